@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Массовая загрузка истории: DataDB.add_data на каждую строку против BulkLoader
+(CSV в формате Data.as_csv() и бинарная выгрузка HistoryExporter).
+В базе есть индекс по (controller_ip, modbus_id, date_time), чтобы было видно
+отложенное построение индексов. Затем загрузка прерывается ошибкой базы посередине
+и запускается снова - проверяется, что все строки загружены ровно один раз.
+
+    python benchmarks/bench_backfill.py [rows] [sensors] [add_data_rows]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+from bench_poll_cycle import make_config
+from oldsnmpagg.backfill import BulkLoader
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.export import HistoryExporter
+from oldsnmpagg.wrappers import Data
+
+INDEX = 'CREATE INDEX IF NOT EXISTS data_sensor_time ON data (controller_ip, modbus_id, date_time)'
+
+
+class FailingDataDB(object):
+    """DataDB, которая отказывает на fail_after-й транзакции загрузки"""
+
+    def __init__(self, data_db, fail_after):
+        self.data_db = data_db
+        self.fail_after = fail_after
+
+    def __getattr__(self, name):
+        return getattr(self.data_db, name)
+
+    def add_rows(self, lst_rows, spool_position=None):
+        self.fail_after -= 1
+        if self.fail_after < 0:
+            return False
+        return self.data_db.add_rows(lst_rows, spool_position)
+
+
+def new_data_db(workdir, name):
+    data_db = DataDB(os.path.join(workdir, name))
+    data_db._DataDB__sqlite.execute(INDEX)
+    return data_db
+
+
+def count_rows(data_db):
+    return data_db._DataDB__sqlite.execute('SELECT COUNT(*), COUNT(DISTINCT date_time) FROM data').fetchone()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sensors_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    add_data_rows = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+
+    workdir = tempfile.mkdtemp()
+    controllers = make_config(os.path.join(workdir, 'config.db'), sensors_count, 100, 1)
+    sensors = controllers.get_all_sensors()
+
+    csv_file = os.path.join(workdir, 'history.csv')
+    start = datetime.datetime(2024, 1, 1)
+    with open(csv_file, 'w') as f:
+        for i in range(rows):
+            sensor = sensors[i % len(sensors)]
+            f.write(Data(sensor, i * 0.25, start + datetime.timedelta(seconds=i)).as_csv())
+
+    binary_file = os.path.join(workdir, 'history.bin')
+    source = DataDB(os.path.join(workdir, 'source.db'))
+    source.add_rows([(s.controller_ip, s.oid, s.modbus_id, v, t) for s, v, t in (
+        (sensors[i % len(sensors)], i * 0.25, start.timestamp() + i) for i in range(rows)
+    )])
+    with open(binary_file, 'wb') as f:
+        HistoryExporter(source).export(f, sensors, fmt='binary')
+
+    print('rows: {0}, sensors: {1}, csv {2:.1f} MB, binary {3:.1f} MB'.format(
+        rows, len(sensors), os.path.getsize(csv_file) / 1e6, os.path.getsize(binary_file) / 1e6))
+
+    data_db = new_data_db(workdir, 'add_data.db')
+    with open(csv_file) as f:
+        lst_lines = [next(f) for _ in range(min(add_data_rows, rows))]
+    began = time.perf_counter()
+    for line in lst_lines:
+        date_time, controller_ip, modbus_id, value = line.split(', ')
+        sensor = controllers.get_sensor(controller_ip, int(modbus_id))
+        data_db.add_data(Data(sensor, float(value), datetime.datetime.fromisoformat(date_time)))
+    elapsed = time.perf_counter() - began
+    print('{0:<28} {1:>10.0f} rows/s  ({2} rows)'.format('add_data per row', len(lst_lines) / elapsed, len(lst_lines)))
+
+    for name, path in (('BulkLoader csv', csv_file), ('BulkLoader binary', binary_file)):
+        data_db = new_data_db(workdir, '{0}.db'.format(name.replace(' ', '_')))
+        loader = BulkLoader(data_db, controllers)
+        loaded = loader.load(path)
+        print('{0:<28} {1:>10.0f} rows/s  ({2} rows, {3:.1f} s)'.format(
+            name, loader.rows_per_second(), loaded, loader.seconds))
+
+    data_db = new_data_db(workdir, 'resume.db')
+    loaded = BulkLoader(FailingDataDB(data_db, 3), controllers, batch_size=rows // 10).load(csv_file)
+    first = count_rows(data_db)[0]
+    loaded = BulkLoader(data_db, controllers, batch_size=rows // 10).load(csv_file)
+    total, distinct = count_rows(data_db)
+    indexes = data_db._DataDB__sqlite.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = 'data_sensor_time'").fetchone()[0]
+    print('resume: {0} rows before failure, {1} after restart, total {2} ({3} distinct), index rebuilt: {4}'.format(
+        first, loaded, total, distinct, bool(indexes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Память и время загрузки конфигурации: get_all_sensors() на sensors сенсоров
+(per_controller на контроллер), число разных объектов Controller и пик памяти
+(tracemalloc) для списка сенсоров и для rows объектов Data.
+
+    python benchmarks/bench_config_memory.py [sensors] [per_controller] [rows]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_poll_cycle import make_config
+from oldsnmpagg.wrappers import Data
+
+
+def measure(func, repeat=3):
+    """Время (лучшее из repeat) - без трассировки памяти, память - отдельным прогоном под tracemalloc"""
+    lst_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        lst_times.append(time.perf_counter() - start)
+    elapsed = min(lst_times)
+
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def main():
+    sensors_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    per_controller = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+
+    controllers = make_config(os.path.join(tempfile.mkdtemp(), 'config.db'), sensors_count, per_controller, 1)
+
+    lst_sensors, elapsed, size = measure(controllers.get_all_sensors)
+    print('get_all_sensors: {0} sensors, {1} Controller objects, {2:.3f} s, {3:.1f} MB ({4:.0f} bytes/sensor)'.format(
+        len(lst_sensors), len(set(id(sensor.controller) for sensor in lst_sensors)),
+        elapsed, size / 1e6, size / len(lst_sensors)))
+
+    sensor = lst_sensors[0]
+    now = time.time()
+    lst_data, elapsed, size = measure(lambda: [Data(sensor, i * 0.5, now + i, i) for i in range(rows)])
+    print('Data: {0} objects, {1:.3f} s, {2:.1f} MB ({3:.0f} bytes/object)'.format(
+        len(lst_data), elapsed, size / 1e6, size / len(lst_data)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Стоимость времени в Data: get_all_data для одного сенсора с rows строками,
+затем обращение к date_time, as_dict() и date_time_as_unixtimestap() для всех строк.
+Отдельно - разбор ISO 8601 строк: parse_date_time (fromisoformat) против dateutil.
+Берется лучшее из нескольких повторов.
+
+    python benchmarks/bench_data_timestamps.py [rows] [repeat]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import dateutil.parser
+
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.wrappers import Sensor, parse_date_time
+
+
+def best(func, repeat):
+    lst_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        lst_times.append(time.perf_counter() - start)
+    return min(lst_times)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    data_db = DataDB(os.path.join(tempfile.mkdtemp(), 'data.db'))
+    sensor = Sensor(controller_ip='10.0.0.1', oid=1, modbus_id=1)
+    now = time.time() - rows
+    data_db.add_rows([('10.0.0.1', 1, 1, i * 0.5, now + i) for i in range(rows)])
+
+    lst_data = data_db.get_all_data(sensor, 1)
+    print('rows: {0}'.format(len(lst_data)))
+    for name, func in (
+        ('get_all_data', lambda: data_db.get_all_data(sensor, 1)),
+        ('date_time of all rows', lambda: [data.date_time for data in data_db.get_all_data(sensor, 1)]),
+        ('as_dict of all rows', lambda: [data.as_dict() for data in data_db.get_all_data(sensor, 1)]),
+        ('unix time of all rows', lambda: [data.date_time_as_unixtimestap() for data in data_db.get_all_data(sensor, 1)]),
+    ):
+        elapsed = best(func, repeat)
+        print('{0:<28} {1:>8.3f} s  {2:>10.0f} rows/s'.format(name, elapsed, rows / elapsed))
+
+    lst_strings = [datetime.datetime.fromtimestamp(now + i).isoformat() for i in range(min(rows, 100000))]
+    for name, parse in (('parse_date_time', parse_date_time), ('dateutil.parser.parse', dateutil.parser.parse)):
+        elapsed = best(lambda: [parse(text) for text in lst_strings], repeat)
+        print('{0:<28} {1:>8.3f} s  {2:>10.0f} strings/s'.format(name, elapsed, len(lst_strings) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
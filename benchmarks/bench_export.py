@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Выгрузка истории: HistoryExporter (CSV / NDJSON / binary, потоком)
+против get_all_data + Data.as_csv() / as_json() для каждой строки.
+Печатает время, строки/с, размер выгрузки и пик выделенной памяти (tracemalloc).
+
+    python benchmarks/bench_export.py [rows] [sensors]
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.export import HistoryExporter
+from oldsnmpagg.wrappers import Sensor
+
+
+class CountingSink(io.RawIOBase):
+    """Считает байты, ничего не храня"""
+
+    def __init__(self):
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.size += len(b)
+        return len(b)
+
+
+def measure(func):
+    """Время - без трассировки памяти, пик памяти - отдельным прогоном под tracemalloc"""
+    start = time.perf_counter()
+    rows, size = func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, size, elapsed, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sensors_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    data_file = os.path.join(tempfile.mkdtemp(), 'data.db')
+    data_db = DataDB(data_file)
+    sensors = [Sensor(controller_ip='10.0.0.1', oid=i + 1, modbus_id=i) for i in range(sensors_count)]
+    now = time.time() - rows
+    lst_rows = [('10.0.0.1', i % sensors_count + 1, i % sensors_count, i * 0.5, now + i) for i in range(rows)]
+    connection = data_db._DataDB__sqlite
+    connection.executemany(
+        'INSERT INTO data (controller_ip, oid, modbus_id, value, date_time) VALUES (?, ?, ?, ?, ?)', lst_rows
+    )
+    connection.commit()
+    del lst_rows
+
+    exporter = HistoryExporter(data_db)
+
+    def old(method):
+        def run():
+            sink = CountingSink()
+            n = 0
+            for sensor in sensors:
+                lst_data = data_db.get_all_data(sensor, 1)
+                for data in lst_data:
+                    sink.write(getattr(data, method)().encode('utf-8'))
+                n += len(lst_data)
+            return n, sink.size
+        return run
+
+    def new(fmt, aggregate=None):
+        def run():
+            sink = CountingSink()
+            return exporter.export(sink, sensors, fmt=fmt, aggregate=aggregate), sink.size
+        return run
+
+    print('rows: {0}, sensors: {1}'.format(rows, sensors_count))
+    for name, func in (
+            ('Data.as_csv', old('as_csv')),
+            ('Data.as_json', old('as_json')),
+            ('export csv', new('csv')),
+            ('export ndjson', new('ndjson')),
+            ('export binary', new('binary')),
+            ('export csv, 60 s avg', new('csv', 60)),
+    ):
+        n, size, elapsed, peak = measure(func)
+        print('{0:<22}{1:>9} rows {2:>7.2f} s {3:>10.0f} rows/s {4:>8.1f} MB out {5:>8.1f} MB peak'.format(
+            name, n, elapsed, n / elapsed, size / 1e6, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
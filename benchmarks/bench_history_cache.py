@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Автообновляемый дашборд: panels графиков DataDB.get_data с одним и тем же диапазоном,
+между обновлениями опрос дописывает по отсчету на сенсор. Без кеша против DataDB(cache_bytes=...):
+- открытый диапазон (to_date = now() при каждом обновлении) - запись попадает в диапазон,
+  дочитываются новые строки;
+- закрытый диапазон в прошлом - отдается из кеша без запросов;
+- запись из другого соединения (другой процесс) - через PRAGMA data_version.
+Каждый результат сверяется с DataDB без кеша.
+
+    python benchmarks/bench_history_cache.py [sensors] [rows_per_sensor] [panels] [refreshes]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.wrappers import Sensor
+
+CACHE_BYTES = 256 * 1024 * 1024
+
+
+def make_sensor(i):
+    sensor = Sensor()
+    sensor.controller_ip = '10.0.{0}.{1}'.format(i // 250, i % 250 + 1)
+    sensor.modbus_id = i % 100
+    sensor.oid = i
+    return sensor
+
+
+def fill(data_db, lst_sensors, rows_per_sensor, start):
+    lst_rows = []
+    for n in range(rows_per_sensor):
+        for sensor in lst_sensors:
+            lst_rows.append((sensor.controller_ip, sensor.oid, sensor.modbus_id, n % 1000, start + n * 10))
+        if len(lst_rows) >= 100000:
+            data_db.add_rows(lst_rows)
+            lst_rows = []
+    data_db.add_rows(lst_rows)
+
+
+def as_tuples(lst_data):
+    return [(data.id, data.value, data.date_time_as_unixtimestap()) for data in lst_data]
+
+
+def main():
+    sensors_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rows_per_sensor = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    panels = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    refreshes = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+    data_file = os.path.join(tempfile.mkdtemp(), 'data.db')
+    lst_sensors = [make_sensor(i) for i in range(sensors_count)]
+    start = time.time() - rows_per_sensor * 10
+    writer = DataDB(data_file)
+    fill(writer, lst_sensors, rows_per_sensor, start)
+    print('rows: {0}, dashboard: {1} panels, {2} refreshes'.format(sensors_count * rows_per_sensor, panels, refreshes))
+
+    plain = DataDB(data_file)
+    cached = DataDB(data_file, cache_bytes=CACHE_BYTES)
+    lst_panels = lst_sensors[:panels]
+    middle = datetime.datetime.fromtimestamp(start + rows_per_sensor * 5)
+    closed_range = (datetime.datetime.fromtimestamp(start), middle)
+
+    def open_range():
+        return middle, datetime.datetime.now()  # как у дашборда: конец диапазона - момент обновления
+
+    def write_tick(data_db, tick):
+        data_db.add_rows([(sensor.controller_ip, sensor.oid, sensor.modbus_id, tick, time.time())
+                          for sensor in lst_sensors])
+
+    for name, get_range, local_writes in (
+        ('open range, same-process writes', open_range, True),
+        ('open range, other-process writes', open_range, False),
+        ('closed range', closed_range, True),
+    ):
+        plain_time = 0
+        cached_time = 0
+        misses = cached.history_cache.misses
+        for tick in range(refreshes):
+            write_tick(cached if local_writes else writer, tick)
+            date_range = get_range() if callable(get_range) else get_range
+            t0 = time.perf_counter()
+            expected = [plain.get_data(sensor, date_range[0], date_range[1], 1) for sensor in lst_panels]
+            t1 = time.perf_counter()
+            result = [cached.get_data(sensor, date_range[0], date_range[1], 1) for sensor in lst_panels]
+            t2 = time.perf_counter()
+            assert list(map(as_tuples, result)) == list(map(as_tuples, expected)), \
+                'cached result differs on {0}, tick {1}'.format(name, tick)
+            plain_time += t1 - t0
+            if tick > 0:  # первое обновление заполняет кеш
+                cached_time += t2 - t1
+        print('{0:<34} no cache {1:>8.2f} ms/refresh   cache {2:>8.2f} ms/refresh   misses {3}'.format(
+            name, plain_time / refreshes * 1000, cached_time / (refreshes - 1) * 1000,
+            cached.history_cache.misses - misses))
+
+    cached.delete_data_older_than(0)
+    cached.commit()
+    assert as_tuples(cached.get_data(lst_panels[0], *closed_range, 1)) == []
+    print('after retention: {0}'.format(cached.history_cache.stats()))
+
+    small = DataDB(data_file, cache_bytes=2 * 1024 * 1024)
+    fill(writer, lst_sensors, rows_per_sensor // 10, time.time())
+    for sensor in lst_sensors:
+        small.get_data(sensor, *open_range(), 10)
+    print('2 MB cache, {0} sensors: {1}'.format(sensors_count, small.history_cache.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Накладные расходы логирования на один отсчет: ModBusBridge.get_value и DataDB.add_data
+с логгером, у которого DEBUG выключен, и с полностью выключенным логированием
+(hotlog.set_enabled(False)). Берется лучшее из нескольких повторов.
+Режим "eager (before)" - как было до HotLogger: сообщение форматируется на каждый вызов
+и отдается logger.debug(), который уже сам проверяет уровень (EagerLogger подставляется
+вместо HotLogger в modbusbridge и datadb). Так "до/после" воспроизводится на одном дереве.
+
+    python benchmarks/bench_hot_logging.py [count] [repeat]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pymodbus.register_read_message import ReadInputRegistersResponse
+
+from oldsnmpagg import datadb, hotlog, modbusbridge
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.hotlog import HotLogger
+from oldsnmpagg.modbusbridge import ModBusBridge
+from oldsnmpagg.wrappers import Data, Sensor
+
+
+class FakeClient(object):
+    """Отвечает сразу, без сети - меряем только работу моста"""
+
+    def read_input_registers(self, address, count=1, unit=1, **kwargs):
+        return ReadInputRegistersResponse([address] * count)
+
+    def close(self):
+        pass
+
+
+class EagerLogger(HotLogger):
+    """Прежнее поведение: format() до проверки уровня, проверка - внутри logging"""
+
+    def debug(self, msg, *args):
+        if self.logger is not None:
+            self.logger.debug(msg.format(*args) if args else msg)
+
+    def info(self, msg, *args):
+        if self.logger is not None:
+            self.logger.info(msg.format(*args) if args else msg)
+
+    def warning(self, msg, *args):
+        if self.logger is not None:
+            self.logger.warning(msg.format(*args) if args else msg)
+
+    def error(self, msg, *args):
+        if self.logger is not None:
+            self.logger.error(msg.format(*args) if args else msg)
+
+
+def use_logger(cls):
+    modbusbridge.HotLogger = cls
+    datadb.HotLogger = cls
+
+
+def bench_reads(logger, count):
+    bridge = ModBusBridge('127.0.0.1', 1, timeout=0.01, logger=logger)
+    bridge.client = FakeClient()
+    sensors = [
+        Sensor(controller_ip='127.0.0.1', modbus_id=i, register_type='input', data_type='real' if i % 2 else 'int')
+        for i in range(100)
+    ]
+
+    start = time.perf_counter()
+    for i in range(count):
+        bridge.get_value(sensors[i % 100])
+    return time.perf_counter() - start
+
+
+def bench_inserts(logger, count):
+    data_db = DataDB(os.path.join(tempfile.mkdtemp(), 'data.db'), logger=logger)
+    sensor = Sensor(controller_ip='127.0.0.1', oid=1, oid_name='s', modbus_id=1, data_type='real')
+    now = time.time()
+
+    start = time.perf_counter()
+    for i in range(count):
+        data_db.add_data(Data(sensor, i * 0.5, now + i), autocommit=False)
+    data_db.commit()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    logger = logging.getLogger('bench_hot_logging')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    logger.setLevel(logging.WARNING)
+
+    print('samples: {0}'.format(count))
+    for mode in ('eager (before)', 'level WARNING', 'logging off'):
+        use_logger(EagerLogger if mode == 'eager (before)' else HotLogger)
+        hotlog.set_enabled(mode != 'logging off')
+        for name, func in (('get_value', bench_reads), ('add_data', bench_inserts)):
+            elapsed = min(func(logger, count) for _ in range(repeat))
+            print('{0:<16}{1:<12}{2:>8.3f} s  {3:>6.2f} us/sample'.format(
+                mode, name, elapsed, elapsed / count * 1e6
+            ))
+    use_logger(HotLogger)
+
+
+if __name__ == '__main__':
+    main()
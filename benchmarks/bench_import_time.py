@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Время импорта модулей пакета (python -X importtime, каждый раз в новом процессе):
+медиана суммарного времени из нескольких запусков и самые долгие импорты по собственному
+времени. Короткоживущие утилиты (CLI, CGI) платят за это на каждый вызов, поэтому:
+- суммарное время модуля не должно превышать бюджет BUDGETS;
+- импорт модуля не должен тянуть тяжелые зависимости (HEAVY) - они грузятся
+  при первом использовании.
+Код возврата 1 - есть регрессия.
+
+    python benchmarks/bench_import_time.py [runs] [top]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# модуль -> бюджет суммарного времени импорта, мс (примерно вдвое выше обычного - шум замеров;
+# загрузка pymodbus/numpy/dateutil добавляет 40-150 мс и в бюджет не помещается)
+BUDGETS = {
+    'oldsnmpagg.utils': 30,
+    'oldsnmpagg.wrappers': 40,
+    'oldsnmpagg.controllers': 50,
+    'oldsnmpagg.datadb': 60,
+    'oldsnmpagg.registry': 50,
+    'oldsnmpagg.export': 70,
+    'oldsnmpagg.backfill': 70,
+    'oldsnmpagg.modbusbridge': 70,
+    'oldsnmpagg.reachability': 70,
+    'oldsnmpagg.alarms': 25,
+    'oldsnmpagg.retention': 60,
+    'oldsnmpagg.poller': 120,
+}
+
+HEAVY = ('pymodbus', 'numpy', 'dateutil', 'snmpagg')
+
+
+def run_python(args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (ROOT, env.get('PYTHONPATH'))))
+    return subprocess.run([sys.executable] + args, env=env, cwd=ROOT, capture_output=True, text=True)
+
+
+def import_time(module):
+    """:return: (суммарное время модуля в мс, {импорт: собственное время в мс})"""
+    result = run_python(['-X', 'importtime', '-c', 'import {0}'.format(module)])
+    if result.returncode != 0:
+        raise RuntimeError('import {0} failed:\n{1}'.format(module, result.stderr[-2000:]))
+    cumulative = None
+    st_self = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        st_self[name] = int(self_us) / 1000
+        if name == module:
+            cumulative = int(cumulative_us) / 1000
+    return cumulative, st_self
+
+
+def loaded_heavy(module):
+    """:return: тяжелые зависимости, оказавшиеся в sys.modules после import module"""
+    result = run_python(['-c', 'import sys, {0}; print(" ".join(n for n in {1!r} if n in sys.modules))'.format(
+        module, HEAVY)])
+    if result.returncode != 0:
+        raise RuntimeError('import {0} failed:\n{1}'.format(module, result.stderr[-2000:]))
+    return result.stdout.split()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    lst_failures = []
+    print('{0:<26} {1:>9} {2:>9}  {3}'.format('module', 'median ms', 'budget', 'slowest imports (self ms)'))
+    for module, budget in BUDGETS.items():
+        lst_cumulative = []
+        st_self = {}
+        for _ in range(runs):
+            cumulative, st_run = import_time(module)
+            lst_cumulative.append(cumulative)
+            for name, ms in st_run.items():
+                st_self.setdefault(name, []).append(ms)
+        median = statistics.median(lst_cumulative)
+        slowest = sorted(((statistics.median(lst_ms), name) for name, lst_ms in st_self.items()), reverse=True)[:top]
+        print('{0:<26} {1:>9.1f} {2:>9}  {3}'.format(
+            module, median, budget, ', '.join('{0} {1:.1f}'.format(name, ms) for ms, name in slowest)
+        ))
+        if median > budget:
+            lst_failures.append('{0}: {1:.1f} ms > {2} ms'.format(module, median, budget))
+
+    for module in BUDGETS:
+        lst_heavy = loaded_heavy(module)
+        if lst_heavy:
+            lst_failures.append('{0} loads {1} at import'.format(module, ', '.join(lst_heavy)))
+
+    if lst_failures:
+        print('\nREGRESSION:\n  ' + '\n  '.join(lst_failures))
+        return 1
+    print('\nOK: all modules within budget, none loads {0} at import'.format(', '.join(HEAVY)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
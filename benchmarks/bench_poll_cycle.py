@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Сквозной бенчмарк цикла опроса на симуляторе Modbus TCP (oldsnmpagg.simulator).
+
+Строит базу Controllers с заданным числом сенсоров, поднимает по симулированному порту
+на контроллер и меряет:
+    - время цикла и число Modbus запросов за цикл (get_value, get_values, get_values с конвейером);
+    - скорость записи в DataDB;
+    - задержку запросов к истории (get_last_data, get_data).
+Результат - JSON (stdout или --output), чтобы регрессии было видно при сравнении прогонов.
+
+    python benchmarks/bench_poll_cycle.py --sensors 10000 --latency 0.001 --output bench.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from oldsnmpagg.controllers import Controllers, DEFAULT_ROOT_OID
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.modbusbridge import ModBusBridge
+from oldsnmpagg.simulator import ModbusSimulator
+from oldsnmpagg.wrappers import Controller, Sensor, Data
+
+# каждый тип регистра - в своем непрерывном диапазоне адресов, как в реальных картах
+SENSOR_LAYOUT = [
+    # register_type, data_type, первый адрес, шаг
+    ('input', 'int', 0, 1),
+    ('input', 'real', 1000, 2),
+    ('holding_reg', 'int', 3000, 1),
+    ('coil', 'int', 4000, 1),
+    ('discrete', 'int', 5000, 1),
+]
+
+
+def make_config(db_file, sensors_count, per_controller, units):
+    """Шаблонный контроллер с per_controller сенсорами, размноженный через copy_controller_to_many"""
+    controllers = Controllers(db_file)
+    controllers.add_controller(Controller(DEFAULT_ROOT_OID, '10.0.0.1', 1, 'c0', 502, 'template'))
+
+    kinds = len(SENSOR_LAYOUT)
+    counters = [0] * kinds
+    for i in range(per_controller):
+        kind = i % kinds
+        register_type, data_type, first, step = SENSOR_LAYOUT[kind]
+        # сенсоры одного типа делятся между unit id непрерывными кусками
+        kind_total = (per_controller - kind + kinds - 1) // kinds
+        unit_id = counters[kind] * units // kind_total + 1
+        modbus_id = first + counters[kind] * step
+        counters[kind] += 1
+        controllers.add_sensor(Sensor(
+            controller_ip='10.0.0.1', oid=i + 1, oid_name='s{0}'.format(i), modbus_id=modbus_id,
+            data_type=data_type, register_type=register_type, unit_id=unit_id
+        ))
+
+    lst_new = []
+    for c in range(1, (sensors_count + per_controller - 1) // per_controller):
+        lst_new.append(('10.0.{0}.{1}'.format(c // 250, c % 250 + 1), c + 1, 'c{0}'.format(c), ''))
+    controllers.copy_controller_to_many('10.0.0.1', lst_new)
+    return controllers
+
+
+def poll_cycle(bridges, sensors_by_ip, mode):
+    values = {}
+    for ip, bridge in bridges.items():
+        sensors = sensors_by_ip[ip]
+        if mode == 'get_value':
+            for sensor in sensors:
+                values[sensor] = bridge.get_value(sensor)
+        else:
+            values.update(bridge.get_values(sensors))
+    return values
+
+
+def bench_polling(simulator, controllers, sensors_by_ip, cycles, window):
+    results = {}
+    for mode, pipeline_window in (('get_value', 0), ('get_values', 0), ('get_values_pipelined', window)):
+        bridges = {}
+        dead = 0
+        for ip, port in simulator.ports.items():
+            bridge = ModBusBridge(simulator.host, port, timeout=1, pipeline_window=pipeline_window)
+            if not bridge.connect_state:
+                dead += 1
+                continue
+            bridges[ip] = bridge
+
+        times = []
+        requests = []
+        errors = 0
+        values = {}
+        for _ in range(cycles):
+            simulator.reset_counters()
+            start = time.perf_counter()
+            values = poll_cycle(bridges, sensors_by_ip, mode)
+            times.append(time.perf_counter() - start)
+            requests.append(simulator.request_count())
+            errors += sum(1 for value in values.values() if value is None)
+
+        for bridge in bridges.values():
+            bridge.close()
+
+        results[mode] = {
+            'cycle_time_s': min(times),
+            'cycle_time_avg_s': sum(times) / len(times),
+            'modbus_requests_per_cycle': max(requests),
+            'sensors_polled': len(values),
+            'read_errors': errors,
+            'dead_controllers': dead,
+        }
+
+    return results, values
+
+
+def bench_datadb(data_file, values, cycles):
+    data_db = DataDB(data_file)
+    now = time.time()
+    rows = 0
+    start = time.perf_counter()
+    for cycle in range(cycles):
+        for sensor, value in values.items():
+            if value is None:
+                continue
+            data_db.add_data(Data(sensor, value, now + cycle), autocommit=False)
+            rows += 1
+        data_db.commit()
+    elapsed = time.perf_counter() - start
+
+    sensors = [sensor for sensor, value in values.items() if value is not None][:100]
+    from_date = datetime.datetime.fromtimestamp(now - 1)
+    to_date = datetime.datetime.fromtimestamp(now + cycles)
+
+    start = time.perf_counter()
+    for sensor in sensors:
+        data_db.get_last_data(sensor)
+    last_latency = (time.perf_counter() - start) / max(len(sensors), 1)
+
+    start = time.perf_counter()
+    for sensor in sensors:
+        data_db.get_data(sensor, from_date, to_date, 1)
+    range_latency = (time.perf_counter() - start) / max(len(sensors), 1)
+
+    return {
+        'insert_rows': rows,
+        'insert_rows_per_s': rows / elapsed if elapsed > 0 else None,
+        'get_last_data_latency_ms': last_latency * 1000,
+        'get_data_latency_ms': range_latency * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=10000)
+    parser.add_argument('--per-controller', type=int, default=100)
+    parser.add_argument('--units', type=int, default=1, help='unit ids behind each gateway')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--dead', type=int, default=0, help='number of controllers with dead ports')
+    parser.add_argument('--window', type=int, default=8, help='pipeline window')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    controllers = make_config(os.path.join(workdir, 'config.db'), args.sensors, args.per_controller, args.units)
+    config_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sensors = controllers.get_all_sensors()
+    load_time = time.perf_counter() - start
+
+    sensors_by_ip = {}
+    for sensor in sensors:
+        sensors_by_ip.setdefault(sensor.controller_ip, []).append(sensor)
+
+    dead_ips = sorted(sensors_by_ip)[:args.dead]
+    simulator = ModbusSimulator.from_controllers(
+        controllers, dead_ips=dead_ips, seed=1,
+        latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate
+    ).start()
+
+    try:
+        polling, values = bench_polling(simulator, controllers, sensors_by_ip, args.cycles, args.window)
+    finally:
+        simulator.stop()
+
+    results = {
+        'params': vars(args),
+        'config': {
+            'sensors': len(sensors),
+            'controllers': len(sensors_by_ip),
+            'build_time_s': config_time,
+            'get_all_sensors_s': load_time,
+        },
+        'polling': polling,
+        'datadb': bench_datadb(os.path.join(workdir, 'data.db'), values, args.cycles),
+    }
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Проверка доступности парка контроллеров: Controller.connection_is_ok по очереди
+против ReachabilityCache.check (все сразу, одно окно timeout) и повторной проверки
+из кеша. Контроллеры на loopback-адресах 127.x.y.z:
+up - слушающий сокет, refused - порт закрыт, stalled - очередь accept заполнена
+(SYN отбрасываются, как у зависшего контроллера или недоступной площадки).
+
+    python benchmarks/bench_reachability.py [up] [refused] [stalled]
+"""
+
+import socket
+import sys
+import time
+
+from oldsnmpagg.metrics import MetricsRegistry
+from oldsnmpagg.reachability import ReachabilityCache
+from oldsnmpagg.wrappers import Controller
+
+PORT = 15020
+
+
+def make_fleet(up, refused, stalled):
+    lst_controllers = []
+    lst_sockets = []
+    for kind, count in ((1, up), (2, refused), (3, stalled)):
+        for i in range(count):
+            ip = '127.{0}.{1}.{2}'.format(kind, i // 250, i % 250 + 1)
+            if kind != 2:
+                server = socket.socket()
+                server.bind((ip, PORT))
+                server.listen(0 if kind == 3 else 128)
+                lst_sockets.append(server)
+                if kind == 3:
+                    filler = socket.create_connection((ip, PORT))  # занимает единственное место в очереди
+                    lst_sockets.append(filler)
+            lst_controllers.append(Controller('', ip, i, 'c{0}'.format(i), PORT, ''))
+    return lst_controllers, lst_sockets
+
+
+def main():
+    up = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    refused = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    stalled = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    lst_controllers, lst_sockets = make_fleet(up, refused, stalled)
+    print('controllers: {0} up, {1} refused, {2} stalled'.format(up, refused, stalled))
+
+    start = time.perf_counter()
+    sequential = sum(1 for controller in lst_controllers if controller.connection_is_ok())
+    print('{0:<32} {1:>8.3f} s  ({2} up)'.format('connection_is_ok one by one', time.perf_counter() - start, sequential))
+
+    cache = ReachabilityCache(timeout=1, ttl=30, metrics=MetricsRegistry())
+    start = time.perf_counter()
+    result = cache.check(lst_controllers)
+    print('{0:<32} {1:>8.3f} s  ({2} up)'.format('ReachabilityCache.check', time.perf_counter() - start,
+                                                 sum(result.values())))
+
+    start = time.perf_counter()
+    cache.check(lst_controllers)
+    print('{0:<32} {1:>8.3f} s  (from cache)'.format('ReachabilityCache.check again', time.perf_counter() - start))
+
+    stats = cache.stats()
+    print('up {0}, down {1}, connect latency: {2}'.format(stats['up'], stats['down'], ', '.join(
+        '{0} {1:.0f} us'.format(name, stats['latency'][name] * 1e6) for name in ('min', 'p50', 'p95', 'max'))))
+
+    for server in lst_sockets[:5]:
+        server.close()
+    cache.check(lst_controllers, force=True)
+    print('after 5 controllers went down: {0} transitions'.format(len(cache.pop_transitions())))
+
+    for sock in lst_sockets:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
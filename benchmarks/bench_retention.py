@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Удаление истории: один DELETE delete_data_older_than против RetentionJob (правила по сенсорам
+и типам регистров, пачки по индексу, отметки). Кроме общего времени - самая долгая транзакция
+удаления: столько опрос ждет возможности записать (у delete_data_older_than - весь DELETE).
+Второй запуск - на сутки позже: RetentionJob удаляет только вновь устаревшее.
+
+    python benchmarks/bench_retention.py [sensors] [days] [rows_per_day] [batch_size]
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench_poll_cycle import make_config
+from oldsnmpagg.datadb import DataDB, DEFAULT_DELETE_BATCH
+from oldsnmpagg.metrics import MetricsRegistry
+from oldsnmpagg.retention import RetentionJob, DAY, index_rules, retention_days
+from oldsnmpagg.wrappers import RetentionRule
+
+GLOBAL_DAYS = 30
+RULES = [
+    RetentionRule(days=GLOBAL_DAYS),                          # общее
+    RetentionRule(register_type='input', days=7),             # шумные аналоговые каналы
+    RetentionRule(register_type='discrete', days=730),        # аварии
+    RetentionRule('10.0.0.1', 0, days=None),                  # один сенсор - всегда
+]
+
+
+def fill(data_file, lst_sensors, days, rows_per_day, now):
+    data_db = DataDB(data_file)
+    step = DAY / rows_per_day
+    lst_rows = []
+    for n in range(int(days * rows_per_day)):
+        date_time = now - days * DAY + n * step
+        for sensor in lst_sensors:
+            lst_rows.append((sensor.controller_ip, sensor.oid, sensor.modbus_id, n % 100, date_time))
+        if len(lst_rows) >= 100000:
+            data_db.add_rows(lst_rows)
+            lst_rows = []
+    data_db.add_rows(lst_rows)
+
+
+def expected_rows(data_file, lst_sensors, st_rules, now):
+    """Строк, которые должны остаться после удаления по правилам"""
+    connection = sqlite3.connect(data_file)
+    expected = 0
+    for sensor in lst_sensors:
+        days = retention_days(st_rules, sensor)
+        before = float('-inf') if days is None else now - days * DAY
+        expected += connection.execute(
+            'SELECT COUNT(*) FROM data WHERE controller_ip = ? AND modbus_id = ? AND date_time > ?',
+            (sensor.controller_ip, sensor.modbus_id, before)
+        ).fetchone()[0]
+    connection.close()
+    return expected
+
+
+def count_rows(data_file, ip='192.168.0.1'):
+    connection = sqlite3.connect(data_file)
+    count = connection.execute('SELECT COUNT(*) FROM data WHERE controller_ip != ?', (ip,)).fetchone()[0]
+    connection.close()
+    return count
+
+
+def report(name, elapsed, deleted, longest):
+    print('{0:<36} {1:>8.2f} s  {2:>9} rows  longest write transaction {3:>8.1f} ms'.format(
+        name, elapsed, deleted, longest * 1000))
+
+
+def main():
+    sensors_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    rows_per_day = int(sys.argv[3]) if len(sys.argv) > 3 else 24
+    batch_size = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_DELETE_BATCH
+
+    workdir = tempfile.mkdtemp()
+    db_file = os.path.join(workdir, 'config.db')
+    controllers = make_config(db_file, sensors_count, 100, 1)
+    for rule in RULES:
+        controllers.set_retention_rule(rule)
+    lst_sensors = controllers.get_all_sensors()
+    st_rules = index_rules(controllers.get_retention_rules())
+    del controllers
+
+    now = time.time()
+    source_file = os.path.join(workdir, 'source.db')
+    fill(source_file, lst_sensors, days, rows_per_day, now)
+    total = count_rows(source_file)
+    print('sensors: {0}, rows: {1} ({2} days)'.format(len(lst_sensors), total, days))
+
+    global_file = os.path.join(workdir, 'global.db')
+    shutil.copy(source_file, global_file)
+    global_db = DataDB(global_file)
+    for day, name in ((0, 'delete_data_older_than, first run'), (1, 'delete_data_older_than, next day')):
+        before_count = count_rows(global_file)
+        start = time.perf_counter()
+        global_db.delete_data_older_than(GLOBAL_DAYS - day)
+        global_db.commit()
+        elapsed = time.perf_counter() - start
+        report(name, elapsed, before_count - count_rows(global_file), elapsed)
+
+    job_file = os.path.join(workdir, 'job.db')
+    shutil.copy(source_file, job_file)
+    start = time.perf_counter()
+    DataDB(job_file).create_sensor_index()
+    elapsed = time.perf_counter() - start
+    report('create_sensor_index (once)', elapsed, 0, elapsed)
+
+    metrics = MetricsRegistry()
+    batch_time = metrics.histogram('retention_batch_seconds')
+    job = RetentionJob(db_file, job_file, batch_size=batch_size, metrics=metrics)
+    expected = expected_rows(job_file, lst_sensors, st_rules, now)
+    for day, name in ((0, 'RetentionJob, first run'), (1, 'RetentionJob, next day'), (1, 'RetentionJob, again')):
+        if day:
+            expected = expected_rows(job_file, lst_sensors, st_rules, now + day * DAY)
+        batch_time.reset()
+        start = time.perf_counter()
+        deleted = job.run_once(now + day * DAY)
+        elapsed = time.perf_counter() - start
+        report(name, elapsed, deleted, batch_time.max)
+        assert count_rows(job_file) == expected, 'rows left {0}, expected {1}'.format(count_rows(job_file), expected)
+    print('rules applied correctly, {0} batches in total'.format(job.batches))
+
+
+if __name__ == '__main__':
+    main()
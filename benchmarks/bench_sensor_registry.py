@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Сортировка, дедупликация и поиск сенсоров на большой конфигурации:
+sorted() сенсоров и контроллеров, set() сенсоров, поиск в SensorRegistry
+против Controllers.get_sensor (SQL) и сравнение двух снимков конфигурации.
+Берется лучшее из нескольких повторов.
+
+    python benchmarks/bench_sensor_registry.py [sensors] [per_controller] [repeat]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench_poll_cycle import make_config
+from oldsnmpagg.registry import SensorRegistry
+from oldsnmpagg.wrappers import Sensor
+
+
+def best(func, repeat):
+    lst_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        lst_times.append(time.perf_counter() - start)
+    return min(lst_times)
+
+
+def main():
+    sensors_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    per_controller = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    controllers = make_config(os.path.join(tempfile.mkdtemp(), 'config.db'), sensors_count, per_controller, 1)
+    lst_sensors = controllers.get_all_sensors()
+    lst_controllers = controllers.get_controllers()
+    random.seed(1)
+    random.shuffle(lst_sensors)
+    random.shuffle(lst_controllers)
+    lst_keys = [(sensor.controller_ip, sensor.modbus_id) for sensor in lst_sensors[:1000]]
+    print('sensors: {0}, controllers: {1}'.format(len(lst_sensors), len(lst_controllers)))
+
+    def report(name, elapsed, count):
+        print('{0:<36} {1:>9.4f} s  {2:>10.2f} us/item'.format(name, elapsed, elapsed / count * 1e6))
+
+    fresh = controllers.get_all_sensors()
+    random.shuffle(fresh)
+    report('sorted(sensors), first time', best(lambda: sorted(fresh), 1), len(fresh))
+    report('sorted(sensors)', best(lambda: sorted(lst_sensors), repeat), len(lst_sensors))
+    report('sorted(controllers)', best(lambda: sorted(lst_controllers), repeat), len(lst_controllers))
+    report('sorted(sensors, key=sort_key)', best(lambda: sorted(lst_sensors, key=Sensor.sort_key), repeat),
+           len(lst_sensors))
+    lst_both = lst_sensors + fresh
+    report('set(sensors + copy of config)', best(lambda: set(lst_both), repeat), len(lst_both))
+    registry = SensorRegistry(lst_sensors)
+    report('SensorRegistry(sensors)', best(lambda: SensorRegistry(lst_sensors), repeat), len(lst_sensors))
+    report('registry.get', best(lambda: [registry.get(*key) for key in lst_keys], repeat), len(lst_keys))
+    report('Controllers.get_sensor', best(lambda: [controllers.get_sensor(*key) for key in lst_keys], 1), len(lst_keys))
+
+    new_sensors = controllers.get_all_sensors()
+    for sensor in new_sensors[:100]:
+        sensor.description = 'changed'
+    new_registry = SensorRegistry(new_sensors[50:])
+    elapsed = best(lambda: registry.diff(new_registry), repeat)
+    added, removed, changed = registry.diff(new_registry)
+    report('diff of two snapshots', elapsed, len(lst_sensors))
+    print('diff: {0} added, {1} removed, {2} changed'.format(len(added), len(removed), len(changed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Пропускная способность ShardedPoller в зависимости от числа рабочих процессов.
+
+Симулятор (oldsnmpagg.simulator) поднимается в отдельных процессах, чтобы не делить
+GIL с супервизором. Опрос идет без пауз (interval=0), меряется число значений,
+записанных в DataDB за --duration секунд. Дополнительно считается, какая доля
+контроллеров переезжает при добавлении одного процесса.
+
+    python benchmarks/bench_sharded_poller.py --sensors 20000 --workers 1 2 4 --duration 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from bench_poll_cycle import make_config
+from oldsnmpagg.poller import HashRing, ShardedPoller
+from oldsnmpagg.simulator import ModbusSimulator
+
+
+def run_simulator(devices, latency, stop):
+    simulator = ModbusSimulator(latency=latency)
+    simulator.devices = devices
+    simulator.start()
+    stop.wait()
+    simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=20000)
+    parser.add_argument('--per-controller', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--simulators', type=int, default=2, help='simulator processes')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_file = os.path.join(workdir, 'config.db')
+    controllers = make_config(db_file, args.sensors, args.per_controller, 1)
+    lst_ips = [controller.ip_address for controller in controllers.get_controllers()]
+
+    simulator = ModbusSimulator.from_controllers(controllers, seed=1)
+    address_map = {ip: (simulator.host, port) for ip, port in simulator.ports.items()}
+    ports = sorted(simulator.devices)
+
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    lst_processes = []
+    for i in range(args.simulators):
+        devices = {port: simulator.devices[port] for port in ports[i::args.simulators]}
+        process = context.Process(target=run_simulator, args=(devices, args.latency, stop), daemon=True)
+        process.start()
+        lst_processes.append(process)
+    time.sleep(1)
+
+    print('cpus: {0}, controllers: {1}, sensors: {2}'.format(
+        multiprocessing.cpu_count(), len(lst_ips), args.sensors))
+    try:
+        for workers in args.workers:
+            data_file = os.path.join(workdir, 'data_{0}.db'.format(workers))
+            poller = ShardedPoller(db_file, data_file, workers=workers, interval=0, address_map=address_map).start()
+            time.sleep(1)  # запуск процессов (spawn) не входит в замер
+            polled = poller.polled
+            start = time.perf_counter()
+            time.sleep(args.duration)
+            rate = (poller.polled - polled) / (time.perf_counter() - start)
+            poller.stop()
+            print('workers {0:>3}: {1:>10.0f} samples/s'.format(workers, rate))
+    finally:
+        stop.set()
+        for process in lst_processes:
+            process.join()
+
+    for workers in args.workers:
+        before = HashRing(range(workers)).assign(lst_ips)
+        after = HashRing(range(workers + 1)).assign(lst_ips)
+        owner = {ip: node for node, lst in before.items() for ip in lst}
+        moved = sum(1 for node, lst in after.items() for ip in lst if owner[ip] != node)
+        print('{0} -> {1} workers: {2:.1%} controllers moved (ideal {3:.1%})'.format(
+            workers, workers + 1, moved / len(lst_ips), 1 / (workers + 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Чтение текущего значения сенсора: SharedValueTable (из другого процесса)
+против DataDB.get_last_data и Controllers.get_sensor (sensors.value).
+Другой процесс (spawn) читает таблицу, пока этот процесс в нее пишет.
+
+    python benchmarks/bench_shm_table.py [sensors] [seconds]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from oldsnmpagg.controllers import Controllers, DEFAULT_ROOT_OID
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.shmtable import SharedValueTable
+from oldsnmpagg.wrappers import Controller, Sensor, Data
+
+TABLE_NAME = 'bench_shm_table'
+
+
+def reader(keys, seconds, results):
+    table = SharedValueTable.attach(TABLE_NAME)
+    reads = 0
+    misses = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for ip, modbus_id in keys:
+            if table.get(ip, modbus_id) is None:
+                misses += 1
+        reads += len(keys)
+    results.put((reads, misses, time.perf_counter() - start))
+    table.close()
+
+
+def per_call(func, lst_args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in lst_args:
+            func(*args)
+        elapsed = (time.perf_counter() - start) / len(lst_args)
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    workdir = tempfile.mkdtemp()
+    controllers = Controllers(os.path.join(workdir, 'config.db'))
+    controllers.add_controller(Controller(DEFAULT_ROOT_OID, '10.0.0.1', 1, 'c', 502, ''))
+    sensors = [
+        Sensor(controller_ip='10.0.0.1', oid=i + 1, oid_name='s{0}'.format(i), modbus_id=i, data_type='real')
+        for i in range(count)
+    ]
+    data_db = DataDB(os.path.join(workdir, 'data.db'))
+    now = time.time()
+    for sensor in sensors:
+        controllers.add_sensor(sensor)
+        for i in range(10):
+            data_db.add_data(Data(sensor, float(i), now + i), autocommit=False)
+    data_db.commit()
+
+    table = SharedValueTable.create(TABLE_NAME, sensors)
+    keys = [(sensor.controller_ip, sensor.modbus_id) for sensor in sensors]
+    for ip, modbus_id in keys:
+        table.set(ip, modbus_id, 1.0)
+
+    print('sensors: {0}'.format(count))
+    print('{0:<34}{1:>8.2f} us'.format('Controllers.get_sensor', per_call(controllers.get_sensor, keys)))
+    print('{0:<34}{1:>8.2f} us'.format('DataDB.get_last_data', per_call(data_db.get_last_data, [(s,) for s in sensors])))
+    print('{0:<34}{1:>8.2f} us'.format('SharedValueTable.get', per_call(table.get, keys)))
+    print('{0:<34}{1:>8.2f} us'.format('SharedValueTable.set', per_call(table.set, [k + (2.0,) for k in keys])))
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=reader, args=(keys, seconds, results))
+    process.start()
+    writes = 0
+    while process.is_alive() and results.empty():
+        for ip, modbus_id in keys:
+            table.set(ip, modbus_id, float(writes))
+        writes += len(keys)
+    reads, misses, elapsed = results.get()
+    process.join()
+    print('{0:<34}{1:>8.2f} us  ({2} writes concurrently, {3} failed reads)'.format(
+        'SharedValueTable.get, other proc', elapsed / reads * 1e6, writes, misses))
+
+    table.close()
+    table.unlink()
+
+
+if __name__ == '__main__':
+    main()
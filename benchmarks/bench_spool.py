@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Запись истории в DataDB со спулом при отказе базы.
+
+Три фазы по count отсчетов: база работает, база отказывает (каждый запрос получает
+ошибку - эмуляция через sqlite3 authorizer), база снова работает (спул переносится).
+Печатает скорость записи в каждой фазе и проверяет, что в базе ровно все отсчеты.
+
+    python benchmarks/bench_spool.py [count] [batch]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from oldsnmpagg import datadb
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.spool import Spool
+from oldsnmpagg.wrappers import Data, Sensor
+
+
+class FaultySqlite(object):
+    """sqlite3 для DataDB, в котором можно 'выключить' базу"""
+    outage = False
+
+    def __init__(self):
+        self.lst_connections = []
+
+    def __getattr__(self, name):
+        return getattr(sqlite3, name)
+
+    @staticmethod
+    def authorizer(*args):
+        return sqlite3.SQLITE_DENY if FaultySqlite.outage else sqlite3.SQLITE_OK
+
+    def connect(self, *args, **kwargs):
+        connection = sqlite3.connect(*args, **kwargs)
+        connection.set_authorizer(self.authorizer)
+        return connection
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    datadb.sqlite3 = FaultySqlite()
+    workdir = tempfile.mkdtemp()
+    data_file = os.path.join(workdir, 'data.db')
+    spool = Spool(os.path.join(workdir, 'data.spool'))
+    data_db = DataDB(data_file, spool=spool, retry_interval=0.5)
+
+    sensors = [Sensor(controller_ip='10.0.0.1', oid=i + 1, modbus_id=i) for i in range(100)]
+    now = time.time()
+    n = 0
+    for phase in ('db up', 'db down', 'db up again'):
+        FaultySqlite.outage = phase == 'db down'
+        start = time.perf_counter()
+        for i in range(count):
+            data_db.add_data(Data(sensors[n % 100], float(n), now + n * 0.001), autocommit=False)
+            n += 1
+            if n % batch == 0:
+                data_db.commit()
+        data_db.commit()
+        elapsed = time.perf_counter() - start
+        print('{0:<12}{1:>10.0f} samples/s   spool {2:>10} bytes'.format(phase, count / elapsed, spool.size()))
+
+    # последний перенос спула - после retry_interval
+    time.sleep(0.6)
+    data_db.add_data(Data(sensors[0], 0.0, now), autocommit=True)
+    n += 1
+
+    rows, distinct = sqlite3.connect(data_file).execute(
+        'SELECT COUNT(*), COUNT(DISTINCT date_time) FROM data').fetchone()
+    print('samples {0}, rows {1}, distinct {2}, spool {3} bytes'.format(n, rows, distinct, spool.size()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Время записи колонки sensors.value для всех сенсоров за один цикл опроса:
+update_sensor_value (по одному сенсору) против update_sensor_values (пачкой).
+
+    python benchmarks/bench_update_sensor_values.py [sensors] [sensors_per_controller]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from oldsnmpagg.controllers import Controllers, DEFAULT_ROOT_OID
+from oldsnmpagg.wrappers import Controller, Sensor
+
+
+def make_db(db_file, sensors_count, per_controller):
+    controllers = Controllers(db_file)
+    for c in range((sensors_count + per_controller - 1) // per_controller):
+        ip = '10.0.{0}.{1}'.format(c // 250, c % 250 + 1)
+        controllers.add_controller(Controller(DEFAULT_ROOT_OID, ip, c + 1, 'c{0}'.format(c), 502, ''))
+        for i in range(min(per_controller, sensors_count - c * per_controller)):
+            controllers.add_sensor(Sensor(
+                controller_ip=ip, oid=i + 1, oid_name='s{0}'.format(i), modbus_id=i + 1, data_type='int'
+            ))
+    return controllers
+
+
+def main():
+    sensors_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    per_controller = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    db_file = os.path.join(tempfile.mkdtemp(), 'config.db')
+    controllers = make_db(db_file, sensors_count, per_controller)
+    sensors = controllers.get_all_sensors()
+
+    start = time.perf_counter()
+    for sensor in sensors:
+        controllers.update_sensor_value(sensor, 1)
+    one_by_one = time.perf_counter() - start
+
+    cycles = [
+        ('batch, all changed', {(s.controller_ip, s.modbus_id): 2 for s in sensors}),
+        ('batch, nothing changed', {(s.controller_ip, s.modbus_id): 2 for s in sensors}),
+        ('batch, 10% changed', {(s.controller_ip, s.modbus_id): 3 if i % 10 == 0 else 2 for i, s in enumerate(sensors)}),
+    ]
+
+    print('sensors: {0}'.format(len(sensors)))
+    print('{0:<28}{1:>10.3f} s'.format('update_sensor_value', one_by_one))
+    for name, st_values in cycles:
+        start = time.perf_counter()
+        updated = controllers.update_sensor_values(st_values)
+        elapsed = time.perf_counter() - start
+        print('{0:<28}{1:>10.3f} s  (updated: {2})'.format(name, elapsed, updated))
+
+
+if __name__ == '__main__':
+    main()
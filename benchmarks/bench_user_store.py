@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Вход пользователя и проверка группы при всплеске логинов в веб-интерфейсе:
+get_users + verify_login и get_groups на каждый запрос (как сейчас) против UserStore.
+Плюс время добавления пользователя (user_add_or_modify) обоими способами.
+
+    python benchmarks/bench_user_store.py [users] [groups] [logins]
+"""
+
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+from oldsnmpagg import utils
+from oldsnmpagg.utils import UserStore
+
+
+def make_files(workdir, users_count, groups_count):
+    users_file = os.path.join(workdir, 'users')
+    groups_file = os.path.join(workdir, 'groups')
+    with open(users_file, 'w') as f:
+        for i in range(users_count):
+            f.write('user{0}:{1}\n'.format(i, hashlib.md5('pass{0}'.format(i).encode('utf-8')).hexdigest()))
+    with open(groups_file, 'w') as f:
+        for g in range(groups_count):
+            f.write('group{0}: {1}\n'.format(g, ', '.join('user{0}'.format(i) for i in range(g, users_count, groups_count))))
+    return users_file, groups_file
+
+
+def main():
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    groups_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    logins = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    users_file, groups_file = make_files(tempfile.mkdtemp(), users_count, groups_count)
+    random.seed(1)
+    lst_logins = [random.randrange(users_count) for _ in range(logins)]
+
+    def old_login(i):
+        _, users = utils.get_users(users_file)
+        ok = utils.verify_login('user{0}'.format(i), 'pass{0}'.format(i), users)
+        groups = utils.get_groups(groups_file)
+        return ok and 'user{0}'.format(i) in groups['group{0}'.format(i % groups_count)]
+
+    store = UserStore(users_file, groups_file)
+
+    def new_login(i):
+        ok = store.verify_login('user{0}'.format(i), 'pass{0}'.format(i))
+        return ok and store.in_group('user{0}'.format(i), 'group{0}'.format(i % groups_count))
+
+    print('users: {0}, groups: {1}, logins: {2}'.format(users_count, groups_count, logins))
+    for name, login in (('get_users + verify_login', old_login), ('UserStore', new_login)):
+        start = time.perf_counter()
+        assert all(login(i) for i in lst_logins)
+        elapsed = time.perf_counter() - start
+        print('{0:<28} {1:>8.3f} s  {2:>10.1f} us/login'.format(name, elapsed, elapsed / logins * 1e6))
+
+    for name, add in (
+        ('user_add_or_modify', lambda i: utils.user_add_or_modify(users_file, 'new{0}'.format(i), 'x')),
+        ('UserStore.user_add_or_modify', lambda i: store.user_add_or_modify('new{0}'.format(i), 'x')),
+    ):
+        start = time.perf_counter()
+        for i in range(100):
+            add(i)
+        elapsed = time.perf_counter() - start
+        print('{0:<28} {1:>8.3f} s  {2:>10.1f} us/change'.format(name, elapsed, elapsed / 100 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+from array import array
+
+from oldsnmpagg.decoders import load_numpy
+
+STATE_LOW = -1
+STATE_NORMAL = 0
+STATE_HIGH = 1
+
+STATE_NAMES = {
+    STATE_LOW: 'low',
+    STATE_NORMAL: 'normal',
+    STATE_HIGH: 'high'
+}
+
+NAN = float('nan')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+class AlarmEngine(object):
+    """
+    Проверка min_value/max_value сенсоров для целой пачки значений за один проход.
+    Пороги хранятся в непрерывных массивах, индекс в массиве - ключ сенсора
+    (controller_ip, modbus_id). Для каждого сенсора хранится состояние (low/normal/high)
+    и счетчик debounce: состояние меняется только после debounce одинаковых отсчетов подряд.
+    hysteresis - на сколько значение должно вернуться за порог, чтобы выйти из low/high.
+    Если numpy установлен, проверка идет векторно.
+    """
+    logger = None
+
+    def __init__(self, sensors, hysteresis=0.0, debounce=1, logger=None):
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self.logger = logger
+        self.__numpy = load_numpy()
+        self.load(sensors)
+
+    def load(self, sensors):
+        """(Пере)загружает пороги. Состояние сенсоров сбрасывается в normal"""
+        self.keys = []
+        self.index = {}
+        low = []
+        high = []
+        for sensor in sensors:
+            if sensor.min_value == '' and sensor.max_value == '':
+                continue
+            key = (sensor.controller_ip, sensor.modbus_id)
+            if key in self.index:
+                continue
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            low.append(_to_float(sensor.min_value) if sensor.min_value != '' else NAN)
+            high.append(_to_float(sensor.max_value) if sensor.max_value != '' else NAN)
+
+        count = len(self.keys)
+        numpy = self.__numpy
+        if numpy is not None:
+            self.low = numpy.array(low, dtype=numpy.float64)
+            self.high = numpy.array(high, dtype=numpy.float64)
+            self.state = numpy.zeros(count, dtype=numpy.int8)
+            self.pending_state = numpy.zeros(count, dtype=numpy.int8)
+            self.pending_count = numpy.zeros(count, dtype=numpy.int32)
+        else:
+            self.low = array('d', low)
+            self.high = array('d', high)
+            self.state = array('b', bytes(count))
+            self.pending_state = array('b', bytes(count))
+            self.pending_count = array('l', [0] * count)
+
+        self.__debug('AlarmEngine: loaded {0} sensors with thresholds'.format(count))
+
+    def get_state(self, controller_ip, modbus_id):
+        try:
+            return int(self.state[self.index[(controller_ip, modbus_id)]])
+        except KeyError:
+            return None
+
+    def evaluate(self, st_values):
+        """
+        Проверяет пачку значений
+        :param st_values: {(controller_ip, modbus_id): value, ...}
+        :return: только переходы: [(key, old_state, new_state, value), ...]
+        """
+        lst_idx = []
+        lst_values = []
+        index = self.index
+        for key, value in st_values.items():
+            i = index.get(key)
+            if i is None:
+                continue
+            value = _to_float(value)
+            if value != value:  # NaN - нечисловое значение или ошибка чтения
+                continue
+            lst_idx.append(i)
+            lst_values.append(value)
+
+        if len(lst_idx) == 0:
+            return []
+
+        if self.__numpy is not None:
+            changed = self.__evaluate_numpy(lst_idx, lst_values)
+        else:
+            changed = self.__evaluate_python(lst_idx, lst_values)
+
+        transitions = []
+        for i, old_state, new_state, value in changed:
+            transitions.append((self.keys[i], old_state, new_state, value))
+            self.__debug('AlarmEngine: {0} {1} -> {2} ({3})'.format(
+                self.keys[i], STATE_NAMES[old_state], STATE_NAMES[new_state], value
+            ))
+
+        return transitions
+
+    def __evaluate_numpy(self, lst_idx, lst_values):
+        numpy = self.__numpy
+        idx = numpy.array(lst_idx, dtype=numpy.intp)
+        values = numpy.array(lst_values, dtype=numpy.float64)
+        low = self.low[idx]
+        high = self.high[idx]
+        state = self.state[idx]
+
+        # в состоянии low/high порог сдвигается на hysteresis в сторону нормы
+        high_limit = numpy.where(state == STATE_HIGH, high - self.hysteresis, high)
+        low_limit = numpy.where(state == STATE_LOW, low + self.hysteresis, low)
+
+        candidate = numpy.full(len(idx), STATE_NORMAL, dtype=numpy.int8)
+        candidate[values > high_limit] = STATE_HIGH
+        candidate[values < low_limit] = STATE_LOW
+
+        differs = candidate != state
+        same_pending = candidate == self.pending_state[idx]
+        count = numpy.where(differs, numpy.where(same_pending, self.pending_count[idx] + 1, 1), 0)
+        self.pending_state[idx] = numpy.where(differs, candidate, state)
+
+        fire = differs & (count >= self.debounce)
+        count[fire] = 0
+        self.pending_count[idx] = count
+        self.state[idx] = numpy.where(fire, candidate, state)
+
+        return [
+            (int(idx[j]), int(state[j]), int(candidate[j]), float(values[j]))
+            for j in numpy.flatnonzero(fire)
+        ]
+
+    def __evaluate_python(self, lst_idx, lst_values):
+        low = self.low
+        high = self.high
+        states = self.state
+        pending_state = self.pending_state
+        pending_count = self.pending_count
+        hysteresis = self.hysteresis
+        debounce = self.debounce
+
+        changed = []
+        for i, value in zip(lst_idx, lst_values):
+            state = states[i]
+            high_limit = high[i] - hysteresis if state == STATE_HIGH else high[i]
+            low_limit = low[i] + hysteresis if state == STATE_LOW else low[i]
+
+            if value < low_limit:
+                candidate = STATE_LOW
+            elif value > high_limit:
+                candidate = STATE_HIGH
+            else:
+                candidate = STATE_NORMAL
+
+            if candidate == state:
+                pending_state[i] = state
+                pending_count[i] = 0
+                continue
+
+            if candidate == pending_state[i]:
+                pending_count[i] += 1
+            else:
+                pending_state[i] = candidate
+                pending_count[i] = 1
+
+            if pending_count[i] >= debounce:
+                states[i] = candidate
+                pending_count[i] = 0
+                changed.append((i, state, candidate, value))
+
+        return changed
+
+    def __debug(self, msg):
+        if self.logger is not None:
+            self.logger.debug(msg)
@@ -0,0 +1,276 @@
+"""
+Массовая загрузка истории в DataDB (перенос площадок, восстановление из выгрузок).
+
+Источники:
+CSV - строки как у Data.as_csv(): date_time (ISO 8601), controller_ip, modbus_id, value;
+binary - выгрузка HistoryExporter (fmt='binary', см. oldsnmpagg.export).
+
+oid берется из конфигурации (Controllers) - один запрос на сенсор, а не на строку;
+строки сенсоров, которых нет в конфигурации, пропускаются.
+На время загрузки DataDB переводится в режим массовой загрузки (begin_bulk_load:
+настройки SQLite, индексы data строятся в конце), строки пишутся транзакциями по
+batch_size. Позиция в файле сохраняется в той же транзакции (как у спула), поэтому
+после прерывания повторный запуск продолжает с места остановки без дублей.
+
+    loader = BulkLoader(DataDB('data.db'), Controllers('config.db', read_only=True))
+    loader.load('history.csv')
+    print(loader.rows, loader.rows_per_second())
+
+    python -m oldsnmpagg.backfill config.db data.db history.csv history.bin
+"""
+
+import datetime
+import hashlib
+import math
+import os
+import time
+
+from oldsnmpagg.export import MAGIC, read_binary_block, read_binary_header
+from oldsnmpagg.hotlog import HotLogger
+
+DEFAULT_BATCH_SIZE = 100000     # строк в одной транзакции
+DEFAULT_REPORT_INTERVAL = 10    # секунд между сообщениями о скорости
+READ_SIZE = 1 << 20             # байт CSV за одно чтение
+FINGERPRINT_SIZE = 1 << 16      # не больше стольких байт начала файла узнаем, что это тот же файл
+
+FORMATS = ('csv', 'binary')
+
+
+def parse_value(text):
+    """Значение из CSV: None, int, float или строка как есть"""
+    if text == 'None':
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def detect_format(path):
+    with open(path, 'rb') as f:
+        return 'binary' if f.read(len(MAGIC)) == MAGIC else 'csv'
+
+
+def fingerprint(path, size=FINGERPRINT_SIZE):
+    """
+    Id содержимого файла для позиции загрузки: '<n>:<md5 первых n байт>', n - не больше size
+    (файл меньше size - весь файл). Сколько байт хешировано, хранится в самом id, поэтому
+    файл проверяется по тем же байтам (same_file) и после дописывания в конец
+    """
+    with open(path, 'rb') as f:
+        head = f.read(size)
+    return '{0}:{1}'.format(len(head), hashlib.md5(head).hexdigest())
+
+
+def same_file(path, generation):
+    """
+    :param generation: fingerprint() прошлой загрузки
+    :return: True - это тот же файл (возможно, дописанный), False - другой (замененный)
+    """
+    try:
+        size = int(generation.split(':', 1)[0])
+    except (AttributeError, ValueError):
+        return False
+    return fingerprint(path, size) == generation
+
+
+class BulkLoader(object):
+
+    def __init__(self, data_db, controllers, batch_size=DEFAULT_BATCH_SIZE, logger=None,
+                 report_interval=DEFAULT_REPORT_INTERVAL):
+        self.data_db = data_db
+        self.controllers = controllers
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.__log = HotLogger(logger)
+
+        self.__oids = {}  # {(controller_ip, modbus_id): oid или None - нет в конфигурации}
+        self.rows = 0     # загружено строк
+        self.skipped = 0  # пропущено строк (нет сенсора, не разбирается)
+        self.seconds = 0.0
+
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __oid(self, controller_ip, modbus_id):
+        key = (controller_ip, modbus_id)
+        try:
+            return self.__oids[key]
+        except KeyError:
+            pass
+        sensor = self.controllers.get_sensor(controller_ip, modbus_id)
+        oid = sensor.oid if sensor is not None else None
+        if oid is None:
+            self.__warning('Sensor {0}:{1} is not configured, its rows are skipped', controller_ip, modbus_id)
+        self.__oids[key] = oid
+        return oid
+
+    def load(self, path, fmt=None):
+        """
+        Загружает файл (с позиции, на которой прервалась прошлая загрузка этого файла)
+        :param fmt: csv, binary или None - по содержимому
+        :return: число загруженных строк или -1 - ошибка базы (позиция сохранена, можно повторить)
+        """
+        if fmt is None:
+            fmt = detect_format(path)
+        if fmt not in FORMATS:
+            raise ValueError('Unknown backfill format: {0}'.format(fmt))
+
+        source = os.path.abspath(path)
+        stored = self.data_db.get_spool_position(source)
+        if stored is None:
+            return -1
+        generation, position = stored
+        if generation is None or not same_file(path, generation) or position > os.path.getsize(path):
+            # новый или замененный файл: загрузка сначала, id - по текущему содержимому
+            generation, position = fingerprint(path), 0
+        if position > 0:
+            self.__info('Resuming {0} from byte {1}', path, position)
+
+        if not self.data_db.begin_bulk_load():
+            return -1
+
+        rows, skipped, seconds = self.rows, self.skipped, self.seconds
+        self.__started = time.perf_counter() - self.seconds
+        self.__reported = self.__started
+        try:
+            read = self.__read_csv if fmt == 'csv' else self.__read_binary
+            lst_batch = []
+            end = position
+            for end, lst_rows in read(path, position):
+                lst_batch.extend(lst_rows)
+                if len(lst_batch) >= self.batch_size:
+                    if not self.__write(lst_batch, (source, generation, end)):
+                        return -1
+                    lst_batch = []
+            if lst_batch or end > position:
+                if not self.__write(lst_batch, (source, generation, end)):
+                    return -1
+        finally:
+            if not self.data_db.end_bulk_load():
+                self.__error('Indexes of {0} are not rebuilt, they will be rebuilt by the next load', path)
+            self.seconds = time.perf_counter() - self.__started
+
+        self.__info('Loaded {0}: {1} rows ({2} skipped) in {3:.1f} s, {4:.0f} rows/s', path,
+                    self.rows - rows, self.skipped - skipped, self.seconds - seconds, self.rows_per_second())
+        return self.rows - rows
+
+    def __write(self, lst_batch, spool_position):
+        if not self.data_db.add_rows(lst_batch, spool_position):
+            return False
+        self.rows += len(lst_batch)
+
+        now = time.perf_counter()
+        if now - self.__reported >= self.report_interval:
+            self.__reported = now
+            self.seconds = now - self.__started
+            self.__info('Loaded {0} rows, {1:.0f} rows/s', self.rows, self.rows_per_second())
+        return True
+
+    def __read_csv(self, path, position):
+        """:return: генератор (позиция после прочитанных строк, [строка для add_rows, ...])"""
+        fromisoformat = datetime.datetime.fromisoformat
+        oid_of = self.__oid
+        with open(path, 'rb') as f:
+            f.seek(position)
+            while True:
+                lst_lines = f.readlines(READ_SIZE)
+                if not lst_lines:
+                    return
+                position += sum(map(len, lst_lines))
+                lst_rows = []
+                for line in lst_lines:
+                    try:
+                        date_time, controller_ip, modbus_id, value = line.decode('utf-8').split(',', 3)
+                        controller_ip = controller_ip.strip()
+                        modbus_id = int(modbus_id)
+                        oid = oid_of(controller_ip, modbus_id)
+                        if oid is None:
+                            self.skipped += 1
+                            continue
+                        lst_rows.append((
+                            controller_ip, oid, modbus_id,
+                            parse_value(value.strip()),
+                            fromisoformat(date_time.strip()).timestamp()
+                        ))
+                    except ValueError:
+                        if line.strip():
+                            self.skipped += 1
+                            self.__debug('Bad backfill line: {0}', line)
+                yield position, lst_rows
+
+    def __read_binary(self, path, position):
+        """
+        :return: генератор (позиция после блока, [строка для add_rows, ...]);
+            NaN (нечисловое значение в выгрузке) загружается как None
+        """
+        isnan = math.isnan
+        with open(path, 'rb') as f:
+            header = read_binary_header(f)
+            lst_sensors = []
+            for controller_ip, modbus_id, _ in header['sensors']:
+                lst_sensors.append((controller_ip, self.__oid(controller_ip, modbus_id), modbus_id))
+            if position > f.tell():
+                f.seek(position)
+
+            while True:
+                lst_columns = read_binary_block(f)
+                if lst_columns is None:
+                    return
+                lst_rows = []
+                for index, date_time, value in zip(*lst_columns):
+                    controller_ip, oid, modbus_id = lst_sensors[index]
+                    if oid is None:
+                        self.skipped += 1
+                        continue
+                    lst_rows.append((controller_ip, oid, modbus_id, None if isnan(value) else value, date_time))
+                yield f.tell(), lst_rows
+
+    # __logging__
+    def __debug(self, msg, *args):
+        self.__log.debug(msg, *args)
+
+    def __error(self, msg, *args):
+        self.__log.error(msg, *args)
+
+    def __warning(self, msg, *args):
+        self.__log.warning(msg, *args)
+
+    def __info(self, msg, *args):
+        self.__log.info(msg, *args)
+
+
+def main():
+    import argparse
+    import logging
+
+    from oldsnmpagg.controllers import Controllers
+    from oldsnmpagg.datadb import DataDB
+
+    parser = argparse.ArgumentParser(description='Bulk load of data history (CSV or binary export)')
+    parser.add_argument('db_file')
+    parser.add_argument('data_file')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--format', choices=FORMATS, default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('backfill')
+    loader = BulkLoader(
+        DataDB(args.data_file, logger=logger), Controllers(args.db_file, logger=logger, read_only=True),
+        batch_size=args.batch_size, logger=logger
+    )
+    for path in args.files:
+        if loader.load(path, args.format) < 0:
+            raise SystemExit('Backfill of {0} failed, run again to resume'.format(path))
+    print('{0} rows ({1} skipped) in {2:.1f} s, {3:.0f} rows/s'.format(
+        loader.rows, loader.skipped, loader.seconds, loader.rows_per_second()))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,11 +6,79 @@
 # Year: 2017
 
 import sqlite3
-from oldsnmpagg.wrappers import Controller, Sensor, Data
+from time import perf_counter
+from oldsnmpagg.wrappers import Controller, Sensor, Data, RetentionRule
+from oldsnmpagg.utils import lower_first_char
+from oldsnmpagg.metrics import REGISTRY
 
 DEFAULT_ROOT_OID = '.1.3.6.1.4.1.49118.121'  # 121 взят с потолка
 SQL_WILDCARD = '%'
 
+# колонки sensors, появившиеся позже; добавляются в конец таблицы, чтобы порядок
+# колонок (и аргументов Sensor) совпадал в новых и старых базах
+SENSORS_NEW_COLUMNS = [
+    ('deadband_abs', "TEXT DEFAULT ''"),
+    ('deadband_pct', "TEXT DEFAULT ''"),
+    ('unit_id', 'INTEGER DEFAULT NULL'),
+]
+
+CONTROLLERS_NEW_COLUMNS = [
+    ('unit_id', 'INTEGER DEFAULT 1'),
+]
+
+# порядок колонок совпадает с аргументами Controller(...) и Sensor(...)
+CONTROLLER_COLUMNS = 'root_oid, ip_address, oid, oid_name, tcp_port, description, unit_id'
+
+SENSOR_COLUMNS = '''
+            controllers.root_oid, controllers.ip_address, controllers.oid, controllers.oid_name,
+            controllers.tcp_port, controllers.description,
+            sensors.controller_ip, sensors.oid, sensors.oid_name, sensors.modbus_id, sensors.data_type,
+            sensors.description, sensors.register_type, sensors.monitoring, sensors.min_value,
+            sensors.max_value, sensors.value, sensors.deadband_abs, sensors.deadband_pct,
+            sensors.unit_id, controllers.unit_id
+'''
+
+
+def select_columns(columns, st_existing):
+    """
+    Список колонок для SELECT по базе, созданной старой версией и открытой только на чтение
+    (ALTER TABLE в ней не выполнялся): колонки из *_NEW_COLUMNS, которых нет, заменяются
+    значением по умолчанию, чтобы порядок (и аргументы Controller/Sensor) не менялся
+    :param columns: CONTROLLER_COLUMNS или SENSOR_COLUMNS (без таблицы - controllers)
+    :param st_existing: {table_name: множество колонок}
+    """
+    defaults = {}
+    for table_name, lst_columns in (('sensors', SENSORS_NEW_COLUMNS), ('controllers', CONTROLLERS_NEW_COLUMNS)):
+        for name, definition in lst_columns:
+            defaults[(table_name, name)] = definition.split('DEFAULT', 1)[1].strip()
+
+    lst_select = []
+    for column in columns.split(','):
+        column = column.strip()
+        table_name, _, name = column.rpartition('.')
+        key = (table_name or 'controllers', name)
+        if key in defaults and name not in st_existing.get(key[0], ()):
+            lst_select.append(defaults[key])
+        else:
+            lst_select.append(column)
+    return ', '.join(lst_select)
+
+
+def make_sensors(rows):
+    """
+    Sensor из строк SENSOR_COLUMNS; один Controller на ip_address - общий для всех его сенсоров
+    :return: [Sensor, ...]
+    """
+    dict_controllers = {}
+    lst_sensors = []
+    for item in rows:
+        controller = dict_controllers.get(item[1])
+        if controller is None:
+            controller = dict_controllers[item[1]] = Controller(*item[:6], item[20])
+        lst_sensors.append(Sensor(*item, controller=controller))
+    return lst_sensors
+
+
 ADD_SENSOR_ERRORS = {
     1: 'OK',
     0: 'ошибка внесения записи(Exception)',
@@ -25,10 +93,19 @@ class Controllers(object):
     """Класс для работы с БД, в которой храниться конфигурация контроллеров"""
     logger = None
 
-    def __init__(self, db_file, logger = None, read_only=False):
-        """Если файла нет или он пустой, то создаем базу заднных"""
+    def __init__(self, db_file, logger = None, read_only=False, metrics=None):
+        """
+        Если файла нет или он пустой, то создаем базу заднных
+        :param metrics: MetricsRegistry для времени выборок (None - общий metrics.REGISTRY)
+        """
 
         self.logger = logger
+        if metrics is None:
+            metrics = REGISTRY
+        self.__lookup_time = {
+            method: metrics.histogram('config_lookup_seconds', method=method)
+            for method in ('get_controllers', 'get_sensors', 'get_sensor', 'get_all_sensors')
+        }
         sql_foreign_on = 'PRAGMA foreign_keys = ON'
 
         sql_create_root_oids = '''
@@ -45,6 +122,7 @@ class Controllers(object):
             oid_name TEXT UNIQUE, -- символьный OID
             tcp_port INTEGER,  -- порт по которому работает Modbus
             description TEXT,  -- справочная информация
+            unit_id INTEGER DEFAULT 1,  -- Modbus unit id по умолчанию для сенсоров контроллера
             FOREIGN KEY (root_oid) REFERENCES  root_oids(oid) ON UPDATE CASCADE 
         )
         '''
@@ -62,25 +140,64 @@ class Controllers(object):
             min_value TEXT DEFAULT \'\',
             max_value TEXT DEFAULT \'\',
             value TEXT DEFAULT \'\',
+            deadband_abs TEXT DEFAULT \'\', -- не писать в историю изменения меньше этого (абсолютное)
+            deadband_pct TEXT DEFAULT \'\', -- не писать в историю изменения меньше этого (в процентах)
+            unit_id INTEGER DEFAULT NULL, -- Modbus unit id устройства за шлюзом (NULL - как у контроллера)
             FOREIGN KEY (controller_ip)  REFERENCES controllers(ip_address) ON DELETE CASCADE ON UPDATE CASCADE
         )
         '''
 
+        sql_create_sensors_index = '''
+        CREATE INDEX IF NOT EXISTS sensors_controller_modbus_id ON sensors (controller_ip, modbus_id)
+        '''
+
+        sql_create_retention_rules = '''
+        CREATE TABLE IF NOT EXISTS retention_rules (
+            controller_ip TEXT DEFAULT NULL,  -- NULL - любой контроллер
+            modbus_id INTEGER DEFAULT NULL,  -- NULL - любой сенсор (иначе правило одного сенсора controller_ip)
+            register_type TEXT DEFAULT NULL,  -- NULL - любой тип регистра
+            days REAL DEFAULT NULL,  -- сколько дней хранить историю, NULL - всегда
+            FOREIGN KEY (controller_ip) REFERENCES controllers(ip_address) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+        '''
+
         self.__sqlite = sqlite3.connect(db_file)
         self.__cursor = self.__sqlite.cursor()
         self.__cursor.execute(sql_foreign_on)
+        self.__controller_columns = CONTROLLER_COLUMNS
+        self.__sensor_columns = SENSOR_COLUMNS
         if read_only:
             self.disable_changes()
+            st_existing = {
+                table_name: set(row[1] for row in self.__cursor.execute('PRAGMA table_info({0})'.format(table_name)))
+                for table_name in ('controllers', 'sensors')
+            }
+            self.__controller_columns = select_columns(CONTROLLER_COLUMNS, st_existing)
+            self.__sensor_columns = select_columns(SENSOR_COLUMNS, st_existing)
             return
         self.__cursor.execute(sql_create_root_oids)
         self.__cursor.execute(sql_create_controllers)
         self.__cursor.execute(sql_create_sensors)
+        self.__cursor.execute(sql_create_sensors_index)
+        self.__cursor.execute(sql_create_retention_rules)
+        self.__add_missing_columns('sensors', SENSORS_NEW_COLUMNS)
+        self.__add_missing_columns('controllers', CONTROLLERS_NEW_COLUMNS)
 
         try:
             self.__cursor.execute('INSERT INTO root_oids (oid) VALUES ("{0}")'.format(DEFAULT_ROOT_OID))
         except:
             pass
 
+    def __add_missing_columns(self, table_name, lst_columns):
+        """
+        Добавляет в таблицу колонки, которых нет в базах, созданных старыми версиями
+        :param lst_columns: [(name, definition), ...]
+        """
+        existing = [row[1] for row in self.__cursor.execute('PRAGMA table_info({0})'.format(table_name))]
+        for name, definition in lst_columns:
+            if name not in existing:
+                self.__cursor.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(table_name, name, definition))
+
     def __del__(self):
         self.__sqlite.commit()
         self.__sqlite.close()
@@ -101,16 +218,17 @@ class Controllers(object):
         try:
             self.__cursor.execute(
                 '''INSERT INTO controllers 
-                        (root_oid, ip_address, oid, oid_name, tcp_port, description) 
+                        (root_oid, ip_address, oid, oid_name, tcp_port, description, unit_id) 
                    VALUES
-                        ("{0}", "{1}", {2}, "{3}", {4}, "{5}")
+                        ("{0}", "{1}", {2}, "{3}", {4}, "{5}", {6})
                         '''.format(
                                     controller.root_oid,
                                     controller.ip_address,
                                     controller.oid,
                                     controller.oid_name,
                                     controller.tcp_port,
-                                    controller.description
+                                    controller.description,
+                                    int(controller.unit_id)
                             )
             )
             self.__debug('Добавили контроллер с ip = {0}'.format(controller.ip_address))
@@ -134,7 +252,8 @@ class Controllers(object):
             'oid': controller.oid,
             'oid_name': controller.oid_name,
             'tcp_port': controller.tcp_port,
-            'description': controller.description
+            'description': controller.description,
+            'unit_id': int(controller.unit_id)
         }
 
         ret = self.__update_row('controllers', 'ip_address = "{0}"'.format(controller.ip_address), st_values)
@@ -197,6 +316,9 @@ class Controllers(object):
         min_value = sensor.get_min_value()
         max_value = sensor.get_max_value()
         value = sensor.value
+        deadband_abs = sensor.get_deadband_abs()
+        deadband_pct = sensor.get_deadband_pct()
+        unit_id = 'NULL' if sensor.unit_id is None else int(sensor.unit_id)
 
         try:
             result = self.__cursor.execute(
@@ -228,12 +350,12 @@ class Controllers(object):
 
             self.__cursor.execute(
                 '''INSERT INTO sensors 
-                        (controller_ip, oid, oid_name, modbus_id, data_type, description, register_type, monitoring, min_value, max_value, value)
+                        (controller_ip, oid, oid_name, modbus_id, data_type, description, register_type, monitoring, min_value, max_value, value, deadband_abs, deadband_pct, unit_id)
                 VALUES
-                        ("{0}", {1}, "{2}", {3}, "{4}", "{5}", "{6}", "{7}", "{8}", "{9}", "{10}")
+                        ("{0}", {1}, "{2}", {3}, "{4}", "{5}", "{6}", "{7}", "{8}", "{9}", "{10}", "{11}", "{12}", {13})
                 '''.format(
                     controller_ip, sensor_oid, oid_name, modbus_id, data_type, description,
-                    register_type, monitoring, min_value, max_value, value
+                    register_type, monitoring, min_value, max_value, value, deadband_abs, deadband_pct, unit_id
                 )
             )
             self.__sqlite.commit()
@@ -251,6 +373,51 @@ class Controllers(object):
             {'value': new_value}
         )
 
+    def update_sensor_deadband(self, sensor):
+        return self.__update_row(
+            'sensors',
+            'controller_ip="{0}" AND modbus_id={1}'.format(sensor.controller_ip, sensor.modbus_id),
+            {'deadband_abs': sensor.get_deadband_abs(), 'deadband_pct': sensor.get_deadband_pct()}
+        )
+
+    def update_sensor_values(self, st_values):
+        """
+        Обновляет значения (колонка value) сразу у многих сенсоров одной транзакцией.
+        Строки, в которых значение не изменилось, не трогаются.
+        :param st_values: {(controller_ip, modbus_id): value, ...}
+        :return: количество обновленных строк, -1 - ошибка
+        """
+        sql = '''
+                UPDATE
+                        sensors
+                SET
+                        value = ?
+                WHERE
+                        controller_ip = ?
+                AND
+                        modbus_id = ?
+                AND
+                        value IS NOT ?
+        '''
+
+        rows = []
+        for (controller_ip, modbus_id), value in st_values.items():
+            value = str(value)
+            rows.append((value, controller_ip, modbus_id, value))
+
+        try:
+            self.__cursor.executemany(sql, rows)
+            updated = self.__cursor.rowcount
+            self.__sqlite.commit()
+            self.__debug('Обновили значения {0} сенсоров из {1}'.format(updated, len(rows)))
+            return updated
+
+        except Exception as e:
+            self.__sqlite.rollback()
+            self.__debug('Ошибка обновления значений сенсоров.')
+            self.__debug(str(e))
+            return -1
+
     def del_controller(self, controller_ip):
         """
         Удаляеет контроллер.
@@ -309,8 +476,11 @@ class Controllers(object):
             Возвращает все контроллеры из базы
             :return: [Controller, ...]
         """
-        result = self.__cursor.execute('SELECT * FROM controllers')
-        return [Controller(*item) for item in list(result)]
+        start = perf_counter()
+        result = self.__cursor.execute('SELECT {0} FROM controllers'.format(self.__controller_columns))
+        lst_controllers = [Controller(*item) for item in list(result)]
+        self.__lookup_time['get_controllers'].record(perf_counter() - start)
+        return lst_controllers
 
     def get_sensors(self, controller_ip=None):
         """
@@ -320,19 +490,19 @@ class Controllers(object):
         """
         query = '''
                     SELECT
-                            *
+                            {0}
                     FROM 
                             controllers                                  
                     INNER JOIN 
                             sensors
                     ON 
                             sensors.controller_ip = controllers.ip_address
-        '''
+        '''.format(self.__sensor_columns)
 
         if controller_ip is not None:
             query = '''
                             SELECT
-                            *
+                            {0}
                             FROM 
                                   controllers                                  
                             INNER JOIN 
@@ -340,15 +510,18 @@ class Controllers(object):
                             ON 
                                   sensors.controller_ip = controllers.ip_address
                             WHERE
-                                  sensors.controller_ip = "{0}"
-                '''.format(controller_ip)
+                                  sensors.controller_ip = "{1}"
+                '''.format(self.__sensor_columns, controller_ip)
 
-        return [Sensor(*item) for item in list(self.__cursor.execute(query))]
+        start = perf_counter()
+        lst_sensors = make_sensors(self.__cursor.execute(query))
+        self.__lookup_time['get_sensors'].record(perf_counter() - start)
+        return lst_sensors
 
     def get_sensor(self, controller_ip, modbus_id):
         query = '''
         SELECT
-            *
+            {0}
         FROM
             controllers
         INNER JOIN
@@ -359,10 +532,12 @@ class Controllers(object):
             controller_ip = ?
         AND
             modbus_id = ?
-        '''
+        '''.format(self.__sensor_columns)
 
-        self.logger.debug(query)
-        result = [Sensor(*item) for item in list(self.__cursor.execute(query, (controller_ip, modbus_id)))]
+        self.__debug(query)
+        start = perf_counter()
+        result = make_sensors(self.__cursor.execute(query, (controller_ip, modbus_id)))
+        self.__lookup_time['get_sensor'].record(perf_counter() - start)
 
         if len(result) > 0:
             return result[0]
@@ -375,7 +550,7 @@ class Controllers(object):
         """
         query = '''
                     SELECT
-                    *
+                    {0}
                     FROM 
                           controllers 
                     INNER JOIN 
@@ -383,9 +558,69 @@ class Controllers(object):
                     ON 
                           sensors.controller_ip = controllers.ip_address
 
-        '''
+        '''.format(self.__sensor_columns)
+
+        start = perf_counter()
+        lst_sensors = make_sensors(self.__cursor.execute(query))
+        self.__lookup_time['get_all_sensors'].record(perf_counter() - start)
+        return lst_sensors
+
+    def set_retention_rule(self, rule):
+        """
+        Добавляет правило хранения истории, правило с теми же controller_ip, modbus_id,
+        register_type заменяется
+        :param rule: RetentionRule
+        :return: True/False
+        """
+        try:
+            self.__cursor.execute(
+                'DELETE FROM retention_rules WHERE controller_ip IS ? AND modbus_id IS ? AND register_type IS ?',
+                rule.key()
+            )
+            self.__cursor.execute(
+                'INSERT INTO retention_rules (controller_ip, modbus_id, register_type, days) VALUES (?, ?, ?, ?)',
+                rule.key() + (rule.days,)
+            )
+            self.__sqlite.commit()
+            self.__debug('Правило хранения {0}'.format(rule))
+            return True
+
+        except Exception as e:
+            self.__debug('Ошибка записи правила хранения {0}'.format(rule))
+            self.__debug(str(e))
+            self.__sqlite.rollback()
+            return False
 
-        return [Sensor(*item) for item in list(self.__cursor.execute(query))]
+    def del_retention_rule(self, rule):
+        """
+        Удаляет правило хранения с теми же controller_ip, modbus_id, register_type
+        :return: True/False
+        """
+        try:
+            self.__cursor.execute(
+                'DELETE FROM retention_rules WHERE controller_ip IS ? AND modbus_id IS ? AND register_type IS ?',
+                rule.key()
+            )
+            self.__sqlite.commit()
+            return True
+
+        except Exception as e:
+            self.__debug('Ошибка удаления правила хранения {0}'.format(rule))
+            self.__debug(str(e))
+            return False
+
+    def get_retention_rules(self):
+        """
+        Возвращает правила хранения истории
+        :return: [RetentionRule, ...]
+        """
+        try:
+            result = self.__cursor.execute(
+                'SELECT controller_ip, modbus_id, register_type, days FROM retention_rules'
+            )
+        except sqlite3.OperationalError:
+            return []  # база, созданная до появления таблицы и открытая только на чтение
+        return [RetentionRule(*item) for item in result]
 
     def get_root_oids(self):
         """
@@ -415,45 +650,72 @@ class Controllers(object):
             False - Error
         """
 
-        sql = '''
-                SELECT * FROM controllers WHERE ip_address=?
-        '''
+        return self.copy_controller_to_many(
+            controller_ip,
+            [(new_controller_ip, new_controller_oid, new_oid_name, new_description)]
+        )
 
-        controller = self.__cursor.execute(sql, (controller_ip,)).fetchone()
-        self.__debug(controller)
+    def copy_controller_to_many(self, controller_ip, lst_new_controllers):
+        """
+            Copy controller with sensors as several new ones in one transaction.
+            If any copy fails nothing is added.
+        :param controller_ip: ip of template controller
+        :param lst_new_controllers: [(new_ip, new_oid, new_oid_name, new_description), ...]
+        :return:
+            True - OK
+            False - Error
+        """
 
-        root_oid, _, _, _, tcp_port, _ = controller
-        controller_to_add = Controller(
-            root_oid=root_oid,
-            ip_address=new_controller_ip,
-            oid=new_controller_oid,
-            oid_name=new_oid_name,
-            tcp_port=tcp_port,
-            description=new_description
+        sql_controller = '''
+                INSERT INTO controllers
+                        (root_oid, ip_address, oid, oid_name, tcp_port, description, unit_id)
+                SELECT
+                        root_oid, ?, ?, ?, tcp_port, ?, unit_id
+                FROM
+                        controllers
+                WHERE
+                        ip_address = ?
+        '''
 
-        )
-        ret = self.add_controller(controller_to_add)
+        sql_sensors = '''
+                INSERT INTO sensors
+                        (controller_ip, oid, oid_name, modbus_id, data_type, description,
+                         register_type, monitoring, min_value, max_value, value, deadband_abs, deadband_pct, unit_id)
+                SELECT
+                        ?, oid, oid_name, modbus_id, data_type, description,
+                        register_type, monitoring, min_value, max_value, value, deadband_abs, deadband_pct, unit_id
+                FROM
+                        sensors
+                WHERE
+                        controller_ip = ?
+        '''
 
-        if not ret:
-            self.logger.error('add_controller error: {0}'.format(ret))
-            return False
+        controller_rows = []
+        sensor_rows = []
+        for new_ip, new_oid, new_oid_name, new_description in lst_new_controllers:
+            controller_rows.append((new_ip, new_oid, lower_first_char(new_oid_name), new_description, controller_ip))
+            sensor_rows.append((new_ip, controller_ip))
 
-        err_sensors = []
+        try:
+            self.__cursor.executemany(sql_controller, controller_rows)
+            if self.__cursor.rowcount != len(controller_rows):
+                self.__sqlite.rollback()
+                self.__error('Controller {0} not found'.format(controller_ip))
+                return False
 
-        for sensor in self.get_sensors(controller_ip):
-            sensor.controller_ip = new_controller_ip
-            self.logger.debug(sensor)
-            if not self.add_sensor(sensor):
-                err_sensors.append(sensor)
+            self.__cursor.executemany(sql_sensors, sensor_rows)
+            self.__sqlite.commit()
+            self.__debug('Controller {0} copied to {1}'.format(
+                controller_ip, ', '.join(str(row[0]) for row in controller_rows)
+            ))
+            return True
 
-        if len(err_sensors) > 0:
-            self.__error('Some sensors are not copied:')
-            for sensor in err_sensors:
-                self.__error('    {0}'.format(sensor))
+        except Exception as e:
+            self.__sqlite.rollback()
+            self.__error('Exception when try copy controller {0}'.format(controller_ip))
+            self.__debug(str(e))
             return False
 
-        return True
-
     def change_controllers_ip(self, from_ip, to_ip):
         """
         Change ip of controller
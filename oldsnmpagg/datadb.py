@@ -1,19 +1,98 @@
 import sqlite3
 import datetime
+import time
+from time import perf_counter
 from .wrappers import Data
 from .wrappers import Sensor
+from .hotlog import HotLogger
+from .metrics import REGISTRY
+from .historycache import HistoryCache, sensor_key
+
+DEFAULT_RETRY_INTERVAL = 5  # секунд между попытками вернуться к базе после ошибки (со спулом)
+DEFAULT_CHUNK_SIZE = 10000  # строк за один fetchmany в iter_data_rows
+SENSORS_PER_QUERY = 300     # сенсоров в одном запросе iter_data_rows (лимит переменных SQLite)
+DEFAULT_DELETE_BATCH = 1000  # строк за одну транзакцию delete_sensor_data
+OPEN_RANGE_SLACK = 60       # секунд: get_data с to_date >= now - OPEN_RANGE_SLACK - открытый диапазон кеша
+
+# индекс для удаления истории по сенсорам (delete_sensor_data) и выборок по сенсору и времени
+SENSOR_INDEX = 'data_sensor_date_time'
+WATERMARK_TRIGGER = 'data_retention_watermark'  # снимает отметку хранения при вставке отсчета не новее нее
+
+# функции агрегации для iter_data_rows
+AGGREGATES = {
+    'avg': 'AVG',
+    'min': 'MIN',
+    'max': 'MAX',
+    'sum': 'SUM',
+    'count': 'COUNT'
+}
+
+# настройки SQLite на время массовой загрузки (begin_bulk_load)
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 0,       # OFF: без fsync на каждый commit
+    'cache_size': -262144,  # 256 MB
+    'temp_store': 2         # MEMORY
+}
+
+
+def _is_unavailable(e):
+    """
+    Ошибка самой базы (блокировка, диск, испорченный файл), а не отсчета:
+    ProgrammingError/IntegrityError/InterfaceError и прочие исключения - плохой отсчет
+    """
+    return isinstance(e, (sqlite3.OperationalError, sqlite3.InternalError)) or type(e) is sqlite3.DatabaseError
 
 
 class DataDB(object):
     logger = None
 
-    def __init__(self, db_file, logger = None, mode='rwc'):
-        """Если файла нет или он пустой, то создаем базу заднных"""
+    def __init__(self, db_file, logger = None, mode='rwc', metrics=None, spool=None,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, cache_bytes=0):
+        """
+        Если файла нет или он пустой, то создаем базу заднных
+        :param metrics: MetricsRegistry для времени операций (None - общий metrics.REGISTRY)
+        :param spool: oldsnmpagg.spool.Spool - при ошибке базы (не отсчета, см. _is_unavailable) отсчеты (и незакоммиченные
+            с прошлого commit) пишутся в спул, база не трогается retry_interval секунд,
+            после восстановления спул переносится в базу. None - отсчет теряется, как раньше
+        :param cache_bytes: > 0 - кешировать результаты get_data (HistoryCache не больше
+            cache_bytes), 0 - без кеша
+        """
 
         self.logger = logger
+        self.__log = HotLogger(logger)
         self.mode = mode
         self.db_file = db_file
+        self.metrics = metrics
+        if metrics is None:
+            metrics = REGISTRY
+        self.__op_time = {
+            op: metrics.histogram('datadb_seconds', op=op)
+            for op in ('add_data', 'get_data', 'get_all_data', 'get_last_data', 'get_step_data')
+        }
+        self.__errors = metrics.counter('datadb_errors_total')
+        self.__spooled = metrics.counter('datadb_spooled_total')
+
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.__pending = []      # отсчеты после последнего commit (только со спулом)
+        self.__retry_at = None   # база недоступна до этого времени
+        self.__bulk_pragmas = {}  # прежние настройки на время begin_bulk_load
+        self.cache_bytes = cache_bytes
+        self.history_cache = HistoryCache(cache_bytes) if cache_bytes > 0 else None
+        self.__data_version = None  # PRAGMA data_version при последнем чтении через кеш
+        if spool is not None and not spool.is_empty():
+            self.__retry_at = time.time()  # остался спул с прошлого запуска
+
+        if spool is None:
+            self.__connect()
+            return
+        try:
+            self.__connect()
+        except Exception as e:
+            self.__error('Data history is unavailable: {0}', e)
+            self.__retry_at = time.time() + self.retry_interval
 
+    def __connect(self):
         sql_foreign_on = 'PRAGMA foreign_keys = ON'
 
         sql_create_data = '''
@@ -26,11 +105,37 @@ class DataDB(object):
             date_time REAL -- Unix TimeStamp as float
         )
         '''
-        self.__sqlite = sqlite3.connect('file:{0}?mode={1}'.format(db_file, mode), uri=True)
+
+        sql_create_spool_positions = '''
+        CREATE TABLE IF NOT EXISTS spool_positions (
+            path TEXT PRIMARY KEY,  -- файл спула
+            generation TEXT,        -- id содержимого спула (меняется после очистки)
+            position INTEGER        -- до этой позиции спул уже перенесен в data
+        )
+        '''
+
+        sql_create_deferred_indexes = '''
+        CREATE TABLE IF NOT EXISTS deferred_indexes (
+            name TEXT PRIMARY KEY,  -- индекс таблицы data, удаленный на время массовой загрузки
+            sql TEXT
+        )
+        '''
+        sql_create_retention_watermarks = '''
+        CREATE TABLE IF NOT EXISTS retention_watermarks (
+            controller_ip TEXT,
+            modbus_id INTEGER,
+            deleted_before REAL,  -- история сенсора с date_time <= deleted_before уже удалена
+            PRIMARY KEY (controller_ip, modbus_id)
+        )
+        '''
+        self.__sqlite = sqlite3.connect('file:{0}?mode={1}'.format(self.db_file, self.mode), uri=True)
         self.__cursor = self.__sqlite.cursor()
         self.__cursor.execute(sql_foreign_on)
         if self.mode == 'rwc':
             self.__cursor.execute(sql_create_data)
+            self.__cursor.execute(sql_create_spool_positions)
+            self.__cursor.execute(sql_create_deferred_indexes)
+            self.__cursor.execute(sql_create_retention_watermarks)
 
     def __del__(self):
         try:
@@ -40,16 +145,71 @@ class DataDB(object):
             pass
 
     def reinit(self):
-        self.__init__(self.db_file, logger=self.logger, mode=self.mode)
+        self.__init__(self.db_file, logger=self.logger, mode=self.mode, metrics=self.metrics,
+                      spool=self.spool, retry_interval=self.retry_interval, cache_bytes=self.cache_bytes)
 
     def commit(self):
-        self.__sqlite.commit()
+        if self.spool is None:
+            self.__sqlite.commit()
+            return
+
+        if self.__retry_at is not None:
+            return
+        try:
+            self.__sqlite.commit()
+            self.__pending = []
+        except Exception as e:
+            self.__errors.inc()
+            self.__error('Exception when commit data history: {0}', e)
+            self.__go_offline()
+
+    def __go_offline(self):
+        """Незакоммиченные отсчеты - в спул, база не используется retry_interval секунд"""
+        for data in self.__pending:
+            self.spool.append(data)
+        self.__spooled.inc(len(self.__pending))
+        self.__pending = []
+        self.__retry_at = time.time() + self.retry_interval
+        if self.history_cache is not None:
+            self.history_cache.clear()  # могли попасть строки, которых в базе не будет
+        try:
+            self.__sqlite.close()
+        except Exception:
+            pass
+        self.__warning('Data history is unavailable, spooling to {0}', self.spool.path)
+
+    def __is_available(self):
+        """Со спулом: после retry_interval пробует переподключиться и перенести спул в базу"""
+        if self.__retry_at is None:
+            return True
+        if time.time() < self.__retry_at:
+            return False
+
+        try:
+            self.__connect()
+        except Exception as e:
+            self.__error('Data history is still unavailable: {0}', e)
+            self.__retry_at = time.time() + self.retry_interval
+            return False
+
+        replayed = self.spool.replay(self)
+        if replayed < 0:
+            self.__go_offline()
+            return False
+
+        self.__retry_at = None
+        self.__info('Data history is available again, {0} samples replayed from spool', replayed)
+        return True
 
     def add_data(self, data: Data, autocommit=True):
         if data.id != 0:
-            self.__error('Id is not Null: {0}'.format(data))
+            self.__error('Id is not Null: {0}', data)
             return False
 
+        if self.spool is not None and not self.__is_available():
+            self.__spooled.inc()
+            return self.spool.append(data)
+
         query = '''
         INSERT INTO data
             (controller_ip, oid, modbus_id, value, date_time) 
@@ -57,29 +217,184 @@ class DataDB(object):
             (?, ?, ?, ?, ?)
         '''
 
+        start = perf_counter()
         try:
             self.__debug(query)
-            self.__cursor.execute(
-                query,
-                (
-                    data.sensor.controller_ip,
-                    data.sensor.oid,
-                    data.sensor.modbus_id,
-                    data.value,
-                    data.date_time_as_unixtimestap()
-                )
+            row = (
+                data.sensor.controller_ip,
+                data.sensor.oid,
+                data.sensor.modbus_id,
+                data.value,
+                data.date_time_as_unixtimestap()
             )
+            self.__cursor.execute(query, row)
+            if self.history_cache is not None:
+                self.history_cache.note_rows((row,))
+            if self.spool is not None:
+                self.__pending.append(data)
             if autocommit:
                 self.commit()
-                self.__debug('Successful write data history: {0}'.format(data))
+                self.__debug('Successful write data history: {0}', data)
+            self.__op_time['add_data'].record(perf_counter() - start)
             return True
         except Exception as e:
-            self.__error('Exception when try to save data history: {0}'.format(data))
+            self.__errors.inc()
+            self.__error('Exception when try to save data history: {0}', data)
             self.__debug(e)
+            if not _is_unavailable(e):
+                # плохой отсчет: база в порядке, незакоммиченные отсчеты остаются в транзакции,
+                # в спул его не пишем и кеш не сбрасываем
+                return False
+            if self.spool is not None:
+                self.__go_offline()
+                self.__spooled.inc()
+                return self.spool.append(data)
             self.__sqlite.close()
             self.reinit()
             return False
 
+    def add_data_many(self, lst_data, spool_position=None):
+        """
+        Пишет пачку отсчетов одной транзакцией
+        :param spool_position: (path, generation, position) - сохраняется в той же транзакции
+            (replay из спула)
+        :return: True/False (при ошибке транзакция откатывается)
+        """
+        return self.add_rows([
+            (
+                data.sensor.controller_ip,
+                data.sensor.oid,
+                data.sensor.modbus_id,
+                data.value,
+                data.date_time_as_unixtimestap()
+            ) for data in lst_data
+        ], spool_position)
+
+    def add_rows(self, lst_rows, spool_position=None):
+        """
+        Как add_data_many, но строки уже готовые, без Data (массовая загрузка)
+        :param lst_rows: [(controller_ip, oid, modbus_id, value, date_time - unix time), ...]
+        :param spool_position: (path, generation, position) - позиция в спуле или
+            загружаемом файле, сохраняется в той же транзакции
+        :return: True/False (при ошибке транзакция откатывается)
+        """
+        query = '''
+        INSERT INTO data
+            (controller_ip, oid, modbus_id, value, date_time)
+        VALUES
+            (?, ?, ?, ?, ?)
+        '''
+
+        try:
+            self.__cursor.executemany(query, lst_rows)
+            if spool_position is not None:
+                self.__cursor.execute(
+                    'INSERT OR REPLACE INTO spool_positions (path, generation, position) VALUES (?, ?, ?)',
+                    spool_position
+                )
+            self.__sqlite.commit()
+            if self.history_cache is not None:
+                self.history_cache.note_rows(lst_rows)
+            return True
+        except Exception as e:
+            self.__errors.inc()
+            self.__error('Exception when try to save {0} data history items: {1}', len(lst_rows), e)
+            try:
+                self.__sqlite.rollback()
+            except Exception:
+                pass
+            return False
+
+    def begin_bulk_load(self):
+        """
+        Режим массовой загрузки: synchronous=OFF, большой кэш, индексы таблицы data удаляются
+        (их SQL сохраняется в deferred_indexes) и строятся заново в end_bulk_load.
+        Журнал не отключается: прерванная загрузка не портит базу и продолжается с позиции.
+        :return: True/False
+        """
+        try:
+            self.__bulk_pragmas = {
+                name: list(self.__cursor.execute('PRAGMA {0}'.format(name)))[0][0]
+                for name in BULK_LOAD_PRAGMAS
+            }
+            for name, value in BULK_LOAD_PRAGMAS.items():
+                self.__cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+
+            lst_indexes = list(self.__cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'data' AND sql IS NOT NULL"
+            ))
+            for name, sql in lst_indexes:
+                self.__cursor.execute('INSERT OR REPLACE INTO deferred_indexes (name, sql) VALUES (?, ?)', (name, sql))
+                self.__cursor.execute('DROP INDEX "{0}"'.format(name))
+            self.__sqlite.commit()
+            if lst_indexes:
+                self.__info('Bulk load: {0} indexes deferred', len(lst_indexes))
+            return True
+        except Exception as e:
+            self.__error('Exception when start bulk load: {0}', e)
+            try:
+                self.__sqlite.rollback()
+            except Exception:
+                pass
+            return False
+
+    def end_bulk_load(self):
+        """
+        Строит индексы, удаленные begin_bulk_load (в том числе прерванной загрузкой),
+        и возвращает прежние настройки
+        :return: True/False
+        """
+        try:
+            lst_indexes = list(self.__cursor.execute('SELECT name, sql FROM deferred_indexes'))
+            for name, sql in lst_indexes:
+                self.__debug(sql)
+                self.__cursor.execute(sql)
+                self.__cursor.execute('DELETE FROM deferred_indexes WHERE name = ?', (name,))
+            self.__sqlite.commit()
+            if lst_indexes:
+                self.__info('Bulk load: {0} indexes rebuilt', len(lst_indexes))
+        except Exception as e:
+            self.__error('Exception when rebuild indexes after bulk load: {0}', e)
+            try:
+                self.__sqlite.rollback()
+            except Exception:
+                pass
+            return False
+
+        for name, value in self.__bulk_pragmas.items():
+            self.__cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+        self.__bulk_pragmas = {}
+        return True
+
+    def get_spool_offset(self, path, generation):
+        """
+        :return: позиция, до которой спул generation уже перенесен в базу (0 - не переносился),
+            -1 - ошибка базы
+        """
+        stored = self.get_spool_position(path)
+        if stored is None:
+            return -1
+        if stored[0] != generation:
+            return 0
+        return stored[1]
+
+    def get_spool_position(self, path):
+        """
+        :return: (generation, позиция) последнего переноса path, (None, 0) - не переносился,
+            None - ошибка базы
+        """
+        try:
+            lst_result = list(self.__cursor.execute(
+                'SELECT generation, position FROM spool_positions WHERE path = ?', (path,)
+            ))
+        except Exception as e:
+            self.__error('Exception when read spool position: {0}', e)
+            return None
+
+        if len(lst_result) < 1:
+            return None, 0
+        return lst_result[0][0], lst_result[0][1]
+
     def get_data(self, sensor: Sensor, from_date: datetime.datetime, to_date: datetime.datetime, interval):
         try:
             unix_from_date = from_date.timestamp()
@@ -98,20 +413,77 @@ class DataDB(object):
                     modbus_id = ?
                 AND
                     date_time BETWEEN ? AND ?
+                {0}
                 ORDER BY
                     id
                 '''
-
-        self.logger.debug(query)
-        lst_result = list(self.__cursor.execute(query, (sensor.controller_ip, sensor.modbus_id, unix_from_date, unix_to_date)))
-        lst_result = [row for i, row in enumerate(lst_result) if i % int(interval) == 0]
-
-        lst_data = []
-        for item_id, value, date_time in lst_result:
-            lst_data.append(Data(sensor, value, date_time, item_id))
-
+        params = (sensor.controller_ip, sensor.modbus_id, unix_from_date, unix_to_date)
+
+        self.__debug(query)
+        start = perf_counter()
+        if self.history_cache is None:
+            lst_result = self.__cursor.execute(query.format(''), params).fetchall()
+        elif unix_to_date >= time.time() - OPEN_RANGE_SLACK:
+            # до текущего времени: одна запись кеша на любой to_date, граница - при чтении
+            lst_result = self.__get_cached_rows(query.format('AND id > ? AND id <= ?'),
+                                                params[:3] + (float('inf'),), unix_to_date)
+        else:
+            lst_result = self.__get_cached_rows(query.format('AND id > ? AND id <= ?'), params)
+        lst_data = [Data(sensor, value, date_time, item_id) for item_id, value, date_time in lst_result[::int(interval)]]
+
+        self.__op_time['get_data'].record(perf_counter() - start)
         return lst_data
 
+    def __get_cached_rows(self, query, params, to_date=None):
+        """
+        Строки get_data через HistoryCache: свежая запись - без запроса, устаревшая - дочитываются
+        только строки с id > max_id записи, нет записи - полный запрос
+        :param query: запрос get_data с условием id > ? AND id <= ?
+        :param to_date: открытый диапазон (params до inf) - вернуть только строки с date_time <= to_date
+        """
+        cache = self.history_cache
+        self.__check_data_version()
+        key = sensor_key(params[0], params[1]) + params[2:]
+        entry = cache.get(key)
+        if entry is None or entry.stale:
+            max_id = self.__cursor.execute('SELECT MAX(id) FROM data').fetchone()[0] or 0
+            after_id = entry.max_id if entry is not None else 0
+            lst_rows = self.__cursor.execute(query, params + (after_id, max_id)).fetchall()
+            if entry is not None:
+                cache.extend(key, lst_rows, max_id)
+            else:
+                entry = cache.put(key, lst_rows, max_id)
+                if entry is None:
+                    return lst_rows if to_date is None else [row for row in lst_rows if row[2] <= to_date]
+
+        if to_date is None or entry.max_date <= to_date:
+            return entry.rows
+        return [row for row in entry.rows if row[2] <= to_date]
+
+    def __check_data_version(self):
+        """
+        PRAGMA data_version меняется после commit из другого соединения (другой процесс пишет
+        или чистит историю): все записи кеша дочитываются, строки до MIN(id) выбрасываются
+        """
+        version = self.__cursor.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.__data_version:
+            return
+        if self.__data_version is not None:
+            cache = self.history_cache
+            min_id = self.__cursor.execute('SELECT MIN(id) FROM data').fetchone()[0]
+            if min_id is None:
+                cache.clear()
+            else:
+                cache.trim(before_id=min_id)
+                for key in cache.sensor_keys():  # удаления по правилам хранения (delete_sensor_data)
+                    row = self.__cursor.execute(
+                        'SELECT deleted_before FROM retention_watermarks WHERE controller_ip = ? AND modbus_id = ?', key
+                    ).fetchone()
+                    if row is not None:
+                        cache.trim(before=row[0], key_of_sensor=key)
+                cache.mark_all_stale()
+        self.__data_version = version
+
     def get_all_data(self, sensor: Sensor, interval):
         query = '''
         SELECT
@@ -126,15 +498,12 @@ class DataDB(object):
             id
         '''
 
-        self.logger.debug(query)
-        lst_result = list(self.__cursor.execute(query, (sensor.controller_ip, sensor.modbus_id)))
-        lst_result = [row for i, row in enumerate(lst_result) if i % int(interval) == 0]
-
-
-        lst_data = []
-        for item_id, value, date_time in lst_result:
-            lst_data.append(Data(sensor, value, date_time, item_id))
+        self.__debug(query)
+        start = perf_counter()
+        lst_result = self.__cursor.execute(query, (sensor.controller_ip, sensor.modbus_id)).fetchall()
+        lst_data = [Data(sensor, value, date_time, item_id) for item_id, value, date_time in lst_result[::int(interval)]]
 
+        self.__op_time['get_all_data'].record(perf_counter() - start)
         return lst_data
 
     def get_last_data(self, sensor: Sensor):
@@ -153,13 +522,234 @@ class DataDB(object):
         LIMIT 1
         '''
 
+        start = perf_counter()
         lst_result = list(self.__cursor.execute(query, (sensor.controller_ip, sensor.modbus_id)))
+        self.__op_time['get_last_data'].record(perf_counter() - start)
         if len(lst_result) < 1:
             return None
 
         item_id, value, date_time = lst_result[0]
         return Data(sensor, value, date_time, item_id)
 
+    def get_step_data(self, sensor: Sensor, from_date: datetime.datetime, to_date: datetime.datetime):
+        """
+        Возвращает ряд для построения ступенчатого графика по данным, записанным с deadband:
+        первая точка - значение, действовавшее на from_date, последняя - значение на to_date
+        (но не позже текущего момента).
+        """
+        try:
+            unix_from_date = from_date.timestamp()
+            unix_to_date = min(to_date.timestamp(), datetime.datetime.now().timestamp())
+        except:
+            return None
+
+        query_before = '''
+                SELECT
+                    id, value, date_time
+                FROM
+                    data
+                WHERE
+                    controller_ip = ?
+                AND
+                    modbus_id = ?
+                AND
+                    date_time < ?
+                ORDER BY
+                    date_time
+                DESC
+                LIMIT 1
+                '''
+
+        query = '''
+                SELECT
+                    id, value, date_time
+                FROM
+                    data
+                WHERE
+                    controller_ip = ?
+                AND
+                    modbus_id = ?
+                AND
+                    date_time BETWEEN ? AND ?
+                ORDER BY
+                    date_time
+                '''
+
+        self.__debug(query)
+        start = perf_counter()
+        lst_result = list(self.__cursor.execute(query_before, (sensor.controller_ip, sensor.modbus_id, unix_from_date)))
+        lst_result = [(item_id, value, unix_from_date) for item_id, value, _ in lst_result]
+        lst_result += list(self.__cursor.execute(query, (sensor.controller_ip, sensor.modbus_id, unix_from_date, unix_to_date)))
+
+        if len(lst_result) > 0 and lst_result[-1][2] < unix_to_date:
+            item_id, value, _ = lst_result[-1]
+            lst_result.append((item_id, value, unix_to_date))
+
+        lst_data = [Data(sensor, value, date_time, item_id) for item_id, value, date_time in lst_result]
+        self.__op_time['get_step_data'].record(perf_counter() - start)
+        return lst_data
+
+    def iter_data_rows(self, sensors, from_date=None, to_date=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                       aggregate=None, func='avg'):
+        """
+        Потоковое чтение истории нескольких сенсоров пачками по chunk_size строк (fetchmany),
+        без создания Data - для выгрузки больших объемов.
+        Строки упорядочены по (controller_ip, modbus_id, date_time).
+        :param from_date, to_date: datetime.datetime или None (без ограничения)
+        :param aggregate: None - сырые строки, N - интервалы по N секунд
+        :param func: avg, min, max, sum, count (для aggregate)
+        :return: генератор списков строк:
+            сырые - (controller_ip, modbus_id, oid, value, date_time, id),
+            с aggregate - (controller_ip, modbus_id, oid, value, начало интервала, число отсчетов)
+        """
+        unix_from_date = from_date.timestamp() if from_date is not None else float('-inf')
+        unix_to_date = to_date.timestamp() if to_date is not None else float('inf')
+        lst_keys = sorted(set((sensor.controller_ip, sensor.modbus_id) for sensor in sensors))
+
+        if aggregate is None:
+            query = '''
+            SELECT
+                controller_ip, modbus_id, oid, value, date_time, id
+            FROM
+                data
+            WHERE
+                (controller_ip, modbus_id) IN (VALUES {0})
+            AND
+                date_time BETWEEN ? AND ?
+            ORDER BY
+                controller_ip, modbus_id, date_time
+            '''
+            params_before = ()
+        else:
+            query = '''
+            SELECT
+                controller_ip, modbus_id, MIN(oid), {1}(value), CAST(date_time / ? AS INTEGER) * ? AS bucket, COUNT(*)
+            FROM
+                data
+            WHERE
+                (controller_ip, modbus_id) IN (VALUES {0})
+            AND
+                date_time BETWEEN ? AND ?
+            GROUP BY
+                controller_ip, modbus_id, bucket
+            ORDER BY
+                controller_ip, modbus_id, bucket
+            '''.replace('{1}', AGGREGATES[func])
+            params_before = (aggregate, aggregate)
+        params_after = (unix_from_date, unix_to_date)
+
+        cursor = self.__sqlite.cursor()
+        try:
+            for i in range(0, len(lst_keys), SENSORS_PER_QUERY):
+                lst_group = lst_keys[i:i + SENSORS_PER_QUERY]
+                group_query = query.format(', '.join(['(?, ?)'] * len(lst_group)))
+                self.__debug(group_query)
+                cursor.execute(
+                    group_query, params_before + tuple(item for key in lst_group for item in key) + params_after
+                )
+                while True:
+                    lst_rows = cursor.fetchmany(chunk_size)
+                    if not lst_rows:
+                        break
+                    yield lst_rows
+        finally:
+            cursor.close()
+
+    def create_sensor_index(self):
+        """
+        Создает индекс (controller_ip, modbus_id, date_time) таблицы data, если его нет.
+        На большой базе строится долго (один раз); begin_bulk_load удаляет и его.
+        Вместе с индексом - триггер WATERMARK_TRIGGER: отсчет не новее отметки retention_watermarks
+        (спул, массовая загрузка, опоздавший опрос) снимает отметку сенсора в той же транзакции,
+        и следующее удаление проходит его историю с начала. Пока хранение по правилам
+        не используется, вставка за триггер не платит
+        :return: True/False
+        """
+        query = 'CREATE INDEX IF NOT EXISTS {0} ON data (controller_ip, modbus_id, date_time)'.format(SENSOR_INDEX)
+        sql_create_trigger = '''
+        CREATE TRIGGER IF NOT EXISTS {0} AFTER INSERT ON data
+        WHEN NEW.date_time <= (
+            SELECT deleted_before FROM retention_watermarks
+            WHERE controller_ip = NEW.controller_ip AND modbus_id = NEW.modbus_id
+        )
+        BEGIN
+            DELETE FROM retention_watermarks WHERE controller_ip = NEW.controller_ip AND modbus_id = NEW.modbus_id;
+        END
+        '''.format(WATERMARK_TRIGGER)
+        start = perf_counter()
+        try:
+            if list(self.__cursor.execute('SELECT name FROM deferred_indexes WHERE name = ?', (SENSOR_INDEX,))):
+                self.__warning('Index {0} is deferred by bulk load, run end_bulk_load first', SENSOR_INDEX)
+                return False
+            self.__debug(query)
+            self.__cursor.execute(query)
+            self.__cursor.execute(sql_create_trigger)
+            self.__sqlite.commit()
+        except Exception as e:
+            self.__error('Exception when create index {0}: {1}', SENSOR_INDEX, e)
+            return False
+        self.__debug('Index {0} is ready in {1:.3f} s', SENSOR_INDEX, perf_counter() - start)
+        return True
+
+    def get_retention_watermarks(self):
+        """:return: {(controller_ip, modbus_id): deleted_before} или None - ошибка базы"""
+        try:
+            result = self.__cursor.execute('SELECT controller_ip, modbus_id, deleted_before FROM retention_watermarks')
+            return {sensor_key(controller_ip, modbus_id): deleted_before
+                    for controller_ip, modbus_id, deleted_before in result}
+        except Exception as e:
+            self.__error('Exception when read retention watermarks: {0}', e)
+            return None
+
+    def delete_sensor_data(self, controller_ip, modbus_id, after, before, batch_size=DEFAULT_DELETE_BATCH):
+        """
+        Удаляет одну пачку истории сенсора с after < date_time <= before (по индексу
+        create_sensor_index) одной короткой транзакцией. Пачка неполная - удалять больше нечего,
+        в той же транзакции сохраняется отметка retention_watermarks = before
+        :param after: отметка прошлого удаления (None - с самого начала)
+        :return: число удаленных строк или -1 - ошибка (транзакция откатывается)
+        """
+        query = '''
+        DELETE FROM data WHERE id IN (
+            SELECT
+                id
+            FROM
+                data INDEXED BY {0}
+            WHERE
+                controller_ip = ?
+            AND
+                modbus_id = ?
+            AND
+                date_time > ?
+            AND
+                date_time <= ?
+            LIMIT ?
+        )
+        '''.format(SENSOR_INDEX)
+
+        try:
+            deleted = self.__cursor.execute(
+                query, (controller_ip, modbus_id, float('-inf') if after is None else after, before, batch_size)
+            ).rowcount
+            if deleted < batch_size:
+                self.__cursor.execute(
+                    'INSERT OR REPLACE INTO retention_watermarks (controller_ip, modbus_id, deleted_before) '
+                    'VALUES (?, ?, ?)', (controller_ip, modbus_id, before)
+                )
+            self.__sqlite.commit()
+        except Exception as e:
+            self.__errors.inc()
+            self.__error('Exception when delete data history of {0} {1}: {2}', controller_ip, modbus_id, e)
+            try:
+                self.__sqlite.rollback()
+            except Exception:
+                pass
+            return -1
+
+        if self.history_cache is not None and deleted > 0:
+            self.history_cache.trim(before=before, key_of_sensor=sensor_key(controller_ip, modbus_id))
+        return deleted
+
     def delete_data_older_than(self, days: int):
         now = datetime.datetime.now()
         dt_days_before = now - datetime.timedelta(days=days)
@@ -172,26 +762,20 @@ class DataDB(object):
         self.__debug(query.replace('?', str(days_before)))
         try:
             self.__cursor.execute(query, (str(days_before),))
+            if self.history_cache is not None:
+                self.history_cache.trim(before=days_before)
         except Exception as e:
-            self.__error('ERROR: {0}: {1]'.format(type(e), e))
+            self.__error('ERROR: {0}: {1}', type(e), e)
 
     # __logging__
-    def __debug(self, msg):
-        if self.logger is None:
-            return
-        self.logger.debug(msg)
+    def __debug(self, msg, *args):
+        self.__log.debug(msg, *args)
 
-    def __error(self, msg):
-        if self.logger is None:
-            return
-        self.logger.error(msg)
+    def __error(self, msg, *args):
+        self.__log.error(msg, *args)
 
-    def __warning(self, msg):
-        if self.logger is None:
-            return
-        self.logger.warning(msg)
+    def __warning(self, msg, *args):
+        self.__log.warning(msg, *args)
 
-    def __info(self, msg):
-        if self.logger is None:
-            return
-        self.logger.info(msg)
+    def __info(self, msg, *args):
+        self.__log.info(msg, *args)
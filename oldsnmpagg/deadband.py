@@ -0,0 +1,76 @@
+from .wrappers import Data
+
+DEFAULT_HEARTBEAT = 3600  # seconds
+
+
+class DeadbandFilter(object):
+    """
+    Фильтр между опросом (ModBusBridge) и историей (DataDB).
+    Пишет значение в историю, только если оно отличается от последнего записанного
+    больше чем на deadband сенсора (deadband_abs или deadband_pct), или если с последней
+    записи прошло больше heartbeat секунд. Если deadband у сенсора не задан,
+    пишутся только изменившиеся значения.
+    Восстановить ступенчатый ряд можно через DataDB.get_step_data.
+    """
+    logger = None
+
+    def __init__(self, data_db, heartbeat=DEFAULT_HEARTBEAT, logger=None):
+        self.data_db = data_db
+        self.heartbeat = heartbeat
+        self.logger = logger
+        self.__last = {}  # {(controller_ip, modbus_id): (value, unix_time)}
+
+    def add_data(self, data: Data, autocommit=True):
+        """
+        :return:
+            True - значение записано
+            False - значение отброшено фильтром или ошибка записи
+        """
+        sensor = data.sensor
+        key = (sensor.controller_ip, sensor.modbus_id)
+        date_time = data.date_time_as_unixtimestap()
+
+        if key not in self.__last:
+            last_data = self.data_db.get_last_data(sensor)
+            if last_data is not None:
+                self.__last[key] = (last_data.value, last_data.date_time_as_unixtimestap())
+
+        if key in self.__last and not self.is_significant(sensor, data.value, date_time, *self.__last[key]):
+            return False
+
+        if not self.data_db.add_data(data, autocommit=autocommit):
+            return False
+
+        self.__last[key] = (data.value, date_time)
+        return True
+
+    def is_significant(self, sensor, value, date_time, last_value, last_date_time):
+        if date_time - last_date_time >= self.heartbeat:
+            return True
+
+        try:
+            diff = abs(float(value) - float(last_value))
+        except (TypeError, ValueError):
+            return value != last_value
+
+        if sensor.deadband_abs == '' and sensor.deadband_pct == '':
+            return diff > 0
+
+        if sensor.deadband_abs != '' and diff > sensor.deadband_abs:
+            return True
+
+        if sensor.deadband_pct != '':
+            if float(last_value) == 0:
+                return diff > 0
+            if diff / abs(float(last_value)) * 100 > sensor.deadband_pct:
+                return True
+
+        return False
+
+    def forget(self, sensor=None):
+        """Сбрасывает запомненные последние значения (все или одного сенсора)"""
+        if sensor is None:
+            self.__last.clear()
+            return
+
+        self.__last.pop((sensor.controller_ip, sensor.modbus_id), None)
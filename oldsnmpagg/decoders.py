@@ -0,0 +1,97 @@
+import struct
+
+_numpy = False  # False - еще не загружался, None - не установлен
+
+# регистры контроллеров: порядок байт Big, порядок слов Little
+WORDS = struct.Struct('>HH')
+FLOAT32 = struct.Struct('>f')
+
+BIT_REGISTERS = ('coil', 'discrete')
+WORD_REGISTERS = ('input', 'holding_reg')
+
+
+def decode_uint16(registers, offset=0):
+    return registers[offset]
+
+
+def decode_float32(registers, offset=0):
+    return FLOAT32.unpack(WORDS.pack(registers[offset + 1], registers[offset]))[0]
+
+
+def decode_bit(bits, offset=0):
+    return int(bits[offset])
+
+
+# (register_type, data_type) -> (decoder, количество регистров)
+DECODERS = {}
+for _register_type in WORD_REGISTERS:
+    DECODERS[(_register_type, 'int')] = (decode_uint16, 1)
+    DECODERS[(_register_type, 'integer')] = (decode_uint16, 1)
+    DECODERS[(_register_type, 'real')] = (decode_float32, 2)
+
+# data_type, которого нет в таблице
+DEFAULT_DECODERS = {
+    'input': (decode_uint16, 1),
+    'holding_reg': (decode_uint16, 1),
+    'coil': (decode_bit, 1),
+    'discrete': (decode_bit, 1)
+}
+
+
+def load_numpy():
+    """
+    numpy грузится при первом векторном разборе, а не при импорте (~60 мс)
+    :return: модуль numpy или None, если не установлен
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def get_decoder(register_type, data_type):
+    """
+    :return: (decoder, количество регистров) или None для неизвестного типа регистра
+    """
+    try:
+        return DECODERS[(register_type, data_type)]
+    except KeyError:
+        return DEFAULT_DECODERS.get(register_type)
+
+
+def decode_block(register_type, data, items):
+    """
+    Разбирает результат блочного чтения сразу для всех сенсоров блока.
+    :param data: registers (input, holding_reg) или bits (coil, discrete) ответа
+    :param items: [(data_type, offset), ...]
+    :return: [value, ...] в порядке items
+    """
+    if register_type in BIT_REGISTERS:
+        return [int(data[offset]) for _, offset in items]
+
+    numpy = load_numpy() if len(items) >= 8 else None
+    if numpy is None:
+        values = []
+        for data_type, offset in items:
+            decoder, _ = get_decoder(register_type, data_type)
+            values.append(decoder(data, offset))
+        return values
+
+    registers = numpy.asarray(data, dtype=numpy.uint32)
+    offsets = numpy.fromiter((offset for _, offset in items), dtype=numpy.intp, count=len(items))
+    is_real = numpy.fromiter(
+        (get_decoder(register_type, data_type)[0] is decode_float32 for data_type, _ in items),
+        dtype=bool, count=len(items)
+    )
+
+    values = registers[offsets].astype(numpy.float64)
+    real_offsets = offsets[is_real]
+    if len(real_offsets) > 0:
+        words = (registers[real_offsets + 1] << 16) | registers[real_offsets]
+        values[is_real] = words.view(numpy.float32)
+
+    return [float(value) if real else int(value) for value, real in zip(values.tolist(), is_real.tolist())]
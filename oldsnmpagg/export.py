@@ -0,0 +1,190 @@
+"""
+Потоковая выгрузка истории из DataDB в CSV, NDJSON или бинарный колоночный формат.
+
+Строки читаются из курсора пачками (DataDB.iter_data_rows) и сразу пишутся в sink -
+любой объект с write(): файл, socket.makefile('wb'), sys.stdout. Память ограничена
+размером пачки, объекты Data не создаются.
+
+    exporter = HistoryExporter(data_db)
+    with open('history.csv', 'wb') as f:
+        exporter.export(f, sensors, from_date, to_date, fmt='csv')
+
+CSV - строки как у Data.as_csv(): date_time, controller_ip, modbus_id, value.
+NDJSON - объекты как у Data.as_dict() (+ count при агрегации).
+binary - заголовок MAGIC + длина + JSON ({'sensors': [[ip, modbus_id, oid], ...], ...}),
+затем блоки: <число строк n> и колонки sensor (n x uint32, индекс в sensors),
+date_time (n x float64), value (n x float64, нечисловые - NaN); блок с n=0 - конец.
+Все little-endian. Читается read_binary().
+"""
+
+import array
+import datetime
+import io
+import json
+import struct
+import sys
+
+from oldsnmpagg.datadb import DEFAULT_CHUNK_SIZE
+from oldsnmpagg.hotlog import HotLogger
+
+FORMATS = ('csv', 'ndjson', 'binary')
+
+MAGIC = b'SHX1'
+LENGTH = struct.Struct('<I')
+NAN = float('nan')
+
+
+def _column(typecode, values):
+    column = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def read_binary_header(stream):
+    """:return: заголовок бинарной выгрузки (dict), поток - на первом блоке"""
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a history export')
+    length = LENGTH.unpack(stream.read(LENGTH.size))[0]
+    return json.loads(stream.read(length).decode('utf-8'))
+
+
+def read_binary_block(stream):
+    """:return: колонки очередного блока (sensor, date_time, value) или None - конец выгрузки"""
+    count = LENGTH.unpack(stream.read(LENGTH.size))[0]
+    if count == 0:
+        return None
+    lst_columns = []
+    for typecode in ('I', 'd', 'd'):
+        column = array.array(typecode)
+        column.frombytes(stream.read(count * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        lst_columns.append(column)
+    return lst_columns
+
+
+def read_binary(stream):
+    """
+    Читает бинарную выгрузку
+    :return: (header, генератор (controller_ip, modbus_id, oid, date_time, value))
+    """
+    header = read_binary_header(stream)
+
+    def rows():
+        sensors = header['sensors']
+        while True:
+            lst_columns = read_binary_block(stream)
+            if lst_columns is None:
+                return
+            for index, date_time, value in zip(*lst_columns):
+                controller_ip, modbus_id, oid = sensors[index]
+                yield controller_ip, modbus_id, oid, date_time, value
+
+    return header, rows()
+
+
+class HistoryExporter(object):
+
+    def __init__(self, data_db, chunk_size=DEFAULT_CHUNK_SIZE, logger=None):
+        self.data_db = data_db
+        self.chunk_size = chunk_size
+        self.__log = HotLogger(logger)
+
+    def export(self, sink, sensors, from_date=None, to_date=None, fmt='csv', aggregate=None, func='avg'):
+        """
+        :param sink: объект с write(); текстовым (io.TextIOBase) пишутся str, остальным - bytes
+        :param sensors: [Sensor, ...]
+        :param aggregate: None - сырые отсчеты, N - агрегация по интервалам N секунд (func)
+        :return: число выгруженных строк
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Unknown export format: {0}'.format(fmt))
+
+        text = isinstance(sink, io.TextIOBase)
+        oids = {(sensor.controller_ip, sensor.modbus_id): sensor.oid for sensor in sensors}
+        chunks = self.data_db.iter_data_rows(sensors, from_date, to_date, self.chunk_size, aggregate, func)
+
+        if fmt == 'binary':
+            if text:
+                raise ValueError('Binary export needs a binary sink')
+            return self.__export_binary(sink, oids, chunks, aggregate, func)
+
+        format_chunk = self.__csv_chunk if fmt == 'csv' else self.__ndjson_chunk
+        rows = 0
+        for lst_rows in chunks:
+            chunk = format_chunk(lst_rows, oids, aggregate)
+            sink.write(chunk if text else chunk.encode('utf-8'))
+            rows += len(lst_rows)
+            self.__log.debug('Exported {0} rows', rows)
+        return rows
+
+    @staticmethod
+    def __iso(unix_time, fromtimestamp=datetime.datetime.fromtimestamp):
+        return fromtimestamp(unix_time).isoformat()
+
+    def __csv_chunk(self, lst_rows, oids, aggregate):
+        iso = self.__iso
+        return ''.join([
+            '{0}, {1}, {2}, {3}\n'.format(iso(date_time), controller_ip, modbus_id, value)
+            for controller_ip, modbus_id, oid, value, date_time, _ in lst_rows
+        ])
+
+    def __ndjson_chunk(self, lst_rows, oids, aggregate):
+        iso = self.__iso
+        dumps = json.dumps
+        if aggregate is None:
+            return ''.join([
+                dumps({
+                    'id': item_id,
+                    'value': value,
+                    'date_time': iso(date_time),
+                    'controller_ip': controller_ip,
+                    'modbus_id': modbus_id,
+                    'oid': oid
+                }) + '\n'
+                for controller_ip, modbus_id, oid, value, date_time, item_id in lst_rows
+            ])
+        return ''.join([
+            dumps({
+                'id': None,
+                'value': value,
+                'date_time': iso(date_time),
+                'controller_ip': controller_ip,
+                'modbus_id': modbus_id,
+                'oid': oids.get((controller_ip, modbus_id), oid),
+                'count': count
+            }) + '\n'
+            for controller_ip, modbus_id, oid, value, date_time, count in lst_rows
+        ])
+
+    def __export_binary(self, sink, oids, chunks, aggregate, func):
+        lst_sensors = sorted(oids)
+        index = {key: i for i, key in enumerate(lst_sensors)}
+        header = json.dumps({
+            'sensors': [[ip, modbus_id, oids[(ip, modbus_id)]] for ip, modbus_id in lst_sensors],
+            'aggregate': aggregate,
+            'func': func if aggregate is not None else None
+        }).encode('utf-8')
+        sink.write(MAGIC + LENGTH.pack(len(header)) + header)
+
+        rows = 0
+        for lst_rows in chunks:
+            sink.write(b''.join((
+                LENGTH.pack(len(lst_rows)),
+                _column('I', [index[(row[0], row[1])] for row in lst_rows]),
+                _column('d', [row[4] for row in lst_rows]),
+                _column('d', [
+                    row[3] if type(row[3]) is float else _to_float(row[3]) for row in lst_rows
+                ]),
+            )))
+            rows += len(lst_rows)
+        sink.write(LENGTH.pack(0))
+        return rows
@@ -0,0 +1,200 @@
+"""
+LRU-кеш результатов DataDB.get_data для автообновляемых графиков, ограниченный по памяти.
+
+Ключ: (controller_ip, modbus_id, unix from, unix to) - interval в ключ не входит, прореживание
+делается по закешированным строкам. Хранятся сырые строки (id, value, date_time) в порядке id
+и max_id - наибольший id таблицы data на момент чтения. Диапазоны до текущего времени
+(to_date = now() при каждом обновлении) DataDB кладет с unix to = inf - одна запись на любой
+to_date, верхняя граница применяется при чтении (max_date - без фильтра, если не нужен).
+
+Запись отсчета с date_time внутри диапазона записи помечает ее устаревшей (note_rows), и при
+следующем чтении DataDB дочитывает только строки с id > max_id (extend). Диапазоны в прошлом,
+куда ничего не пишется, живут в кеше, пока их не вытеснят или не обрежет хранение (trim).
+"""
+
+import collections
+import sys
+import threading
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def sensor_key(controller_ip, modbus_id):
+    """modbus_id из CSV бывает строкой: '5' и 5 - один сенсор (как и для SQLite)"""
+    try:
+        return controller_ip, int(modbus_id)
+    except (TypeError, ValueError):
+        return controller_ip, modbus_id
+
+
+def _rows_size(lst_rows):
+    """Оценка памяти под строки по первой строке (точный подсчет стоит как сам запрос)"""
+    if not lst_rows:
+        return sys.getsizeof(lst_rows)
+    row = lst_rows[0]
+    row_size = sys.getsizeof(row) + sum(sys.getsizeof(item) for item in row) + 8  # + ссылка в списке
+    return sys.getsizeof(lst_rows) + row_size * len(lst_rows)
+
+
+class _Entry(object):
+    __slots__ = ('rows', 'max_id', 'max_date', 'stale', 'size')
+
+    def __init__(self, rows, max_id):
+        self.rows = rows
+        self.max_id = max_id
+        self.max_date = max((row[2] for row in rows), default=float('-inf'))
+        self.stale = False
+        self.size = _rows_size(rows)
+
+
+class HistoryCache(object):
+    """
+    Вызывающий (DataDB) сам читает базу: get() -> None - прочитать и put(),
+    entry.stale - дочитать id > entry.max_id и extend(), иначе - entry.rows как есть.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()  # {key: _Entry}, от давно не читанных к свежим
+        self.__by_sensor = {}                        # {sensor_key: {key, ...}}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        """:return: _Entry (делает запись самой свежей) или None"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            if entry.stale:
+                self.refreshes += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, key, lst_rows, max_id):
+        """
+        Кладет результат запроса
+        :return: _Entry или None - больше max_bytes, не кешируется
+        """
+        entry = _Entry(lst_rows, max_id)
+        if entry.size > self.max_bytes:
+            return None
+        with self.__lock:
+            self.__remove(key)
+            self.__entries[key] = entry
+            self.__by_sensor.setdefault(key[:2], set()).add(key)
+            self.bytes += entry.size
+            self.__evict()
+        return entry
+
+    def extend(self, key, lst_rows, max_id):
+        """Дописывает строки с id > entry.max_id, запись больше не устаревшая"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return
+            entry.rows.extend(lst_rows)
+            entry.max_id = max(entry.max_id, max_id)
+            entry.max_date = max(entry.max_date, max((row[2] for row in lst_rows), default=entry.max_date))
+            entry.stale = False
+            self.bytes -= entry.size
+            entry.size = _rows_size(entry.rows)
+            self.bytes += entry.size
+            self.__evict()
+
+    def note_rows(self, lst_rows):
+        """
+        Новые строки в таблице data: помечает устаревшими записи, в диапазон которых они попали
+        :param lst_rows: [(controller_ip, oid, modbus_id, value, date_time - unix time), ...]
+        """
+        if not self.__by_sensor:
+            return
+        with self.__lock:
+            by_sensor = self.__by_sensor
+            entries = self.__entries
+            for controller_ip, _, modbus_id, _, date_time in lst_rows:
+                keys = by_sensor.get(sensor_key(controller_ip, modbus_id))
+                if not keys:
+                    continue
+                for key in keys:
+                    if key[2] <= date_time <= key[3]:
+                        entries[key].stale = True
+
+    def mark_all_stale(self):
+        """Базу менял кто-то еще (другое соединение): все записи дочитать при следующем чтении"""
+        with self.__lock:
+            for entry in self.__entries.values():
+                entry.stale = True
+
+    def trim(self, before=None, before_id=None, key_of_sensor=None):
+        """
+        Удаление из базы (хранение): выбрасывает из записей строки с date_time <= before
+        и/или id < before_id. Записи целиком до before удаляются.
+        :param key_of_sensor: sensor_key() - только записи этого сенсора, None - все
+        """
+        with self.__lock:
+            if key_of_sensor is None:
+                lst_keys = list(self.__entries)
+            else:
+                lst_keys = list(self.__by_sensor.get(key_of_sensor, ()))
+            for key in lst_keys:
+                if before is not None and key[3] <= before:
+                    self.__remove(key)
+                    continue
+                entry = self.__entries[key]
+                if before is not None and key[2] <= before:
+                    entry.rows = [row for row in entry.rows if row[2] > before]
+                if before_id is not None and entry.rows and entry.rows[0][0] < before_id:
+                    entry.rows = [row for row in entry.rows if row[0] >= before_id]
+                self.bytes -= entry.size
+                entry.size = _rows_size(entry.rows)
+                self.bytes += entry.size
+
+    def sensor_keys(self):
+        """:return: [sensor_key, ...] сенсоров, у которых есть записи"""
+        with self.__lock:
+            return list(self.__by_sensor)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__by_sensor.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.__entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'refreshes': self.refreshes,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        keys = self.__by_sensor.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.__by_sensor[key[:2]]
+
+    def __evict(self):
+        while self.bytes > self.max_bytes and self.__entries:
+            self.__remove(next(iter(self.__entries)))
+            self.evictions += 1
@@ -0,0 +1,58 @@
+import logging
+import weakref
+
+# общий выключатель логирования на горячих путях (опрос, запись истории)
+ENABLED = True
+
+_instances = weakref.WeakSet()
+
+
+def set_enabled(enabled):
+    """Включает/выключает логирование всех HotLogger процесса"""
+    global ENABLED
+    ENABLED = bool(enabled)
+    for instance in list(_instances):
+        instance.refresh()
+
+
+class HotLogger(object):
+    """
+    Обертка над logging.Logger для горячих путей.
+    Уровни проверяются один раз (при создании и в refresh()), а не на каждый вызов;
+    сообщение форматируется ('{0}'.format(*args)) только если уровень включен.
+    Для совсем бесплатной проверки: if log.debug_on: log.debug(...)
+    Логгер может быть None - тогда все выключено.
+    Важно: после logger.setLevel() (и смены уровня родителя) нужно вызвать refresh()
+    у оберток этого логгера, иначе они так и работают со старыми уровнями.
+    set_enabled() обновляет все обертки сама.
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.refresh()
+        _instances.add(self)
+
+    def refresh(self):
+        """Перечитывает уровни логгера (после setLevel или set_enabled)"""
+        logger = self.logger
+        on = ENABLED and logger is not None
+        self.debug_on = on and logger.isEnabledFor(logging.DEBUG)
+        self.info_on = on and logger.isEnabledFor(logging.INFO)
+        self.warning_on = on and logger.isEnabledFor(logging.WARNING)
+        self.error_on = on and logger.isEnabledFor(logging.ERROR)
+
+    def debug(self, msg, *args):
+        if self.debug_on:
+            self.logger.debug(msg.format(*args) if args else msg)
+
+    def info(self, msg, *args):
+        if self.info_on:
+            self.logger.info(msg.format(*args) if args else msg)
+
+    def warning(self, msg, *args):
+        if self.warning_on:
+            self.logger.warning(msg.format(*args) if args else msg)
+
+    def error(self, msg, *args):
+        if self.error_on:
+            self.logger.error(msg.format(*args) if args else msg)
@@ -0,0 +1,278 @@
+"""
+Встроенные метрики без внешних зависимостей: счетчики, gauge и гистограммы задержек
+в стиле HDR (лог-линейные корзины, точность ~3%).
+
+Запись метрики на горячем пути - несколько целочисленных операций без блокировок
+(доли микросекунды); под GIL возможна потеря единичных инкрементов из разных потоков,
+для метрик это допустимо.
+
+    from oldsnmpagg.metrics import REGISTRY
+    hist = REGISTRY.histogram('modbus_read_seconds', controller='10.0.0.1')
+    start = time.perf_counter()
+    ...
+    hist.record(time.perf_counter() - start)
+
+Снимки: REGISTRY.snapshot() (dict), REGISTRY.to_text() / write_text(path) (текстовый формат
+Prometheus), REGISTRY.snmp_oids() (OID под DEFAULT_ROOT_OID.0).
+"""
+
+import os
+import threading
+
+# гистограмма: значения в микросекундах, 2**SUB_BITS линейных корзин на каждую октаву
+SUB_BITS = 5
+SHIFT_FROM = SUB_BITS + 1
+MAX_MICROSECONDS = 2 ** 32 - 1  # ~71 минута, все, что дольше, попадает в последнюю корзину
+BUCKETS = ((MAX_MICROSECONDS.bit_length() - SHIFT_FROM) << SUB_BITS) + 2 ** SHIFT_FROM
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# поддерево метрик в SNMP: <root_oid>.0.1.N - имя ряда, <root_oid>.0.2.N - значение
+METRICS_OID = '0'
+
+
+def _bucket_bounds(index):
+    """:return: (нижняя, верхняя) граница корзины в микросекундах"""
+    if index < 2 ** SHIFT_FROM:
+        return index, index
+    shift = (index >> SUB_BITS) - 1
+    mantissa = index - (shift << SUB_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(object):
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, n=1):
+        self.value += n
+
+    def dec(self, n=1):
+        self.value -= n
+
+    def snapshot(self):
+        return self.value
+
+
+class _Timer(object):
+    def __init__(self, histogram, clock):
+        self.histogram = histogram
+        self.clock = clock
+
+    def __enter__(self):
+        self.start = self.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.record(self.clock() - self.start)
+
+
+class Histogram(object):
+    """
+    Гистограмма длительностей (в секундах). Хранит count, sum, max и счетчики корзин,
+    квантили вычисляются только в snapshot()
+    """
+    kind = 'summary'
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        if value > MAX_MICROSECONDS:
+            value = MAX_MICROSECONDS
+        elif value < 0:
+            value = 0
+        bits = value.bit_length()
+        if bits > SHIFT_FROM:
+            shift = bits - SHIFT_FROM
+            value = (shift << SUB_BITS) + (value >> shift)
+        self.counts[value] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def time(self, clock=None):
+        """with hist.time(): ... - для мест, где лишний вызов не важен"""
+        if clock is None:
+            from time import perf_counter as clock
+        return _Timer(self, clock)
+
+    def quantile(self, q, counts=None, count=None):
+        """:return: верхняя граница корзины, в которую попал квантиль q, в секундах"""
+        if counts is None:
+            counts = list(self.counts)
+            count = sum(counts)
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if n and seen >= rank:
+                return _bucket_bounds(index)[1] / 1000000.0
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def snapshot(self):
+        counts = list(self.counts)
+        count = sum(counts)
+        result = {
+            'count': count,
+            'sum': self.sum,
+            'max': self.max,
+        }
+        for q in QUANTILES:
+            result[q] = min(self.quantile(q, counts, count), self.max)
+        return result
+
+
+class MetricsRegistry(object):
+    """
+    Метрики по (имени, меткам). counter/gauge/histogram возвращают существующую метрику
+    или создают новую - объект стоит получить один раз (например, в __init__) и держать у себя
+    """
+
+    def __init__(self):
+        self.__metrics = {}  # {(name, ((label, value), ...)): metric}
+        self.__lock = threading.Lock()
+
+    def __get(self, cls, name, labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        metric = self.__metrics.get(key)
+        if metric is None:
+            with self.__lock:
+                metric = self.__metrics.setdefault(key, cls())
+        if not isinstance(metric, cls):
+            raise TypeError('Metric {0} is already registered as {1}'.format(name, metric.kind))
+        return metric
+
+    def counter(self, name, **labels):
+        return self.__get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self.__get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self.__get(Histogram, name, labels)
+
+    def clear(self):
+        with self.__lock:
+            self.__metrics = {}
+
+    def snapshot(self):
+        """
+        :return: {name: [{'labels': {...}, 'type': 'counter', 'value': ...}, ...]}
+            для гистограмм value - {'count', 'sum', 'max', 0.5, 0.9, 0.99, 0.999}
+        """
+        result = {}
+        for (name, labels), metric in sorted(self.__metrics.items(), key=lambda item: item[0]):
+            result.setdefault(name, []).append({
+                'labels': dict(labels),
+                'type': metric.kind,
+                'value': metric.snapshot()
+            })
+        return result
+
+    def series(self):
+        """
+        Плоский список рядов для текстового формата и SNMP
+        :return: [(name, labels, kind, value), ...]
+        """
+        lst_series = []
+        for name, lst_metrics in self.snapshot().items():
+            for metric in lst_metrics:
+                labels = metric['labels']
+                value = metric['value']
+                if metric['type'] != 'summary':
+                    lst_series.append((name, labels, metric['type'], value))
+                    continue
+                for q in QUANTILES:
+                    lst_series.append((name, dict(labels, quantile=str(q)), 'summary', value[q]))
+                lst_series.append((name + '_sum', labels, 'summary', value['sum']))
+                lst_series.append((name + '_count', labels, 'summary', value['count']))
+                lst_series.append((name + '_max', labels, 'summary', value['max']))
+        return lst_series
+
+    @staticmethod
+    def __series_name(name, labels):
+        if not labels:
+            return name
+        return '{0}{{{1}}}'.format(
+            name, ','.join('{0}="{1}"'.format(k, str(v).replace('"', '\\"')) for k, v in sorted(labels.items()))
+        )
+
+    def to_text(self):
+        """:return: текст в формате Prometheus exposition"""
+        lines = []
+        typed = set()
+        for name, labels, kind, value in self.series():
+            base = name
+            if kind == 'summary':
+                for suffix in ('_sum', '_count', '_max'):
+                    if name.endswith(suffix):
+                        base = name[:-len(suffix)]
+            if base not in typed:
+                typed.add(base)
+                lines.append('# TYPE {0} {1}'.format(base, kind))
+            lines.append('{0} {1}'.format(self.__series_name(name, labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def write_text(self, path):
+        """Атомарно (через временный файл) пишет to_text() в path, например для node_exporter"""
+        tmp_path = '{0}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_text())
+        os.replace(tmp_path, path)
+        return True
+
+    def snmp_oids(self, root_oid=None):
+        """
+        :return: [(oid, snmp_type, value), ...] отсортированные по OID:
+            <root_oid>.0.1.N - имя ряда (string), <root_oid>.0.2.N - значение
+            (integer для целых, string для дробных - как real у сенсоров)
+        """
+        if root_oid is None:
+            from oldsnmpagg.controllers import DEFAULT_ROOT_OID
+            root_oid = DEFAULT_ROOT_OID
+
+        names = []
+        values = []
+        for i, (name, labels, kind, value) in enumerate(self.series(), 1):
+            names.append(('{0}.{1}.1.{2}'.format(root_oid, METRICS_OID, i), 'string', self.__series_name(name, labels)))
+            if isinstance(value, int):
+                values.append(('{0}.{1}.2.{2}'.format(root_oid, METRICS_OID, i), 'integer', value))
+            else:
+                values.append(('{0}.{1}.2.{2}'.format(root_oid, METRICS_OID, i), 'string', str(value)))
+        return names + values
+
+
+# общий реестр процесса
+REGISTRY = MetricsRegistry()
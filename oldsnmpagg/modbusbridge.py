@@ -1,16 +1,34 @@
-from pymodbus.constants import Endian
-from pymodbus.utilities import make_byte_string
-from pymodbus.payload import BinaryPayloadBuilder
-from pymodbus.payload import BinaryPayloadDecoder
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
-from pymodbus.exceptions import ModbusException, ModbusIOException
-from pymodbus.bit_read_message import ReadDiscreteInputsResponse, ReadCoilsResponse
-from pymodbus.register_read_message import ReadHoldingRegistersResponse, ReadInputRegistersResponse
 from struct import unpack,pack
+from time import perf_counter
+
+from oldsnmpagg.wrappers import Sensor
+from oldsnmpagg.hotlog import HotLogger
+from oldsnmpagg.decoders import get_decoder, decode_block, BIT_REGISTERS
+from oldsnmpagg.metrics import REGISTRY
+
+# pymodbus (и pipeline, который на нем построен) грузится при создании первого ModBusBridge -
+# утилитам, которым нужны только константы модуля, импорт pymodbus не нужен (~100 мс)
+Endian = None
+BinaryPayloadBuilder = None
+ModbusClient = None
+ModbusException = None
+ModbusIOException = None
+PipelinedModbusClient = None
 
-from snmpagg.wrappers import Sensor
 MODBUS_TIMEOUT = 100
 MAX_ATTEMPT = 1
+MAX_WRITE_REGISTERS = 123  # ограничения Modbus на один запрос
+MAX_WRITE_COILS = 1968
+MAX_READ_REGISTERS = 125
+MAX_READ_BITS = 2000
+
+WRITE_LIMITS = {
+    'coil': MAX_WRITE_COILS,
+    'holding_reg': MAX_WRITE_REGISTERS
+}
+
+# register_type -> (класс запроса pymodbus, максимум за один запрос); заполняется _load_pymodbus()
+READ_REQUESTS = {}
 
 REGISTERS = {
     'integer': 1,
@@ -19,14 +37,41 @@ REGISTERS = {
 }
 
 
-class ExtendedBinaryPayloadBuilder(BinaryPayloadBuilder):
-    def add_16bit_float(self, value):
-        ''' Adds a 32 bit float to the buffer
+def _load_pymodbus():
+    global Endian, BinaryPayloadBuilder, ModbusClient, ModbusException, ModbusIOException, PipelinedModbusClient
+    if ModbusClient is not None:
+        return
+    from pymodbus.constants import Endian
+    from pymodbus.payload import BinaryPayloadBuilder
+    from pymodbus.exceptions import ModbusException, ModbusIOException
+    from pymodbus.bit_read_message import ReadDiscreteInputsRequest, ReadCoilsRequest
+    from pymodbus.register_read_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest
+    from oldsnmpagg.pipeline import PipelinedModbusClient
+    READ_REQUESTS.update({
+        'input': (ReadInputRegistersRequest, MAX_READ_REGISTERS),
+        'holding_reg': (ReadHoldingRegistersRequest, MAX_READ_REGISTERS),
+        'discrete': (ReadDiscreteInputsRequest, MAX_READ_BITS),
+        'coil': (ReadCoilsRequest, MAX_READ_BITS)
+    })
+    from pymodbus.client.sync import ModbusTcpClient as ModbusClient  # последним: признак загрузки
+
+
+def __getattr__(name):
+    if name == 'ExtendedBinaryPayloadBuilder':
+        _load_pymodbus()
+
+        class ExtendedBinaryPayloadBuilder(BinaryPayloadBuilder):
+            def add_16bit_float(self, value):
+                ''' Adds a 32 bit float to the buffer
+
+                :param value: The value to add to the buffer
+                '''
+                fstring = self._endian + 'e'
+                self._payload.append(pack('e', value))
 
-        :param value: The value to add to the buffer
-        '''
-        fstring = self._endian + 'e'
-        self._payload.append(pack('e', value))
+        globals()[name] = ExtendedBinaryPayloadBuilder
+        return ExtendedBinaryPayloadBuilder
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
 
 
 #class ExtendedBinaryPayloadDecoder(BinaryPayloadDecoder):
@@ -51,11 +96,36 @@ class ModBusBridge(object):
 
     connect_state = False
 
-    def __init__(self, addr, port, timeout=MODBUS_TIMEOUT, logger=None):
+    def __init__(self, addr, port, timeout=MODBUS_TIMEOUT, logger=None, cache=None, pipeline_window=0, metrics=None):
+        """
+        :param cache: ReadCache, общий для всех мостов процесса (None - без кеша)
+        :param pipeline_window: > 0 - держать столько запросов в полете на одном соединении
+            (PipelinedModbusClient), 0 - обычный синхронный ModbusTcpClient
+        :param metrics: MetricsRegistry (None - общий metrics.REGISTRY); метрики с меткой controller=addr
+        """
         self.logger = logger
-        self.client = ModbusClient(addr, port=port, timeout=timeout)
+        self.__log = HotLogger(logger)
+        self.addr = addr
+        self.port = port
+        self.cache = cache
+        self.__queued = {}
+        self.timeout = timeout
+        _load_pymodbus()
+        if pipeline_window > 0:
+            self.client = PipelinedModbusClient(addr, port=port, window=pipeline_window, timeout=timeout, logger=logger)
+        else:
+            self.client = ModbusClient(addr, port=port, timeout=timeout)
         self.connect_state = self.client.connect()
 
+        if metrics is None:
+            metrics = REGISTRY
+        self.__read_time = metrics.histogram('modbus_read_seconds', controller=addr)
+        self.__read_errors = metrics.counter('modbus_read_errors_total', controller=addr)
+        self.__write_time = metrics.histogram('modbus_write_seconds', controller=addr)
+        self.__write_errors = metrics.counter('modbus_write_errors_total', controller=addr)
+        self.__block_time = metrics.histogram('modbus_get_values_seconds', controller=addr)
+        metrics.gauge('modbus_connected', controller=addr).set(1 if self.connect_state else 0)
+
     def __del__(self):
         self.client.close()
 
@@ -66,140 +136,354 @@ class ModBusBridge(object):
         except KeyError:
             return REGISTERS['integer']
 
-    def __decode(self, result, register_num):
-        if type(result) == ReadInputRegistersResponse:
-            self.logger.debug('Decode ReadInputRegistersResponse')
-            return self.__input_decode(result, register_num)
-        elif type(result) == ReadDiscreteInputsResponse:
-            self.logger.debug('Decode ReadDiscreteInputsResponse')
-            return self.__discrete_decode(result)
-        elif type(result) == ReadCoilsResponse:
-            self.logger.debug('Decode ReadCoilsResponse')
-            return self.__coil_decode(result)
-        elif type(result) == ReadHoldingRegistersResponse:
-            self.logger.debug('Decode ReadHoldingRegistersResponse')
-            return self.__holding_decode(result, register_num)
-
-    def __input_decode(self, result, register_num):
-        decoder = BinaryPayloadDecoder.fromRegisters(result.registers,
-                                                     byteorder=Endian.Big, wordorder=Endian.Little)
-
-        if register_num == REGISTERS['integer']:
-            return decoder.decode_16bit_uint()
-        elif register_num == REGISTERS['real']:
-            return decoder.decode_32bit_float()
-
-        self.logger.error('Unknown register type!')
-        return None
-
-    def __holding_decode(self, result, register_num):
-        return self.__input_decode(result, register_num)
-
     @staticmethod
-    def __get_fist_bit(result):
-        return int(result.bits[0])
+    def __decode(result, sensor):
+        decoder, _ = get_decoder(sensor.register_type, sensor.data_type)
+        if sensor.register_type in BIT_REGISTERS:
+            return decoder(result.bits)
+        return decoder(result.registers)
 
-    @staticmethod
-    def __discrete_decode(result):
-        return ModBusBridge.__get_fist_bit(result)
+    def __cache_key(self, sensor):
+        return self.addr, self.port, sensor.register_type, sensor.modbus_id, sensor.get_unit_id()
 
     @staticmethod
-    def __coil_decode(result):
-        return ModBusBridge.__get_fist_bit(result)
+    def __register_key(sensor):
+        return sensor.get_unit_id(), sensor.register_type, sensor.modbus_id
 
     def set_value(self, sensor: Sensor, value, attempt=MAX_ATTEMPT):
+        start = perf_counter()
+        if self.cache is None:
+            result = self.__write_value(sensor, value, attempt)
+        else:
+            # сбрасываем и до записи (идущее чтение не попадет в кеш), и после
+            self.cache.invalidate(self.__cache_key(sensor))
+            try:
+                result = self.__write_value(sensor, value, attempt)
+            finally:
+                self.cache.invalidate(self.__cache_key(sensor))
+
+        self.__write_time.record(perf_counter() - start)
+        if result is None:
+            self.__write_errors.inc()
+        return result
+
+    def __write_value(self, sensor: Sensor, value, attempt):
+        """
+        :return: True - записано, None - ошибка
+        """
         while attempt > 0:
-            register_num = self.__get_register_number(sensor.data_type)
             try:
                 if sensor.register_type == 'coil':
-                    self.logger.debug('    Write Coil Register: {0}({1})'.format(value, type(value)))
-                    result = self.client.write_coil(sensor.modbus_id, value, unit=1)
+                    self.__log.debug('    Write Coil Register: {0}({1})', value, type(value))
+                    result = self.client.write_coil(sensor.modbus_id, value, unit=sensor.get_unit_id())
 
                 elif sensor.register_type == 'holding_reg':
-                    builder = BinaryPayloadBuilder(byteorder=Endian.Big, wordorder=Endian.Little)
-                    if type(value) == int:
-                        builder.add_16bit_uint(value)
-                    else:
-                        builder.add_32bit_float(value)
-
-                    registers = builder.to_registers()
-                    self.logger.debug('registers: {0}'.format(registers))
+                    registers = self.__encode_registers(value)
+                    self.__log.debug('registers: {0}', registers)
 
-                    result = self.client.write_registers(sensor.modbus_id, registers, unit=1)
+                    result = self.client.write_registers(sensor.modbus_id, registers, unit=sensor.get_unit_id())
 
                 else:
-                    self.logger.debug('   Returned value: None')
+                    self.__log.debug('   Returned value: None')
                     return None
 
-                if type(result) in [ModbusIOException, ModbusException]:
-                    self.logger.error('{0} ID={1}, TYPE={2}'.format(result, sensor.modbus_id, sensor.data_type))
+                if self.__is_error(result):
+                    self.__log.error('{0} ID={1}, TYPE={2}', result, sensor.modbus_id, sensor.data_type)
                     attempt -= 1
                     continue
 
-                return self.__decode(result, register_num)
+                return True
 
             except Exception as e:
-                self.logger.error('Unknown error. ID={0} TYPE={1}'.format(sensor.modbus_id, sensor.data_type))
-                self.logger.debug('{0} - {1}'.format(type(e), e))
+                self.__log.error('Unknown error. ID={0} TYPE={1}', sensor.modbus_id, sensor.data_type)
+                self.__log.debug('{0} - {1}', type(e), e)
                 attempt -= 1
 
-        self.logger.debug('{0} errors in MAX attempt times. Return None!')
+        self.__log.debug('{0} errors in MAX attempt times. Return None!')
         return None
 
+    @staticmethod
+    def __encode_registers(value):
+        builder = BinaryPayloadBuilder(byteorder=Endian.Big, wordorder=Endian.Little)
+        if type(value) == int:
+            builder.add_16bit_uint(value)
+        else:
+            builder.add_32bit_float(value)
+        return builder.to_registers()
+
+    @staticmethod
+    def __is_error(result):
+        if result is None or type(result) in [ModbusIOException, ModbusException]:
+            return True
+        return hasattr(result, 'isError') and result.isError()
+
+    def queue_value(self, sensor: Sensor, value):
+        """
+        Откладывает запись до flush_values. Повторная запись в тот же регистр
+        до flush заменяет предыдущую (last-write-wins)
+        """
+        self.__queued[self.__register_key(sensor)] = (sensor, value)
+
+    def flush_values(self, attempt=MAX_ATTEMPT):
+        """Записывает все отложенные значения через set_values"""
+        queued = self.__queued
+        self.__queued = {}
+        return self.set_values({sensor: value for sensor, value in queued.values()}, attempt=attempt)
+
+    def set_values(self, st_values, attempt=MAX_ATTEMPT):
+        """
+        Пишет много значений за минимум запросов: соседние holding регистры одного unit id
+        объединяются в один write_registers, соседние coil - в один write_coils.
+        Если в st_values несколько сенсоров указывают на один регистр, пишется последнее значение.
+        :param st_values: {sensor: value, ...}
+        :return: {sensor: True/False, ...}
+        """
+        # (unit_id, register_type, modbus_id) -> (sensor, value); последний выигрывает
+        registers = {}
+        for sensor, value in st_values.items():
+            registers[self.__register_key(sensor)] = (sensor, value)
+
+        groups = {}  # {(unit_id, register_type): [(modbus_id, sensor, value), ...]}
+        for (unit_id, register_type, modbus_id), (sensor, value) in registers.items():
+            if register_type in WRITE_LIMITS:
+                groups.setdefault((unit_id, register_type), []).append((modbus_id, sensor, value))
+
+        written = {}
+        for (unit_id, register_type), items in groups.items():
+            items.sort(key=lambda item: item[0])
+            if register_type == 'coil':
+                write_func = self.client.write_coils
+            else:
+                write_func = self.client.write_registers
+            for address, payload, lst_keys in self.__build_write_blocks(
+                    unit_id, register_type, items, WRITE_LIMITS[register_type]):
+                ok = self.__write_block(write_func, unit_id, address, payload, attempt)
+                for key in lst_keys:
+                    written[key] = ok
+
+        result = {}
+        for sensor in st_values:
+            result[sensor] = written.get(self.__register_key(sensor), False)
+            if self.cache is not None:
+                self.cache.invalidate(self.__cache_key(sensor))
+
+        return result
+
+    def __build_write_blocks(self, unit_id, register_type, items, max_count):
+        """
+        Собирает непрерывные блоки из отсортированных по адресу значений
+        :return: [(address, [payload...], [(unit_id, register_type, modbus_id), ...]), ...]
+        """
+        blocks = []
+        next_address = None
+        for modbus_id, sensor, value in items:
+            if register_type == 'coil':
+                payload = [bool(value)]
+            else:
+                payload = self.__encode_registers(value)
+
+            if next_address == modbus_id and len(blocks[-1][1]) + len(payload) <= max_count:
+                blocks[-1][1].extend(payload)
+                blocks[-1][2].append((unit_id, register_type, modbus_id))
+            else:
+                blocks.append((modbus_id, list(payload), [(unit_id, register_type, modbus_id)]))
+            next_address = modbus_id + len(payload)
+
+        return blocks
+
+    def __write_block(self, write_func, unit_id, address, payload, attempt):
+        while attempt > 0:
+            try:
+                self.__debug('    Write block: unit={0} address={1} count={2}', unit_id, address, len(payload))
+                result = write_func(address, payload, unit=unit_id)
+                if not self.__is_error(result):
+                    return True
+                self.__error('{0} unit={1} address={2} count={3}', result, unit_id, address, len(payload))
+
+            except Exception as e:
+                self.__error('Unknown error. unit={0} address={1} count={2}', unit_id, address, len(payload))
+                self.__debug('{0} - {1}', type(e), e)
+
+            attempt -= 1
+
+        return False
+
     def get_value(self, sensor: Sensor, attempt=MAX_ATTEMPT):
+        start = perf_counter()
+        if self.cache is None:
+            value = self.__read_value(sensor, attempt)
+        else:
+            value = self.cache.get(self.__cache_key(sensor), lambda: self.__read_value(sensor, attempt))
+
+        self.__read_time.record(perf_counter() - start)
+        if value is None:
+            self.__read_errors.inc()
+        return value
+
+    def __read_value(self, sensor: Sensor, attempt):
         while attempt > 0:
             register_num = self.__get_register_number(sensor.data_type)
-            self.logger.debug('register_num: {0}'.format(register_num))
+            self.__log.debug('register_num: {0}', register_num)
 
             try:
                 if sensor.register_type == 'input':
-                    self.logger.debug('    Input Register')
-                    result = self.client.read_input_registers(sensor.modbus_id, register_num, unit=1)
+                    self.__log.debug('    Input Register')
+                    result = self.client.read_input_registers(sensor.modbus_id, register_num, unit=sensor.get_unit_id())
                 elif sensor.register_type == 'discrete':
-                    self.logger.debug('    Discrete Register')
-                    result = self.client.read_discrete_inputs(sensor.modbus_id, 1, unit=1)
+                    self.__log.debug('    Discrete Register')
+                    result = self.client.read_discrete_inputs(sensor.modbus_id, 1, unit=sensor.get_unit_id())
                 elif sensor.register_type == 'coil':
-                    self.logger.debug('    Coil Register')
-                    result = self.client.read_coils(sensor.modbus_id, 1, unit=1)
+                    self.__log.debug('    Coil Register')
+                    result = self.client.read_coils(sensor.modbus_id, 1, unit=sensor.get_unit_id())
                 elif sensor.register_type == 'holding_reg':
-                    self.logger.debug('    Holding Register')
-                    result = self.client.read_holding_registers(sensor.modbus_id, register_num, unit=1)
+                    self.__log.debug('    Holding Register')
+                    result = self.client.read_holding_registers(sensor.modbus_id, register_num, unit=sensor.get_unit_id())
                 else:
-                    self.logger.debug('   Returned value: None')
+                    self.__log.debug('   Returned value: None')
                     return None
 
                 if type(result) in [ModbusIOException, ModbusException]:
-                    self.logger.error('{0} ID={1}, TYPE={2}'.format(result, sensor.modbus_id, sensor.data_type))
+                    self.__log.error('{0} ID={1}, TYPE={2}', result, sensor.modbus_id, sensor.data_type)
                     attempt -= 1
                     continue
 
-                decoded_result = self.__decode(result, register_num)
-                self.logger.debug('   Returned value: {0}'.format(decoded_result))
+                decoded_result = self.__decode(result, sensor)
+                self.__log.debug('   Returned value: {0}', decoded_result)
                 return decoded_result
 
             except Exception as e:
-                self.logger.error('Unknown error. ID={0} TYPE={1}'.format(sensor.modbus_id, sensor.data_type))
-                self.logger.debug('{0} - {1}'.format(type(e), e))
+                self.__log.error('Unknown error. ID={0} TYPE={1}', sensor.modbus_id, sensor.data_type)
+                self.__log.debug('{0} - {1}', type(e), e)
                 attempt -= 1
 
-        self.logger.debug('{0} errors in MAX attempt times. Return None!')
+        self.__log.debug('{0} errors in MAX attempt times. Return None!')
         return None
 
+    def get_values(self, sensors, attempt=MAX_ATTEMPT):
+        """
+        Читает значения нескольких сенсоров блоками: для каждого unit id и типа регистра
+        соседние адреса объединяются в одно чтение. Блоки разных unit id чередуются,
+        чтобы все устройства за шлюзом опрашивались равномерно.
+        С pipeline_window > 0 в полете держится не больше window блоков - шина за шлюзом
+        занята, но очередь шлюза не переполняется; без конвейера блоки читаются по очереди.
+        Сенсоры из блоков с ошибкой перечитываются по одному через get_value.
+        :return: {sensor: value, ...}
+        """
+        start = perf_counter()
+        pipelined = isinstance(self.client, PipelinedModbusClient)
+        blocks = self.__build_read_blocks(sensors)
+
+        lst_pending = []
+        for request, lst_items in blocks:
+            if pipelined:
+                lst_pending.append((self.client.submit(request), lst_items))
+            else:
+                lst_pending.append((request, lst_items))
+
+        values = {}
+        for pending, lst_items in lst_pending:
+            try:
+                if pipelined:
+                    result = pending.result(self.timeout)
+                else:
+                    result = self.client.execute(pending)
+            except Exception as e:
+                result = ModbusIOException(str(e))
+
+            if not self.__is_error(result):
+                try:
+                    decoded = self.__decode_block(result, lst_items)
+                except Exception as e:
+                    # короткий или испорченный ответ шлюза - как ошибка чтения блока
+                    result = ModbusIOException('Bad block response: {0}'.format(e))
+
+            if self.__is_error(result):
+                self.__error('{0} block of {1} sensors', result, len(lst_items))
+                if attempt <= 1:
+                    self.__read_errors.inc(len(lst_items))
+                for sensor, offset, register_num in lst_items:
+                    values[sensor] = self.get_value(sensor, attempt - 1) if attempt > 1 else None
+                continue
+
+            for (sensor, _, _), value in zip(lst_items, decoded):
+                values[sensor] = value
+
+        for sensor in sensors:
+            values.setdefault(sensor, None)
+
+        self.__block_time.record(perf_counter() - start)
+        return values
+
+    @staticmethod
+    def __decode_block(result, lst_items):
+        """
+        Значения сенсоров блока из ответа; ответ короче запрошенного - ValueError
+        :param lst_items: [(sensor, offset, register_num), ...]
+        """
+        register_type = lst_items[0][0].register_type
+        data = result.bits if register_type in BIT_REGISTERS else result.registers
+        count = max(offset + register_num for _, offset, register_num in lst_items)
+        if len(data) < count:
+            raise ValueError('{0} of {1} registers in response'.format(len(data), count))
+        return decode_block(register_type, data, [(sensor.data_type, offset) for sensor, offset, _ in lst_items])
+
+    def __build_read_blocks(self, sensors):
+        """
+        :return: [(request, [(sensor, offset, register_num), ...]), ...] в порядке отправки
+        """
+        groups = {}  # {(unit_id, register_type): [(modbus_id, register_num, sensor), ...]}
+        for sensor in sensors:
+            if sensor.register_type not in READ_REQUESTS:
+                continue
+            _, register_num = get_decoder(sensor.register_type, sensor.data_type)
+            groups.setdefault((sensor.get_unit_id(), sensor.register_type), []).append(
+                (sensor.modbus_id, register_num, sensor)
+            )
+
+        per_unit = {}  # {unit_id: [(request, items), ...]}
+        for (unit_id, register_type), items in groups.items():
+            items.sort(key=lambda item: item[0])
+            request_class, max_count = READ_REQUESTS[register_type]
+
+            start = None
+            end = None
+            lst_items = []
+            for modbus_id, register_num, sensor in items:
+                if start is not None and modbus_id <= end and max(end, modbus_id + register_num) - start <= max_count:
+                    end = max(end, modbus_id + register_num)
+                    lst_items.append((sensor, modbus_id - start, register_num))
+                    continue
+
+                if start is not None:
+                    per_unit.setdefault(unit_id, []).append((request_class(start, end - start, unit=unit_id), lst_items))
+                start = modbus_id
+                end = modbus_id + register_num
+                lst_items = [(sensor, 0, register_num)]
+
+            if start is not None:
+                per_unit.setdefault(unit_id, []).append((request_class(start, end - start, unit=unit_id), lst_items))
+
+        # чередуем блоки разных unit id: u1, u2, u3, u1, u2, ...
+        blocks = []
+        queues = list(per_unit.values())
+        while queues:
+            for queue in queues:
+                blocks.append(queue.pop(0))
+            queues = [queue for queue in queues if queue]
+
+        return blocks
+
     def close(self):
         self.client.close()
 
-    def __debug(self, msg):
-        if self.logger is not None:
-            self.logger.debug(msg)
+    def __debug(self, msg, *args):
+        self.__log.debug(msg, *args)
 
-    def __warn(self, msg):
-        if self.logger is not None:
-            self.logger.warn(msg)
+    def __warn(self, msg, *args):
+        self.__log.warning(msg, *args)
 
-    def __info(self, msg):
-        if self.logger is not None:
-            self.logger.info(msg)
+    def __info(self, msg, *args):
+        self.__log.info(msg, *args)
 
-    def __error(self, msg):
-        if self.logger is not None:
-            self.logger.error(msg)
\ No newline at end of file
+    def __error(self, msg, *args):
+        self.__log.error(msg, *args)
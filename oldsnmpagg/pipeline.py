@@ -0,0 +1,226 @@
+import socket
+import struct
+import threading
+import time
+
+from pymodbus.factory import ClientDecoder
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.bit_read_message import ReadCoilsRequest, ReadDiscreteInputsRequest
+from pymodbus.bit_write_message import WriteSingleCoilRequest, WriteMultipleCoilsRequest
+from pymodbus.register_read_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest
+from pymodbus.register_write_message import WriteMultipleRegistersRequest
+
+DEFAULT_WINDOW = 8
+DEFAULT_TIMEOUT = 3
+
+MBAP_HEADER = struct.Struct('>HHHB')  # transaction id, protocol id, length, unit id
+
+
+class _Pending(object):
+    """Отправленный запрос, ожидающий ответа"""
+
+    def __init__(self, client, transaction_id):
+        self.client = client
+        self.transaction_id = transaction_id
+        self.event = threading.Event()
+        self.response = None
+        self.sent = time.monotonic()
+        self.deadline = self.sent + client.timeout
+
+    def result(self, timeout=None):
+        """
+        Ждет ответ не дольше timeout секунд от отправки запроса (None - timeout клиента):
+        ответы конвейера забираются по очереди, и время ожидания предыдущих не добавляется
+        к таймауту следующих.
+        :return: ответ pymodbus или ModbusIOException (таймаут, обрыв соединения)
+        """
+        deadline = self.deadline if timeout is None else self.sent + timeout
+        if not self.event.wait(max(0, deadline - time.monotonic())):
+            self.client.cancel(self, 'Timeout (transaction {0})'.format(self.transaction_id))
+        return self.response
+
+
+class PipelinedModbusClient(object):
+    """
+    Modbus TCP клиент, который держит до window запросов "в полете" на одном сокете
+    и сопоставляет ответы по transaction id. Кадры (PDU) кодирует и разбирает pymodbus.
+    Синхронные методы (read_input_registers, write_registers, ...) совместимы с
+    ModbusTcpClient и годятся для ModBusBridge; конвейер работает, когда запросы
+    отправляются через submit и ответы забираются потом (см. ModBusBridge.get_values).
+    """
+
+    def __init__(self, host, port=502, window=DEFAULT_WINDOW, timeout=DEFAULT_TIMEOUT, logger=None):
+        self.host = host
+        self.port = port
+        self.window = window
+        self.timeout = timeout
+        self.logger = logger
+
+        self.__socket = None
+        self.__reader = None
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(window)
+        self.__pending = {}  # {transaction_id: _Pending}
+        self.__transaction_id = 0
+        self.__decoder = ClientDecoder()
+
+    def connect(self):
+        if self.__socket is not None:
+            return True
+
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            self.__debug('Connect to {0}:{1} failed: {2}'.format(self.host, self.port, e))
+            return False
+
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__socket = sock
+        self.__reader = threading.Thread(target=self.__read_loop, args=(sock,), daemon=True)
+        self.__reader.start()
+        return True
+
+    def close(self):
+        sock = self.__socket
+        self.__socket = None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self.__fail_all('Connection closed')
+
+    def is_socket_open(self):
+        return self.__socket is not None
+
+    def submit(self, request):
+        """
+        Отправляет запрос не дожидаясь ответа. Если в полете уже window запросов,
+        ждет освобождения места (не дольше timeout).
+        :return: _Pending, ответ - через .result(timeout)
+        """
+        if self.__socket is None and not self.connect():
+            return self.__failed(None, 'Not connected to {0}:{1}'.format(self.host, self.port))
+
+        if not self.__slots.acquire(timeout=self.timeout):
+            return self.__failed(None, 'Pipeline window is full')
+
+        with self.__lock:
+            self.__transaction_id = (self.__transaction_id + 1) & 0xffff
+            transaction_id = self.__transaction_id
+            pending = _Pending(self, transaction_id)
+            self.__pending[transaction_id] = pending
+
+            pdu = struct.pack('>B', request.function_code) + request.encode()
+            frame = MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, request.unit_id) + pdu
+            try:
+                self.__socket.sendall(frame)
+            except (OSError, AttributeError) as e:
+                self.__pending.pop(transaction_id, None)
+                self.__slots.release()
+                return self.__failed(pending, 'Send failed: {0}'.format(e))
+
+        return pending
+
+    def execute(self, request):
+        return self.submit(request).result(self.timeout)
+
+    def cancel(self, pending, reason):
+        """Снимает запрос с ожидания (ответ, если придет, будет отброшен)"""
+        with self.__lock:
+            removed = self.__pending.pop(pending.transaction_id, None) is not None
+            if removed:
+                self.__slots.release()
+        if not removed:
+            # запрос уже снял читающий поток (или __fail_all): он сейчас запишет ответ
+            pending.event.wait()
+            return
+        pending.response = ModbusIOException(reason)
+        pending.event.set()
+
+    # совместимость с pymodbus.client.sync.ModbusTcpClient
+    def read_coils(self, address, count=1, unit=1, **kwargs):
+        return self.execute(ReadCoilsRequest(address, count, unit=unit))
+
+    def read_discrete_inputs(self, address, count=1, unit=1, **kwargs):
+        return self.execute(ReadDiscreteInputsRequest(address, count, unit=unit))
+
+    def read_input_registers(self, address, count=1, unit=1, **kwargs):
+        return self.execute(ReadInputRegistersRequest(address, count, unit=unit))
+
+    def read_holding_registers(self, address, count=1, unit=1, **kwargs):
+        return self.execute(ReadHoldingRegistersRequest(address, count, unit=unit))
+
+    def write_coil(self, address, value, unit=1, **kwargs):
+        return self.execute(WriteSingleCoilRequest(address, value, unit=unit))
+
+    def write_coils(self, address, values, unit=1, **kwargs):
+        return self.execute(WriteMultipleCoilsRequest(address, values, unit=unit))
+
+    def write_registers(self, address, values, unit=1, **kwargs):
+        return self.execute(WriteMultipleRegistersRequest(address, values, unit=unit))
+
+    def __read_loop(self, sock):
+        try:
+            while True:
+                header = self.__recv_exact(sock, MBAP_HEADER.size)
+                transaction_id, _, length, _ = MBAP_HEADER.unpack(header)
+                pdu = self.__recv_exact(sock, length - 1)
+
+                with self.__lock:
+                    pending = self.__pending.pop(transaction_id, None)
+                    if pending is None:
+                        self.__debug('Late or unknown transaction {0}, skip'.format(transaction_id))
+                        continue
+                    self.__slots.release()
+
+                try:
+                    response = self.__decoder.decode(pdu)
+                except Exception as e:
+                    response = ModbusIOException('Bad response: {0}'.format(e))
+                if response is None:
+                    response = ModbusIOException('Unknown response')
+                pending.response = response
+                pending.event.set()
+
+        except (OSError, EOFError) as e:
+            self.__debug('Read loop stopped: {0}'.format(e))
+
+        if self.__socket is sock:
+            self.__socket = None
+            sock.close()
+        self.__fail_all('Connection lost')
+
+    @staticmethod
+    def __recv_exact(sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError('Connection closed by peer')
+            data += chunk
+        return data
+
+    def __fail_all(self, reason):
+        with self.__lock:
+            lst_pending = list(self.__pending.values())
+            self.__pending.clear()
+            for _ in lst_pending:
+                self.__slots.release()
+
+        for pending in lst_pending:
+            pending.response = ModbusIOException(reason)
+            pending.event.set()
+
+    def __failed(self, pending, reason):
+        if pending is None:
+            pending = _Pending(self, None)
+        pending.response = ModbusIOException(reason)
+        pending.event.set()
+        return pending
+
+    def __debug(self, msg):
+        if self.logger is not None:
+            self.logger.debug(msg)
@@ -0,0 +1,433 @@
+"""
+Многопроцессный опрос контроллеров.
+
+Один процесс упирается в GIL и одно ядро, сколько бы ни экономили на вводе-выводе.
+ShardedPoller запускает N рабочих процессов и раздает им контроллеры по consistent hashing
+от ip_address: при изменении конфигурации или числа процессов переезжают только
+затронутые контроллеры. Рабочие опрашивают свои контроллеры (ModBusBridge.get_values)
+и шлют значения в общую очередь, в DataDB пишет один поток супервизора - через DeadbandFilter
+(значения в пределах deadband сенсора в историю не пишутся, кроме heartbeat).
+С shm_name рабочие еще и публикуют текущие значения в SharedValueTable (shmtable),
+откуда их читают другие процессы без SQLite.
+Упавшие процессы перезапускаются в check() (run() вызывает его периодически).
+
+    python -m oldsnmpagg.poller config.db data.db [--workers 4] [--interval 5]
+"""
+
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+
+from oldsnmpagg.controllers import Controllers
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.deadband import DeadbandFilter, DEFAULT_HEARTBEAT
+from oldsnmpagg.hotlog import HotLogger
+from oldsnmpagg.metrics import REGISTRY
+from oldsnmpagg.modbusbridge import ModBusBridge
+from oldsnmpagg.reachability import ReachabilityCache, DEFAULT_TTL as DEFAULT_REACHABILITY_TTL
+from oldsnmpagg.registry import SensorRegistry
+from oldsnmpagg.shmtable import SharedValueTable, FLAG_READ_ERROR, FLAG_OFFLINE
+from oldsnmpagg.wrappers import Data
+
+DEFAULT_REPLICAS = 100   # виртуальных узлов на процесс в кольце
+DEFAULT_INTERVAL = 5     # секунд между циклами опроса
+DEFAULT_TIMEOUT = 3
+RESTART_DELAY = 1        # не перезапускать процесс чаще, чем раз в RESTART_DELAY секунд
+STOP_TIMEOUT = 5
+WRITER_BATCH = 1000      # значений на одну транзакцию DataDB
+WRITER_WAIT = 0.5
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """
+    Кольцо consistent hashing. Каждый узел представлен replicas точками на кольце,
+    ключ принадлежит первому узлу по часовой стрелке от своего хеша.
+    """
+
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self.__ring = []    # [(hash, node), ...] по возрастанию hash
+        self.__hashes = []
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self):
+        return sorted(set(node for _, node in self.__ring))
+
+    def add_node(self, node):
+        for i in range(self.replicas):
+            bisect.insort(self.__ring, (_hash('{0}#{1}'.format(node, i)), node))
+        self.__hashes = [h for h, _ in self.__ring]
+
+    def remove_node(self, node):
+        self.__ring = [item for item in self.__ring if item[1] != node]
+        self.__hashes = [h for h, _ in self.__ring]
+
+    def get_node(self, key):
+        if not self.__ring:
+            return None
+        i = bisect.bisect(self.__hashes, _hash(key)) % len(self.__hashes)
+        return self.__ring[i][1]
+
+    def assign(self, keys):
+        """:return: {node: [key, ...]} (узлы без ключей не попадают в результат)"""
+        result = {}
+        for key in sorted(keys):
+            result.setdefault(self.get_node(key), []).append(key)
+        return result
+
+
+def poll_worker(worker_id, db_file, lst_ips, results, stop, interval, options):
+    """
+    Тело рабочего процесса: опрашивает контроллеры lst_ips, пока не выставлен stop.
+    В results кладет (worker_id, controller_ip, [(modbus_id, value, unix_time), ...]);
+    сенсоры с ошибкой чтения (None) не отправляются.
+    :param options: timeout, pipeline_window,
+        address_map - {ip: (host, port)} вместо ip_address/tcp_port из базы (симулятор),
+        shm_name - SharedValueTable для текущих значений (None - не публиковать),
+        reachability_ttl - сколько секунд не подключаться к контроллеру, недоступному
+            при последней проверке (0 - подключаться каждый цикл)
+    Перед подключением контроллеры без соединения проверяются все сразу (ReachabilityCache),
+    поэтому недоступная площадка стоит циклу одного таймаута, а не таймаута на контроллер.
+    """
+    timeout = options.get('timeout', DEFAULT_TIMEOUT)
+    pipeline_window = options.get('pipeline_window', 0)
+    address_map = options.get('address_map') or {}
+    table = None
+    if options.get('shm_name'):
+        table = SharedValueTable.attach(options['shm_name'], readonly=False)
+
+    controllers = Controllers(db_file, read_only=True)
+    st_ips = set(lst_ips)
+    targets = {}
+    sensors_by_ip = {}
+    for controller in controllers.get_controllers():
+        if controller.ip_address in st_ips:
+            targets[controller.ip_address] = address_map.get(
+                controller.ip_address, (controller.ip_address, controller.tcp_port)
+            )
+    for sensor in controllers.get_all_sensors():
+        if sensor.controller_ip in targets:
+            sensors_by_ip.setdefault(sensor.controller_ip, []).append(sensor)
+    del controllers
+
+    reachability = ReachabilityCache(timeout=timeout, ttl=options.get('reachability_ttl', DEFAULT_REACHABILITY_TTL))
+    bridges = {}
+    while not stop.is_set():
+        start = time.time()
+        reachability.check_targets({
+            ip: targets[ip] for ip in sensors_by_ip if bridges.get(ip) is None or not bridges[ip].connect_state
+        })
+        for ip, lst_sensors in sensors_by_ip.items():
+            if stop.is_set():
+                break
+            bridge = bridges.get(ip)
+            if bridge is None or not bridge.connect_state:
+                bridge = None
+                if not reachability.is_down(ip):
+                    host, port = targets[ip]
+                    bridge = ModBusBridge(host, port, timeout=timeout, pipeline_window=pipeline_window)
+                    bridges[ip] = bridge
+                    if not bridge.connect_state:
+                        reachability.mark(ip, False)
+                if bridge is None or not bridge.connect_state:
+                    if table is not None:
+                        for sensor in lst_sensors:
+                            table.set_flags(ip, sensor.modbus_id, FLAG_OFFLINE)
+                    continue
+
+            values = bridge.get_values(lst_sensors)
+            now = time.time()
+            if table is not None:
+                for sensor, value in values.items():
+                    if value is None:
+                        table.set_flags(ip, sensor.modbus_id, FLAG_READ_ERROR)
+                    else:
+                        table.set(ip, sensor.modbus_id, value, now)
+            results.put((worker_id, ip, [
+                (sensor.modbus_id, value, now) for sensor, value in values.items() if value is not None
+            ]))
+
+        stop.wait(max(0.0, interval - (time.time() - start)))
+
+    for bridge in bridges.values():
+        bridge.close()
+    if table is not None:
+        table.close()
+
+
+class ShardedPoller(object):
+    """
+    Супервизор рабочих процессов опроса и единственный писатель в DataDB.
+    Процессы создаются через spawn: у супервизора работают потоки (писатель), и fork
+    мог бы унести в дочерний процесс захваченные ими блокировки.
+    """
+
+    def __init__(self, db_file, data_file, workers=None, interval=DEFAULT_INTERVAL, logger=None,
+                 timeout=DEFAULT_TIMEOUT, pipeline_window=0, address_map=None,
+                 replicas=DEFAULT_REPLICAS, metrics=None, shm_name=None,
+                 reachability_ttl=DEFAULT_REACHABILITY_TTL, heartbeat=DEFAULT_HEARTBEAT):
+        """
+        :param workers: число процессов (None - по числу ядер)
+        :param address_map: {ip: (host, port)} - куда на самом деле подключаться (симулятор)
+        :param shm_name: имя SharedValueTable для текущих значений (None - без нее)
+        :param reachability_ttl: секунд не подключаться к недоступному контроллеру (см. poll_worker)
+        :param heartbeat: секунд, после которых значение пишется в историю, даже если не вышло за deadband
+        """
+        self.db_file = db_file
+        self.data_file = data_file
+        self.workers = workers or multiprocessing.cpu_count()
+        self.interval = interval
+        self.logger = logger
+        self.replicas = replicas
+        self.heartbeat = heartbeat
+        self.options = {
+            'timeout': timeout,
+            'pipeline_window': pipeline_window,
+            'address_map': address_map or {},
+            'shm_name': shm_name,
+            'reachability_ttl': reachability_ttl
+        }
+        self.shm_name = shm_name
+        self.table = None
+        self.restarts = 0
+        self.polled = 0   # значений получено от рабочих
+        self.samples = 0  # из них записано в историю (прошли DeadbandFilter)
+
+        if metrics is None:
+            metrics = REGISTRY
+        self.__polled = metrics.counter('poller_polled_total')
+        self.__samples = metrics.counter('poller_samples_total')
+        self.__restarts = metrics.counter('poller_restarts_total')
+        self.__workers_gauge = metrics.gauge('poller_workers')
+
+        self.__log = HotLogger(logger)
+        self.__context = multiprocessing.get_context('spawn')
+        self.__results = self.__context.Queue()
+        self.__processes = {}   # {worker_id: (process, stop_event, started_at)}
+        self.__assignment = {}  # {worker_id: [ip, ...]}
+        self.__sensors = SensorRegistry()  # для писателя и сравнения конфигураций в reload
+        self.__stop = threading.Event()
+        self.__writer = None
+        self.__deadband = None  # DeadbandFilter писателя
+
+    def get_assignment(self):
+        """:return: {worker_id: [ip, ...]}"""
+        return {worker_id: list(lst_ips) for worker_id, lst_ips in self.__assignment.items()}
+
+    def start(self):
+        self.__stop.clear()
+        lst_ips = self.__load_config()
+        if self.shm_name:
+            # после чтения конфигурации: емкость - по числу сенсоров с запасом под новые
+            self.table = SharedValueTable.create(self.shm_name, keys=self.__sensors.keys())
+        self.__assignment = HashRing(range(self.workers), self.replicas).assign(lst_ips)
+        for worker_id in self.__assignment:
+            self.__start_worker(worker_id)
+        self.__writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__writer.start()
+        return self
+
+    def stop(self):
+        for worker_id in list(self.__processes):
+            self.__stop_worker(worker_id)
+        self.__stop.set()
+        if self.__writer is not None:
+            self.__writer.join()
+            self.__writer = None
+        if self.table is not None:
+            self.table.close()
+            self.table.unlink()
+            self.table = None
+
+    def run(self, check_interval=1):
+        """Следит за процессами до stop() или KeyboardInterrupt"""
+        try:
+            while not self.__stop.wait(check_interval):
+                self.check()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def check(self):
+        """
+        Перезапускает упавшие процессы с тем же набором контроллеров
+        :return: число перезапущенных
+        """
+        restarted = 0
+        for worker_id, (process, stop, started_at) in list(self.__processes.items()):
+            if process.is_alive() or stop.is_set():
+                continue
+            if time.time() - started_at < RESTART_DELAY:
+                continue
+            self.__log.warning('Poll worker {0} exited with code {1}, restarting', worker_id, process.exitcode)
+            self.__start_worker(worker_id)
+            self.restarts += 1
+            self.__restarts.inc()
+            restarted += 1
+        return restarted
+
+    def reload(self):
+        """
+        Перечитывает конфигурацию: перезапускаются только процессы, у которых
+        изменился набор контроллеров или сенсоры их контроллеров
+        :return: [worker_id, ...] перезапущенных процессов
+        """
+        return self.__rebalance(self.workers)
+
+    def set_workers(self, workers):
+        """
+        Меняет число процессов. Благодаря consistent hashing переезжает примерно
+        1/workers контроллеров
+        :return: [worker_id, ...] перезапущенных процессов
+        """
+        return self.__rebalance(workers)
+
+    def __rebalance(self, workers):
+        old_sensors = self.__sensors
+        lst_ips = self.__load_config()
+        assignment = HashRing(range(workers), self.replicas).assign(lst_ips)
+        self.workers = workers
+
+        added, removed, updated = old_sensors.diff(self.__sensors)
+        deadband = self.__deadband
+        if deadband is not None:
+            for sensor in removed + updated:
+                deadband.forget(sensor)  # с новым deadband первое значение пишется
+        changed_ips = set(sensor.controller_ip for sensor in added + removed + updated)
+        if changed_ips:
+            self.__log.info('Sensors changed: {0} added, {1} removed, {2} updated',
+                            len(added), len(removed), len(updated))
+
+        changed = []
+        for worker_id in sorted(set(self.__assignment) | set(assignment)):
+            lst_worker_ips = assignment.get(worker_id)
+            if self.__assignment.get(worker_id) == lst_worker_ips and changed_ips.isdisjoint(lst_worker_ips or ()):
+                continue
+            changed.append(worker_id)
+            if worker_id in self.__processes:
+                self.__stop_worker(worker_id)
+
+        self.__assignment = assignment
+        for worker_id in changed:
+            if worker_id in assignment:
+                self.__start_worker(worker_id)
+
+        self.__log.info('Rebalanced to {0} workers, restarted: {1}', workers, changed)
+        return changed
+
+    def __load_config(self):
+        controllers = Controllers(self.db_file, read_only=True)
+        self.__sensors = SensorRegistry(controllers.get_all_sensors())
+        if self.table is not None:
+            for key in self.__sensors.keys():
+                if not self.table.add(key):
+                    self.__log.error('Shared value table {0} is full', self.shm_name)
+                    break
+        return [controller.ip_address for controller in controllers.get_controllers()]
+
+    def __start_worker(self, worker_id):
+        stop = self.__context.Event()
+        process = self.__context.Process(
+            target=poll_worker,
+            args=(worker_id, self.db_file, self.__assignment[worker_id], self.__results, stop,
+                  self.interval, self.options),
+            name='poll-worker-{0}'.format(worker_id),
+            daemon=True
+        )
+        process.start()
+        self.__processes[worker_id] = (process, stop, time.time())
+        self.__workers_gauge.set(len(self.__processes))
+        self.__log.debug('Poll worker {0} started (pid {1}) for {2} controllers',
+                         worker_id, process.pid, len(self.__assignment[worker_id]))
+
+    def __stop_worker(self, worker_id):
+        process, stop, _ = self.__processes.pop(worker_id)
+        stop.set()
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            self.__log.warning('Poll worker {0} did not stop in {1} s, terminating', worker_id, STOP_TIMEOUT)
+            process.terminate()
+            process.join()
+        self.__workers_gauge.set(len(self.__processes))
+
+    def __write_loop(self):
+        # соединение sqlite создается в том потоке, который им пользуется
+        data_db = DataDB(self.data_file, logger=self.logger)
+        history = self.__deadband = DeadbandFilter(data_db, heartbeat=self.heartbeat, logger=self.logger)
+        while True:
+            try:
+                batch = self.__results.get(timeout=WRITER_WAIT)
+            except queue.Empty:
+                if self.__stop.is_set():
+                    break
+                continue
+
+            polled = 0
+            written = 0
+            while True:
+                polled += len(batch[2])
+                written += self.__write_batch(history, batch)
+                if polled >= WRITER_BATCH:
+                    break
+                try:
+                    batch = self.__results.get_nowait()
+                except queue.Empty:
+                    break
+            data_db.commit()
+            self.polled += polled
+            self.samples += written
+            self.__polled.inc(polled)
+            self.__samples.inc(written)
+
+    def __write_batch(self, history, batch):
+        """
+        :param history: DeadbandFilter над DataDB писателя
+        :return: число записанных (не отброшенных фильтром) значений
+        """
+        worker_id, ip, lst_values = batch
+        sensors = self.__sensors
+        written = 0
+        for modbus_id, value, unix_time in lst_values:
+            sensor = sensors.get(ip, modbus_id)
+            if sensor is None:
+                continue
+            if history.add_data(Data(sensor, value, unix_time), autocommit=False):
+                written += 1
+        return written
+
+
+def main():
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description='Sharded multi-process poller')
+    parser.add_argument('db_file')
+    parser.add_argument('data_file')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--pipeline-window', type=int, default=0)
+    parser.add_argument('--shm-name', default=None, help='publish current values to this shared value table')
+    parser.add_argument('--heartbeat', type=float, default=DEFAULT_HEARTBEAT,
+                        help='write unchanged values to history at least every HEARTBEAT seconds')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    poller = ShardedPoller(
+        args.db_file, args.data_file, workers=args.workers, interval=args.interval,
+        logger=logging.getLogger('poller'), timeout=args.timeout, pipeline_window=args.pipeline_window,
+        shm_name=args.shm_name, heartbeat=args.heartbeat
+    ).start()
+    poller.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Доступность контроллеров по TCP для всего парка сразу.
+
+Controller.connection_is_ok проверяет контроллеры по одному с таймаутом 1 с, и страница
+состояния на сотни контроллеров при недоступной площадке ждет минуты. probe() открывает
+неблокирующие соединения ко всем адресам сразу (selectors) и ждет их в одном окне timeout.
+ReachabilityCache хранит результаты ttl секунд, записывает переходы up/down и задержки
+соединения (metrics: controller_up, controller_connect_seconds, controller_transitions_total).
+
+    cache = ReachabilityCache(ttl=30)
+    cache.check_fleet(controllers)              # {ip: True/False}, проверяются только устаревшие
+    if cache.is_down('10.0.0.7'): ...           # без новой проверки
+    cache.pop_transitions()                     # [(unix_time, ip, up), ...]
+    cache.stats()                               # {'up': ..., 'down': ..., 'latency': {...}}
+"""
+
+import collections
+import errno
+import selectors
+import socket
+import threading
+import time
+from time import perf_counter
+
+from oldsnmpagg.hotlog import HotLogger
+from oldsnmpagg.metrics import REGISTRY
+from oldsnmpagg.wrappers import CONNECT_TEST_DELAY
+
+DEFAULT_TIMEOUT = CONNECT_TEST_DELAY  # секунд на окно проверки
+DEFAULT_TTL = 30                      # секунд, сколько верим результату
+MAX_PARALLEL = 512                    # соединений в одном окне (лимит файловых дескрипторов)
+MAX_TRANSITIONS = 1000
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def probe(targets, timeout=DEFAULT_TIMEOUT, max_parallel=MAX_PARALLEL):
+    """
+    Параллельная проверка TCP-соединения
+    :param targets: [(host, port), ...]
+    :return: {(host, port): время соединения в секундах или None - недоступен}
+    """
+    lst_targets = list(dict.fromkeys(targets))
+    results = {}
+    for i in range(0, len(lst_targets), max_parallel):
+        results.update(_probe_window(lst_targets[i:i + max_parallel], timeout))
+    return results
+
+
+def _probe_window(lst_targets, timeout):
+    results = {}
+    selector = selectors.DefaultSelector()
+
+    def harvest(wait):
+        for key, _ in selector.select(wait):
+            target, started = key.data
+            sock = key.fileobj
+            ok = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+            results[target] = perf_counter() - started if ok else None
+            selector.unregister(sock)
+            sock.close()
+
+    try:
+        for target in lst_targets:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            started = perf_counter()
+            try:
+                code = sock.connect_ex(target)
+            except OSError:
+                code = -1
+            if code == 0:
+                results[target] = perf_counter() - started
+                sock.close()
+            elif code in _IN_PROGRESS:
+                selector.register(sock, selectors.EVENT_WRITE, (target, started))
+                harvest(0)  # уже соединившиеся - сразу, иначе в задержку попадет время открытия остальных
+            else:
+                results[target] = None
+                sock.close()
+
+        deadline = perf_counter() + timeout
+        while selector.get_map():
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            harvest(remaining)
+    finally:
+        for key in list(selector.get_map().values()):
+            results[key.data[0]] = None  # не успел за timeout
+            key.fileobj.close()
+        selector.close()
+    return results
+
+
+class ControllerStatus(object):
+    __slots__ = ('ip', 'up', 'latency', 'checked_at', 'changed_at')
+
+    def __init__(self, ip, up, latency, checked_at, changed_at):
+        self.ip = ip
+        self.up = up
+        self.latency = latency        # секунды соединения (None - недоступен)
+        self.checked_at = checked_at  # unix time последней проверки
+        self.changed_at = changed_at  # unix time последнего перехода up/down
+
+    def __str__(self):
+        return '<ControllerStatus>:{0}:{1}:{2}'.format(self.ip, 'up' if self.up else 'down', self.latency)
+
+
+class ReachabilityCache(object):
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, ttl=DEFAULT_TTL, address_map=None, logger=None,
+                 metrics=None, max_parallel=MAX_PARALLEL):
+        """
+        :param address_map: {ip: (host, port)} - куда на самом деле подключаться (симулятор)
+        :param metrics: MetricsRegistry (None - общий metrics.REGISTRY)
+        """
+        self.timeout = timeout
+        self.ttl = ttl
+        self.address_map = address_map or {}
+        self.max_parallel = max_parallel
+        self.__log = HotLogger(logger)
+        self.__lock = threading.Lock()
+        self.__statuses = {}  # {ip: ControllerStatus}
+        self.__transitions = collections.deque(maxlen=MAX_TRANSITIONS)
+
+        if metrics is None:
+            metrics = REGISTRY
+        self.__metrics = metrics
+        self.__series = {}  # {ip: (gauge controller_up, histogram controller_connect_seconds)}
+        self.__transitions_total = metrics.counter('controller_transitions_total')
+
+    def check_fleet(self, controllers, force=False):
+        """Проверяет все контроллеры из базы (Controllers.get_controllers())"""
+        return self.check(controllers.get_controllers(), force)
+
+    def check(self, lst_controllers, force=False):
+        """
+        :param lst_controllers: [Controller, ...]
+        :param force: True - проверить все, False - только без свежего результата
+        :return: {ip: True/False}
+        """
+        return self.check_targets({
+            controller.ip_address: self.address_map.get(
+                controller.ip_address, (controller.ip_address, controller.tcp_port)
+            ) for controller in lst_controllers
+        }, force)
+
+    def check_targets(self, targets, force=False):
+        """
+        :param targets: {ip: (host, port)}
+        :return: {ip: True/False}
+        """
+        now = time.time()
+        stale = {ip: target for ip, target in targets.items() if force or not self.__is_fresh(ip, now)}
+        if stale:
+            started = perf_counter()
+            latencies = probe(stale.values(), self.timeout, self.max_parallel)
+            for ip, target in stale.items():
+                self.mark(ip, latencies.get(target) is not None, latencies.get(target))
+            self.__log.debug('Probed {0} controllers in {1:.3f} s', len(stale), perf_counter() - started)
+
+        statuses = self.__statuses
+        return {ip: statuses[ip].up for ip in targets}
+
+    def mark(self, ip, up, latency=None):
+        """Записывает результат (в т.ч. полученный не через probe - например, опросом)"""
+        now = time.time()
+        with self.__lock:
+            status = self.__statuses.get(ip)
+            if status is None:
+                status = self.__statuses[ip] = ControllerStatus(ip, up, latency, now, now)
+            elif status.up != up:
+                status.up = up
+                status.changed_at = now
+                self.__transitions.append((now, ip, up))
+                self.__transitions_total.inc()
+                self.__log.info('Controller {0} is {1}', ip, 'up' if up else 'down')
+            status.latency = latency
+            status.checked_at = now
+
+        series = self.__series.get(ip)
+        if series is None:
+            series = self.__series[ip] = (
+                self.__metrics.gauge('controller_up', controller=ip),
+                self.__metrics.histogram('controller_connect_seconds', controller=ip)
+            )
+        series[0].set(1 if up else 0)
+        if latency is not None:
+            series[1].record(latency)
+
+    def __is_fresh(self, ip, now):
+        status = self.__statuses.get(ip)
+        return status is not None and now - status.checked_at < self.ttl
+
+    def get(self, ip):
+        """:return: ControllerStatus (возможно устаревший) или None - не проверялся"""
+        return self.__statuses.get(ip)
+
+    def is_up(self, ip):
+        """True - по свежему результату доступен"""
+        status = self.__statuses.get(ip)
+        return status is not None and status.up and time.time() - status.checked_at < self.ttl
+
+    def is_down(self, ip):
+        """True - по свежему результату недоступен (можно не подключаться до истечения ttl)"""
+        status = self.__statuses.get(ip)
+        return status is not None and not status.up and time.time() - status.checked_at < self.ttl
+
+    def pop_transitions(self):
+        """:return: переходы с прошлого вызова [(unix_time, ip, up), ...]"""
+        with self.__lock:
+            lst_transitions = list(self.__transitions)
+            self.__transitions.clear()
+        return lst_transitions
+
+    def stats(self):
+        """:return: {'up': n, 'down': n, 'latency': {'min', 'avg', 'p50', 'p95', 'max'} по доступным}"""
+        with self.__lock:
+            lst_statuses = list(self.__statuses.values())
+        lst_latencies = sorted(status.latency for status in lst_statuses if status.up and status.latency is not None)
+        up = sum(1 for status in lst_statuses if status.up)
+        latency = {}
+        if lst_latencies:
+            latency = {
+                'min': lst_latencies[0],
+                'avg': sum(lst_latencies) / len(lst_latencies),
+                'p50': lst_latencies[(len(lst_latencies) - 1) // 2],
+                'p95': lst_latencies[int((len(lst_latencies) - 1) * 0.95)],
+                'max': lst_latencies[-1]
+            }
+        return {'up': up, 'down': len(lst_statuses) - up, 'latency': latency}
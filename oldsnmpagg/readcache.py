@@ -0,0 +1,86 @@
+import threading
+import time
+
+# время жизни закешированного значения по типу регистра, секунды
+DEFAULT_TTL = {
+    'input': 1.0,
+    'discrete': 1.0,
+    'coil': 0.5,
+    'holding_reg': 0.5
+}
+DEFAULT_TTL_OTHER = 0.5
+
+
+class _Flight(object):
+    """Запрос к контроллеру, который сейчас выполняется"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.stale = False
+
+
+class ReadCache(object):
+    """
+    Кеш чтений для ModBusBridge (single-flight + короткий TTL).
+    Ключ: (ip, port, register_type, modbus_id, unit_id).
+    Если значение для ключа уже читается, остальные вызывающие ждут этот же запрос,
+    а не шлют свой. Полученное значение отдается из кеша ttl секунд.
+    Ошибки чтения (None) не кешируются.
+    Один экземпляр можно (и нужно) разделять между всеми ModBusBridge процесса.
+    """
+
+    def __init__(self, ttl=None, default_ttl=DEFAULT_TTL_OTHER):
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self.default_ttl = default_ttl
+
+        self.__lock = threading.Lock()
+        self.__values = {}   # {key: (value, expires)}
+        self.__flights = {}  # {key: _Flight}
+
+    def get(self, key, loader):
+        """
+        Возвращает значение для key из кеша, из уже идущего запроса или вызывает loader()
+        """
+        with self.__lock:
+            entry = self.__values.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.__flights[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            return flight.value
+
+        try:
+            flight.value = loader()
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+                if flight.value is not None and not flight.stale:
+                    ttl = self.ttl.get(key[2], self.default_ttl)
+                    self.__values[key] = (flight.value, time.monotonic() + ttl)
+            flight.event.set()
+
+        return flight.value
+
+    def invalidate(self, key):
+        """Сбрасывает значение (например после записи в регистр)"""
+        with self.__lock:
+            self.__values.pop(key, None)
+            flight = self.__flights.get(key)
+            if flight is not None:
+                flight.stale = True
+
+    def clear(self):
+        with self.__lock:
+            self.__values.clear()
+            for flight in self.__flights.values():
+                flight.stale = True
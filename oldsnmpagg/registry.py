@@ -0,0 +1,118 @@
+"""
+Снимок конфигурации сенсоров с поиском за O(1) и сравнением снимков.
+
+    registry = SensorRegistry(controllers.get_all_sensors())
+    sensor = registry.get('10.0.0.1', 5)            # по modbus_id
+    sensor = registry.get_by_oid('10.0.0.1', 3)
+    lst_sensors = registry.get_by_oid_name('temp')  # oid_name уникален только в контроллере
+
+    added, removed, changed = registry.diff(SensorRegistry(controllers.get_all_sensors()))
+
+Ключи нормализуются (ip - str, oid и modbus_id - int, если это числа), поэтому
+сенсоры из CSV (строки) и из базы находятся одинаково.
+"""
+
+from oldsnmpagg.wrappers import Sensor
+
+
+def _number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def config_of(sensor: Sensor):
+    """
+    Настройки сенсора (и его контроллера), изменение которых - изменение конфигурации.
+    Текущее значение (value) не входит: его пишет опрос
+    """
+    controller = sensor.controller
+    return (
+        _number(sensor.oid), sensor.oid_name, sensor.data_type, sensor.description, sensor.register_type,
+        sensor.monitoring, sensor.min_value, sensor.max_value, sensor.deadband_abs, sensor.deadband_pct,
+        sensor.unit_id, controller.root_oid, controller.oid, _number(controller.tcp_port), controller.unit_id
+    )
+
+
+class SensorRegistry(object):
+
+    def __init__(self, sensors=()):
+        self.__by_modbus_id = {}  # {(controller_ip, modbus_id): Sensor}
+        self.__by_oid = {}        # {(controller_ip, oid): Sensor}
+        self.__by_oid_name = {}   # {oid_name: [Sensor, ...]}
+        self.__configs = {}       # {(controller_ip, modbus_id): config_of(sensor)}
+        for sensor in sensors:
+            self.add(sensor)
+
+    @staticmethod
+    def key(sensor: Sensor):
+        """:return: (controller_ip, modbus_id)"""
+        return str(sensor.controller_ip), _number(sensor.modbus_id)
+
+    def add(self, sensor: Sensor):
+        """Добавляет сенсор; сенсор с тем же (controller_ip, modbus_id) заменяется"""
+        key = self.key(sensor)
+        if key in self.__by_modbus_id:
+            self.remove(self.__by_modbus_id[key])
+        self.__by_modbus_id[key] = sensor
+        self.__by_oid[(key[0], _number(sensor.oid))] = sensor
+        self.__by_oid_name.setdefault(sensor.oid_name, []).append(sensor)
+        self.__configs[key] = config_of(sensor)
+
+    def remove(self, sensor: Sensor):
+        """:return: True - удален, False - такого сенсора нет"""
+        key = self.key(sensor)
+        sensor = self.__by_modbus_id.pop(key, None)
+        if sensor is None:
+            return False
+        del self.__configs[key]
+        oid_key = (key[0], _number(sensor.oid))
+        if self.__by_oid.get(oid_key) is sensor:
+            del self.__by_oid[oid_key]
+        lst_named = self.__by_oid_name[sensor.oid_name]
+        lst_named.remove(sensor)
+        if not lst_named:
+            del self.__by_oid_name[sensor.oid_name]
+        return True
+
+    def get(self, controller_ip, modbus_id):
+        return self.__by_modbus_id.get((str(controller_ip), _number(modbus_id)))
+
+    def get_by_oid(self, controller_ip, oid):
+        return self.__by_oid.get((str(controller_ip), _number(oid)))
+
+    def get_by_oid_name(self, oid_name):
+        """:return: [Sensor, ...] с этим oid_name (по одному на контроллер)"""
+        return list(self.__by_oid_name.get(oid_name, ()))
+
+    def controller_ips(self):
+        """:return: множество ip контроллеров, у которых есть сенсоры"""
+        return set(ip for ip, _ in self.__by_modbus_id)
+
+    def __len__(self):
+        return len(self.__by_modbus_id)
+
+    def __iter__(self):
+        return iter(self.__by_modbus_id.values())
+
+    def __contains__(self, sensor):
+        return self.key(sensor) in self.__by_modbus_id
+
+    def keys(self):
+        return self.__by_modbus_id.keys()
+
+    def diff(self, other):
+        """
+        Сравнивает этот снимок (старый) с other (новым) по (controller_ip, modbus_id)
+        :return: (added, removed, changed) - отсортированные списки Sensor:
+            added и changed - из other, removed - из этого снимка
+        """
+        old, new = self.__by_modbus_id, other.__by_modbus_id
+        old_configs, new_configs = self.__configs, other.__configs
+        added = sorted(new[key] for key in new.keys() - old.keys())
+        removed = sorted(old[key] for key in old.keys() - new.keys())
+        changed = sorted(
+            new[key] for key in new.keys() & old.keys() if new_configs[key] != old_configs[key]
+        )
+        return added, removed, changed
@@ -0,0 +1,202 @@
+"""
+Хранение истории по правилам вместо одного срока DataDB.delete_data_older_than.
+
+Правила - таблица retention_rules базы конфигурации (Controllers.set_retention_rule).
+Для сенсора берется самое точное правило: сенсор (controller_ip + modbus_id), контроллер +
+тип регистра, контроллер, тип регистра, общее (все NULL). Нет правила или days = NULL -
+история сенсора не удаляется.
+
+Удаление идет по сенсорам пачками по batch_size строк по индексу (DataDB.create_sensor_index),
+каждая пачка - своя короткая транзакция, между пачками pause секунд, чтобы опрос писал без
+долгих блокировок. У каждого сенсора есть отметка (retention_watermarks): следующий запуск
+удаляет только строки между отметкой и новым сроком, а сенсоры, у которых срок еще не сдвинулся
+за отметку, не трогает совсем. Отсчет, записанный позже не новее отметки (спул, массовая
+загрузка), снимает отметку сенсора (триггер DataDB.create_sensor_index) - его история
+проходится заново с начала.
+
+    job = RetentionJob('config.db', 'data.db')
+    job.run_once()                              # число удаленных строк, -1 - ошибка базы
+    job.start(interval=3600) ... job.stop()     # фоновый поток
+
+    python -m oldsnmpagg.retention config.db data.db [--interval 3600]
+"""
+
+import threading
+import time
+from time import perf_counter
+
+from oldsnmpagg.controllers import Controllers
+from oldsnmpagg.datadb import DataDB, DEFAULT_DELETE_BATCH
+from oldsnmpagg.historycache import sensor_key
+from oldsnmpagg.hotlog import HotLogger
+from oldsnmpagg.metrics import REGISTRY
+
+DEFAULT_INTERVAL = 3600  # секунд между запусками фонового потока
+DEFAULT_PAUSE = 0.01     # секунд между пачками
+DAY = 86400
+
+
+def index_rules(lst_rules):
+    """:return: {(controller_ip, modbus_id, register_type): days}"""
+    return {rule.key(): rule.days for rule in lst_rules}
+
+
+def retention_days(st_rules, sensor):
+    """
+    :param st_rules: index_rules()
+    :return: сколько дней хранить историю сенсора по самому точному правилу, None - всегда
+    """
+    ip = sensor.controller_ip
+    register_type = sensor.register_type
+    modbus_id = sensor_key(ip, sensor.modbus_id)[1]
+    for key in (
+        (ip, modbus_id, None),
+        (ip, None, register_type),
+        (ip, None, None),
+        (None, None, register_type),
+        (None, None, None)
+    ):
+        if key in st_rules:
+            return st_rules[key]
+    return None
+
+
+class RetentionJob(object):
+
+    def __init__(self, db_file, data_file, batch_size=DEFAULT_DELETE_BATCH, pause=DEFAULT_PAUSE,
+                 logger=None, metrics=None):
+        """
+        Базы открываются на каждый запуск в том потоке, который его выполняет
+        :param metrics: MetricsRegistry (None - общий metrics.REGISTRY)
+        """
+        self.db_file = db_file
+        self.data_file = data_file
+        self.batch_size = batch_size
+        self.pause = pause
+        self.logger = logger
+        self.rows = 0     # удалено строк за все запуски
+        self.batches = 0  # транзакций удаления за все запуски
+        self.__log = HotLogger(logger)
+        self.__stop = threading.Event()
+        self.__thread = None
+
+        if metrics is None:
+            metrics = REGISTRY
+        self.__deleted = metrics.counter('retention_deleted_rows_total')
+        self.__run_time = metrics.histogram('retention_run_seconds')
+        self.__batch_time = metrics.histogram('retention_batch_seconds')  # сколько база заблокирована на запись
+
+    def run_once(self, now=None):
+        """
+        Удаляет историю, вышедшую за сроки правил
+        :param now: unix time, от которого считаются сроки (None - текущее)
+        :return: число удаленных строк или -1 - ошибка базы (удаленное до ошибки остается удаленным)
+        """
+        start = perf_counter()
+        now = time.time() if now is None else now
+        controllers = Controllers(self.db_file, logger=self.logger, read_only=True)
+        st_rules = index_rules(controllers.get_retention_rules())
+        if not st_rules:
+            return 0
+
+        data_db = DataDB(self.data_file, logger=self.logger)
+        if not data_db.create_sensor_index():
+            return -1
+        watermarks = data_db.get_retention_watermarks()
+        if watermarks is None:
+            return -1
+
+        deleted = 0
+        touched = 0
+        seen = set()
+        for sensor in controllers.get_all_sensors():
+            key = sensor_key(sensor.controller_ip, sensor.modbus_id)
+            days = retention_days(st_rules, sensor)
+            if days is None or key in seen:
+                continue
+            seen.add(key)
+            before = now - days * DAY
+            after = watermarks.get(key)
+            if after is not None and before <= after:
+                continue
+
+            touched += 1
+            while True:
+                batch_start = perf_counter()
+                count = data_db.delete_sensor_data(sensor.controller_ip, sensor.modbus_id, after, before,
+                                                   self.batch_size)
+                self.__batch_time.record(perf_counter() - batch_start)
+                if count < 0:
+                    self.__finish(deleted, touched, start)
+                    return -1
+                deleted += count
+                self.batches += 1
+                self.__deleted.inc(count)
+                if count < self.batch_size:
+                    break
+                if self.__stop.wait(self.pause):
+                    self.__finish(deleted, touched, start)
+                    return deleted
+
+        self.__finish(deleted, touched, start)
+        return deleted
+
+    def __finish(self, deleted, touched, start):
+        self.rows += deleted
+        elapsed = perf_counter() - start
+        self.__run_time.record(elapsed)
+        self.__log.info('Retention: {0} rows of {1} sensors deleted in {2:.1f} s', deleted, touched, elapsed)
+
+    def start(self, interval=DEFAULT_INTERVAL):
+        """Фоновый поток: run_once каждые interval секунд до stop()"""
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__loop, args=(interval,), name='retention', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """Прерывает запуск между пачками и останавливает поток"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __loop(self, interval):
+        while not self.__stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.__log.error('Retention run failed: {0}', e)
+            if self.__stop.wait(interval):
+                break
+
+
+def main():
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description='Delete data history by per-sensor retention rules')
+    parser.add_argument('db_file')
+    parser.add_argument('data_file')
+    parser.add_argument('--interval', type=float, default=0, help='repeat every INTERVAL seconds (0 - run once)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_DELETE_BATCH)
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    job = RetentionJob(args.db_file, args.data_file, batch_size=args.batch_size, pause=args.pause,
+                       logger=logging.getLogger('retention'))
+    if args.interval <= 0:
+        if job.run_once() < 0:
+            raise SystemExit('Retention failed, see log')
+        return
+    job.start(args.interval)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Таблица текущих значений сенсоров в разделяемой памяти (multiprocessing.shared_memory).
+
+Опросчик пишет, остальные процессы (SNMP, веб) читают без SQLite и без блокировок.
+Раскладка фиксированная: заголовок и capacity слотов одинакового размера.
+Слот: seq, ключ (controller_ip, modbus_id), значение, время (unix time) и флаги качества.
+Каждый слот защищен seqlock: писатель делает seq нечетным, пишет и снова делает
+четным; читатель повторяет чтение, пока seq не совпадет до и после и не будет четным.
+Писатель у слота должен быть один (разные процессы могут писать в разные слоты).
+
+Ключи раскладываются по слотам при create(); добавлять ключи (add) должен тот же
+процесс, что создал таблицу. Остальные находят слоты по ключам, сохраненным в самих
+слотах, и перечитывают их, если число ключей в заголовке изменилось.
+
+    table = SharedValueTable.create('snmpagg_values', controllers.get_all_sensors())
+    table.set_sensor(sensor, 21.5)
+    ...
+    reader = SharedValueTable.attach('snmpagg_values')  # только чтение
+    value, date_time, flags = reader.get_sensor(sensor)
+"""
+
+import mmap
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+_yield = getattr(os, 'sched_yield', lambda: time.sleep(0))
+
+DEFAULT_NAME = 'snmpagg_values'
+MIN_CAPACITY = 1024
+MAX_RETRIES = 10000  # попыток чтения слота, который пишется прямо сейчас
+SPIN_RETRIES = 100   # после стольких попыток отдаем процессор писателю
+
+MAGIC = b'SVT1'
+HEADER = struct.Struct('<4sIII')        # magic, capacity, count, slot_size
+HEADER_SIZE = 64
+SEQ = struct.Struct('<Q')
+COUNT = struct.Struct('<I')
+COUNT_OFFSET = 8
+KEY = struct.Struct('<32si')            # controller_ip, modbus_id
+DATA = struct.Struct('<BxxxddI4x')      # kind, value, date_time, flags
+KEY_OFFSET = SEQ.size
+DATA_OFFSET = KEY_OFFSET + KEY.size
+SLOT_SIZE = DATA_OFFSET + DATA.size
+
+# флаги качества (битовая маска)
+FLAG_NO_DATA = 1      # значение еще не записывалось
+FLAG_READ_ERROR = 2   # последнее чтение неудачно, value - последнее удачное
+FLAG_OFFLINE = 4      # нет связи с контроллером
+
+# тип значения в слоте
+KIND_NONE = 0
+KIND_FLOAT = 1
+KIND_INT = 2
+KIND_BOOL = 3
+
+
+def _encode(value):
+    if value is None:
+        return KIND_NONE, 0.0
+    if isinstance(value, bool):
+        return KIND_BOOL, float(value)
+    if isinstance(value, int):
+        return KIND_INT, float(value)
+    return KIND_FLOAT, float(value)
+
+
+def _decode(kind, value):
+    if kind == KIND_FLOAT:
+        return value
+    if kind == KIND_INT:
+        return int(value)
+    if kind == KIND_BOOL:
+        return bool(value)
+    return None
+
+
+class SharedValueTable(object):
+
+    def __init__(self, name, shm=None, buf=None, readonly=False, owner=False):
+        """Не вызывается напрямую - см. create() и attach()"""
+        self.name = name
+        self.readonly = readonly
+        self.owner = owner
+        self.__shm = shm
+        self.__mmap = buf
+        self.__view = None
+        if buf is None:
+            buf = shm.buf
+        if readonly:
+            self.__view = memoryview(buf).toreadonly()
+            buf = self.__view
+        self.__buf = buf
+
+        magic, self.capacity, _, slot_size = HEADER.unpack_from(self.__buf, 0)
+        if magic != MAGIC or slot_size != SLOT_SIZE:
+            self.close()
+            raise ValueError('{0} is not a shared value table'.format(name))
+
+        self.__slots = {}  # {(controller_ip, modbus_id): offset}
+        self.__count = 0
+        self.__scan()
+
+    @classmethod
+    def create(cls, name=DEFAULT_NAME, keys=(), capacity=None):
+        """
+        Создает таблицу (существующая с тем же именем удаляется)
+        :param keys: [Sensor, ...] или [(controller_ip, modbus_id), ...]
+        :param capacity: число слотов (None - с запасом под новые сенсоры)
+        """
+        lst_keys = [cls.__key(key) for key in keys]
+        if capacity is None:
+            capacity = max(2 * len(lst_keys), MIN_CAPACITY)
+
+        try:
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * SLOT_SIZE)
+        HEADER.pack_into(shm.buf, 0, MAGIC, capacity, 0, SLOT_SIZE)
+        table = cls(name, shm=shm, owner=True)
+        for key in lst_keys:
+            table.add(key)
+        return table
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME, readonly=True):
+        """
+        Подключается к существующей таблице. readonly=True - отображение только на чтение.
+        На Linux файл /dev/shm отображается через mmap напрямую (PROT_READ для readonly):
+        так resource_tracker подключившегося процесса не удалит чужую таблицу при выходе
+        """
+        path = os.path.join('/dev/shm', name.lstrip('/'))
+        if os.path.exists(path):
+            with open(path, 'rb' if readonly else 'r+b') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+            return cls(name, buf=buf, readonly=readonly)
+
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return cls(name, shm=shm, readonly=readonly)
+
+    @staticmethod
+    def __key(key):
+        if isinstance(key, tuple):
+            return str(key[0]), int(key[1])
+        return str(key.controller_ip), int(key.modbus_id)
+
+    def __scan(self):
+        """Перечитывает ключи слотов, добавленные после последнего просмотра"""
+        count = COUNT.unpack_from(self.__buf, COUNT_OFFSET)[0]
+        for i in range(self.__count, count):
+            offset = HEADER_SIZE + i * SLOT_SIZE
+            ip, modbus_id = KEY.unpack_from(self.__buf, offset + KEY_OFFSET)
+            self.__slots[(ip.rstrip(b'\0').decode('utf-8'), modbus_id)] = offset
+        self.__count = count
+
+    def __offset(self, key):
+        offset = self.__slots.get(key)
+        if offset is None and COUNT.unpack_from(self.__buf, COUNT_OFFSET)[0] != self.__count:
+            self.__scan()
+            offset = self.__slots.get(key)
+        return offset
+
+    def __len__(self):
+        return self.__count
+
+    def keys(self):
+        self.__scan()
+        return list(self.__slots)
+
+    def add(self, key):
+        """
+        Выделяет слот под ключ (только в процессе-создателе)
+        :return: True - добавлен или уже есть, False - таблица заполнена
+        """
+        key = self.__key(key)
+        if key in self.__slots:
+            return True
+        if self.__count >= self.capacity:
+            return False
+
+        offset = HEADER_SIZE + self.__count * SLOT_SIZE
+        SEQ.pack_into(self.__buf, offset, 0)
+        KEY.pack_into(self.__buf, offset + KEY_OFFSET, key[0].encode('utf-8'), key[1])
+        DATA.pack_into(self.__buf, offset + DATA_OFFSET, KIND_NONE, 0.0, 0.0, FLAG_NO_DATA)
+        self.__slots[key] = offset
+        self.__count += 1
+        # счетчик - после заполнения слота, чтобы читатели не увидели пустой ключ
+        COUNT.pack_into(self.__buf, COUNT_OFFSET, self.__count)
+        return True
+
+    def set(self, controller_ip, modbus_id, value, date_time=None, flags=0):
+        """
+        :param date_time: unix time (None - сейчас)
+        :return: True - записано, False - для ключа нет слота
+        """
+        offset = self.__offset((controller_ip, modbus_id))
+        if offset is None:
+            return False
+
+        kind, number = _encode(value)
+        buf = self.__buf
+        seq = SEQ.unpack_from(buf, offset)[0]
+        if seq & 1:
+            seq += 1  # прошлый писатель упал посреди записи
+        SEQ.pack_into(buf, offset, seq + 1)
+        DATA.pack_into(buf, offset + DATA_OFFSET, kind, number,
+                       time.time() if date_time is None else date_time, flags)
+        SEQ.pack_into(buf, offset, seq + 2)
+        return True
+
+    def set_sensor(self, sensor, value, date_time=None, flags=0):
+        return self.set(sensor.controller_ip, sensor.modbus_id, value, date_time, flags)
+
+    def set_flags(self, controller_ip, modbus_id, flags):
+        """Меняет флаги, сохраняя последнее значение и его время (ошибка чтения, нет связи)"""
+        current = self.get(controller_ip, modbus_id)
+        if current is None:
+            return False
+        value, date_time, old_flags = current
+        return self.set(controller_ip, modbus_id, value, date_time, flags | (old_flags & FLAG_NO_DATA))
+
+    def get(self, controller_ip, modbus_id):
+        """
+        :return: (value, date_time, flags) или None, если слота нет
+            (или писатель завис посреди записи)
+        """
+        offset = self.__offset((controller_ip, modbus_id))
+        if offset is None:
+            return None
+
+        buf = self.__buf
+        data_offset = offset + DATA_OFFSET
+        for attempt in range(MAX_RETRIES):
+            seq = SEQ.unpack_from(buf, offset)[0]
+            if not seq & 1:
+                kind, value, date_time, flags = DATA.unpack_from(buf, data_offset)
+                if SEQ.unpack_from(buf, offset)[0] == seq:
+                    return _decode(kind, value), date_time, flags
+            if attempt >= SPIN_RETRIES:
+                _yield()
+        return None
+
+    def get_sensor(self, sensor):
+        return self.get(sensor.controller_ip, sensor.modbus_id)
+
+    def items(self):
+        """:return: {(controller_ip, modbus_id): (value, date_time, flags), ...}"""
+        self.__scan()
+        return {key: self.get(*key) for key in self.__slots}
+
+    def close(self):
+        self.__buf = None
+        if self.__view is not None:
+            self.__view.release()
+            self.__view = None
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+        if self.__shm is not None:
+            self.__shm.close()
+
+    def unlink(self):
+        """Удаляет таблицу (делает создатель при остановке)"""
+        if self.__shm is not None:
+            self.__shm.unlink()
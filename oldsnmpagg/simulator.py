@@ -0,0 +1,297 @@
+"""
+Локальный симулятор Modbus TCP для разработки и бенчмарков (без реальных контроллеров).
+
+Каждый контроллер из Controllers получает свой порт на 127.0.0.1. Поддерживаются
+функции 1, 2, 3, 4, 5, 6, 15, 16, несколько unit id на порт, задержка (latency + jitter),
+потеря ответов (drop_rate) и "мертвые" порты (соединение отклоняется).
+Запросы обрабатываются независимо, поэтому конвейер (PipelinedModbusClient) работает.
+
+    python -m oldsnmpagg.simulator config.db [--latency 0.005] [--jitter 0.002] [--drop-rate 0]
+"""
+
+import asyncio
+import random
+import socket
+import struct
+import threading
+
+MBAP_HEADER = struct.Struct('>HHHB')
+FLOAT_WORDS = struct.Struct('>HH')
+FLOAT32 = struct.Struct('>f')
+
+# function code -> таблица
+READ_FUNCTIONS = {
+    1: 'coil',
+    2: 'discrete',
+    3: 'holding_reg',
+    4: 'input'
+}
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_ADDRESS = 2
+
+
+class SimulatedDevice(object):
+    """
+    Память одного порта (шлюза): {(unit_id, address): value} для каждого типа регистра.
+    Незаданные адреса читаются как 0.
+    """
+
+    def __init__(self):
+        self.tables = {
+            'coil': {},
+            'discrete': {},
+            'input': {},
+            'holding_reg': {}
+        }
+        self.requests = 0
+
+    def set_value(self, register_type, address, value, unit_id=1, data_type='int'):
+        table = self.tables[register_type]
+        if register_type in ('coil', 'discrete'):
+            table[(unit_id, address)] = 1 if value else 0
+        elif data_type == 'real':
+            # порядок байт Big, порядок слов Little - как у контроллеров
+            high, low = FLOAT_WORDS.unpack(FLOAT32.pack(value))
+            table[(unit_id, address)] = low
+            table[(unit_id, address + 1)] = high
+        else:
+            table[(unit_id, address)] = int(value) & 0xffff
+
+    def read(self, register_type, unit_id, address, count):
+        table = self.tables[register_type]
+        return [table.get((unit_id, address + i), 0) for i in range(count)]
+
+    def write(self, register_type, unit_id, address, values):
+        table = self.tables[register_type]
+        for i, value in enumerate(values):
+            table[(unit_id, address + i)] = value
+
+    def handle(self, unit_id, pdu):
+        """
+        :return: PDU ответа
+        """
+        self.requests += 1
+        function_code = pdu[0]
+        try:
+            if function_code in READ_FUNCTIONS:
+                address, count = struct.unpack('>HH', pdu[1:5])
+                values = self.read(READ_FUNCTIONS[function_code], unit_id, address, count)
+                if function_code in (1, 2):
+                    data = bytearray((count + 7) // 8)
+                    for i, value in enumerate(values):
+                        if value:
+                            data[i // 8] |= 1 << (i % 8)
+                    return struct.pack('>BB', function_code, len(data)) + bytes(data)
+                return struct.pack('>BB', function_code, count * 2) + struct.pack('>{0}H'.format(count), *values)
+
+            if function_code == 5:
+                address, value = struct.unpack('>HH', pdu[1:5])
+                self.write('coil', unit_id, address, [1 if value == 0xff00 else 0])
+                return pdu[:5]
+
+            if function_code == 6:
+                address, value = struct.unpack('>HH', pdu[1:5])
+                self.write('holding_reg', unit_id, address, [value])
+                return pdu[:5]
+
+            if function_code == 15:
+                address, count = struct.unpack('>HH', pdu[1:5])
+                data = pdu[6:]
+                values = [(data[i // 8] >> (i % 8)) & 1 for i in range(count)]
+                self.write('coil', unit_id, address, values)
+                return pdu[:5]
+
+            if function_code == 16:
+                address, count = struct.unpack('>HH', pdu[1:5])
+                values = struct.unpack('>{0}H'.format(count), pdu[6:6 + count * 2])
+                self.write('holding_reg', unit_id, address, values)
+                return pdu[:5]
+
+        except (struct.error, IndexError):
+            return struct.pack('>BB', function_code | 0x80, ILLEGAL_ADDRESS)
+
+        return struct.pack('>BB', function_code | 0x80, ILLEGAL_FUNCTION)
+
+
+class ModbusSimulator(object):
+    """
+    Набор симулированных портов в отдельном потоке (asyncio).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, drop_rate=0.0, seed=None, host='127.0.0.1'):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.host = host
+        self.random = random.Random(seed)
+
+        self.devices = {}     # {port: SimulatedDevice}
+        self.dead_ports = []  # порты, на которых никто не слушает
+        self.ports = {}       # {controller_ip: port} для from_controllers
+
+        self.__loop = None
+        self.__thread = None
+        self.__servers = []
+
+    @staticmethod
+    def free_port(host='127.0.0.1'):
+        sock = socket.socket()
+        sock.bind((host, 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def add_device(self, port=None):
+        """
+        :return: (port, SimulatedDevice). Порты добавляются до start()
+        """
+        if port is None:
+            port = self.free_port(self.host)
+        device = SimulatedDevice()
+        self.devices[port] = device
+        return port, device
+
+    def add_dead_port(self):
+        port = self.free_port(self.host)
+        self.dead_ports.append(port)
+        return port
+
+    @classmethod
+    def from_controllers(cls, controllers, dead_ips=(), seed=None, **kwargs):
+        """
+        Создает по порту на каждый контроллер и заполняет регистры его сенсоров
+        (аналоговые - случайные значения, дискретные - 0/1).
+        :param controllers: oldsnmpagg.controllers.Controllers
+        :param dead_ips: контроллеры, чьи порты будут "мертвыми"
+        """
+        simulator = cls(seed=seed, **kwargs)
+        devices = {}
+        for controller in controllers.get_controllers():
+            if controller.ip_address in dead_ips:
+                simulator.ports[controller.ip_address] = simulator.add_dead_port()
+                continue
+            port, devices[controller.ip_address] = simulator.add_device()
+            simulator.ports[controller.ip_address] = port
+
+        rnd = random.Random(seed)
+        for sensor in controllers.get_all_sensors():
+            device = devices.get(sensor.controller_ip)
+            if device is None:
+                continue
+            if sensor.register_type in ('coil', 'discrete'):
+                value = rnd.randint(0, 1)
+            elif sensor.data_type == 'real':
+                value = rnd.uniform(-100, 100)
+            else:
+                value = rnd.randint(0, 1000)
+            device.set_value(sensor.register_type, sensor.modbus_id, value, sensor.get_unit_id(), sensor.data_type)
+
+        return simulator
+
+    def request_count(self):
+        return sum(device.requests for device in self.devices.values())
+
+    def reset_counters(self):
+        for device in self.devices.values():
+            device.requests = 0
+
+    def start(self):
+        started = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(started,), daemon=True)
+        self.__thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self.__loop is None:
+            return
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop = None
+
+    def __run(self, started):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.__loop = loop
+        for port, device in self.devices.items():
+            server = loop.run_until_complete(asyncio.start_server(
+                lambda reader, writer, device=device: self.__serve(reader, writer, device),
+                self.host, port
+            ))
+            self.__servers.append(server)
+        started.set()
+
+        try:
+            loop.run_forever()
+        finally:
+            for server in self.__servers:
+                server.close()
+            self.__servers = []
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    async def __serve(self, reader, writer, device):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack(header)
+                if length < 2:
+                    break
+                pdu = await reader.readexactly(length - 1)
+
+                if self.drop_rate > 0 and self.random.random() < self.drop_rate:
+                    continue
+
+                response = device.handle(unit_id, pdu)
+                frame = MBAP_HEADER.pack(transaction_id, protocol_id, len(response) + 1, unit_id) + response
+                delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+                if delay > 0:
+                    loop.call_later(delay, self.__send, writer, frame)
+                else:
+                    self.__send(writer, frame)
+
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def __send(writer, frame):
+        if not writer.is_closing():
+            writer.write(frame)
+
+
+def main():
+    import argparse
+    import time
+    from oldsnmpagg.controllers import Controllers
+
+    parser = argparse.ArgumentParser(description='Modbus TCP simulator for controllers from config DB')
+    parser.add_argument('db_file')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--dead', action='append', default=[], help='IP of controller with dead port')
+    args = parser.parse_args()
+
+    simulator = ModbusSimulator.from_controllers(
+        Controllers(args.db_file, read_only=True), dead_ips=args.dead,
+        latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate
+    ).start()
+    for ip, port in sorted(simulator.ports.items()):
+        print('{0} -> {1}:{2}{3}'.format(ip, simulator.host, port, ' (dead)' if port in simulator.dead_ports else ''))
+
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
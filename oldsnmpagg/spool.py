@@ -0,0 +1,206 @@
+"""
+Спул истории: append-only файл, куда DataDB складывает отсчеты, пока база недоступна
+(диск заполнен, база заблокирована, обслуживание). После восстановления отсчеты
+переносятся в DataDB пачками (replay) и файл очищается.
+
+Формат файла: заголовок (MAGIC + generation, 16 байт случайного id) и записи
+<длина><crc32><отсчет>. Запись с неполной длиной или неверным crc (обрыв при падении)
+и все, что после нее, при replay отбрасываются.
+fsync делается пачками: после fsync_batch записей или fsync_interval секунд.
+
+Replay идемпотентен: позиция в спуле (path, generation, offset) сохраняется в DataDB в той же
+транзакции, что и перенесенные отсчеты, поэтому падение посреди replay не дает дублей.
+"""
+
+import os
+import struct
+import time
+import uuid
+import zlib
+
+from oldsnmpagg.wrappers import Data, Sensor
+
+MAGIC = b'SPL1'
+HEADER_SIZE = len(MAGIC) + 16
+RECORD_HEADER = struct.Struct('<II')     # длина, crc32
+SAMPLE = struct.Struct('<diiBH')         # date_time, oid, modbus_id, kind, длина ip
+DEFAULT_FSYNC_BATCH = 1000
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_REPLAY_BATCH = 5000
+
+KIND_NONE = 0
+KIND_FLOAT = 1
+KIND_INT = 2
+KIND_BOOL = 3
+KIND_STR = 4
+KIND_BYTES = 5
+
+FLOAT = struct.Struct('<d')
+INT = struct.Struct('<q')
+
+
+def encode_sample(controller_ip, oid, modbus_id, value, date_time):
+    ip = str(controller_ip).encode('utf-8')
+    if value is None:
+        kind, payload = KIND_NONE, b''
+    elif isinstance(value, bool):
+        kind, payload = KIND_BOOL, INT.pack(int(value))
+    elif isinstance(value, int):
+        kind, payload = KIND_INT, INT.pack(value)
+    elif isinstance(value, float):
+        kind, payload = KIND_FLOAT, FLOAT.pack(value)
+    elif isinstance(value, bytes):
+        kind, payload = KIND_BYTES, value
+    else:
+        kind, payload = KIND_STR, str(value).encode('utf-8')
+    return SAMPLE.pack(date_time, int(oid), int(modbus_id), kind, len(ip)) + ip + payload
+
+
+def decode_sample(record):
+    """:return: (controller_ip, oid, modbus_id, value, date_time)"""
+    date_time, oid, modbus_id, kind, ip_len = SAMPLE.unpack_from(record, 0)
+    start = SAMPLE.size + ip_len
+    controller_ip = record[SAMPLE.size:start].decode('utf-8')
+    payload = record[start:]
+    if kind == KIND_FLOAT:
+        value = FLOAT.unpack(payload)[0]
+    elif kind == KIND_INT:
+        value = INT.unpack(payload)[0]
+    elif kind == KIND_BOOL:
+        value = bool(INT.unpack(payload)[0])
+    elif kind == KIND_STR:
+        value = payload.decode('utf-8')
+    elif kind == KIND_BYTES:
+        value = bytes(payload)
+    else:
+        value = None
+    return controller_ip, oid, modbus_id, value, date_time
+
+
+class Spool(object):
+
+    def __init__(self, path, fsync_batch=DEFAULT_FSYNC_BATCH, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.generation = None
+        self.__file = None
+        self.__unsynced = 0
+        self.__synced_at = time.time()
+        self.__open()
+
+    def __open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if header[:len(MAGIC)] == MAGIC:
+                self.generation = header[len(MAGIC):].hex()
+                self.__file = open(self.path, 'ab')
+                # обрезаем оборванную при падении запись, иначе новые записи окажутся за ней
+                end = HEADER_SIZE
+                for end, _ in self.read():
+                    pass
+                if end < os.path.getsize(self.path):
+                    self.__file.truncate(end)
+                    self.__file.seek(0, os.SEEK_END)
+                return
+        self.__reset()
+
+    def __reset(self):
+        """Новый пустой файл с новым generation (атомарно, через временный файл)"""
+        if self.__file is not None:
+            self.__file.close()
+        generation = uuid.uuid4().bytes
+        tmp_path = '{0}.tmp'.format(self.path)
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.generation = generation.hex()
+        self.__file = open(self.path, 'ab')
+        self.__unsynced = 0
+
+    def size(self):
+        """Размер записей в байтах (без заголовка)"""
+        return self.__file.tell() - HEADER_SIZE
+
+    def is_empty(self):
+        return self.size() <= 0
+
+    def append(self, data: Data):
+        return self.append_sample(
+            data.sensor.controller_ip, data.sensor.oid, data.sensor.modbus_id,
+            data.value, data.date_time_as_unixtimestap()
+        )
+
+    def append_sample(self, controller_ip, oid, modbus_id, value, date_time):
+        record = encode_sample(controller_ip, oid, modbus_id, value, date_time)
+        self.__file.write(RECORD_HEADER.pack(len(record), zlib.crc32(record)) + record)
+        self.__unsynced += 1
+        if self.__unsynced >= self.fsync_batch or time.time() - self.__synced_at >= self.fsync_interval:
+            self.sync()
+        return True
+
+    def sync(self):
+        if self.__unsynced:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__unsynced = 0
+        self.__synced_at = time.time()
+
+    def read(self, offset=HEADER_SIZE):
+        """
+        :return: генератор (end_offset, (controller_ip, oid, modbus_id, value, date_time))
+            end_offset - позиция сразу после записи
+        """
+        self.__file.flush()
+        with open(self.path, 'rb') as f:
+            f.seek(max(offset, HEADER_SIZE))
+            position = f.tell()
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                length, crc = RECORD_HEADER.unpack(header)
+                record = f.read(length)
+                if len(record) < length or zlib.crc32(record) != crc:
+                    return
+                position += RECORD_HEADER.size + length
+                yield position, decode_sample(record)
+
+    def replay(self, data_db, batch=DEFAULT_REPLAY_BATCH):
+        """
+        Переносит отсчеты в DataDB пачками и очищает спул
+        :return: число перенесенных отсчетов или -1, если база снова отказала
+        """
+        self.sync()
+        offset = data_db.get_spool_offset(self.path, self.generation)
+        if offset < 0:
+            return -1
+
+        replayed = 0
+        lst_data = []
+        end_offset = offset
+        for end_offset, (controller_ip, oid, modbus_id, value, date_time) in self.read(offset):
+            sensor = Sensor(controller_ip=controller_ip, oid=oid, modbus_id=modbus_id)
+            lst_data.append(Data(sensor, value, date_time))
+            if len(lst_data) >= batch:
+                if not data_db.add_data_many(lst_data, spool_position=(self.path, self.generation, end_offset)):
+                    return -1
+                replayed += len(lst_data)
+                lst_data = []
+
+        if lst_data:
+            if not data_db.add_data_many(lst_data, spool_position=(self.path, self.generation, end_offset)):
+                return -1
+            replayed += len(lst_data)
+
+        self.__reset()
+        return replayed
+
+    def close(self):
+        if self.__file is not None:
+            self.sync()
+            self.__file.close()
+            self.__file = None
@@ -6,8 +6,9 @@
 # Year: 2017
 
 import hashlib
+import hmac
 import os
-import socket
+import threading
 
 try:
     from config import GROUPS_FILE
@@ -30,23 +31,40 @@ def verify_login(login, password, st_users, logger=None):
     md5_password = hashlib.md5(password.encode('utf-8')).hexdigest()
 
     debug(logger, 'login={0}, password={1}, md5hash={2}'.format(login, password, md5_password))
+    if isinstance(st_users, dict):
+        return st_users.get(login) == md5_password
     if {login: md5_password} in st_users:
         return True
     return False
 
 
+def _file_stamp(path):
+    """(mtime, size, inode) - меняется при любой перезаписи файла, в т.ч. через rename"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def write_file_atomic(path, lines):
+    """Пишет во временный файл рядом, fsync и rename поверх path"""
+    tmp_path = '{0}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 def save_groups_file(groups, groups_file=GROUPS_FILE, logger=None):
     try:
-        f = open('{0}.tmp'.format(groups_file), 'w')
         lines = []
         for group_name in groups.keys():
             line = '{0}: {1}\n'
             users_line = ', '.join(groups[group_name])
             lines.append(line.format(group_name, users_line))
-        f.writelines(lines)
-
-        os.remove(groups_file)
-        os.rename('{0}.tmp'.format(groups_file), groups_file)
+        write_file_atomic(groups_file, lines)
 
     except Exception as e:
         err(logger, 'Error in save_groups_file: {0}'.format(e))
@@ -156,17 +174,12 @@ def remove_user(users_file, username=None, logger=None):
     if username not in uids:
         return False
 
-    f = open(users_file + '.tmp', 'w')
-
+    lines = []
     for user in  users:
         uid = list(user.keys())[0]
         if username != uid:
-            f.write('{0}:{1}\n'.format(uid, user[uid]))
-
-    f.close()
-
-    os.remove(users_file)
-    os.rename(users_file + '.tmp', users_file)
+            lines.append('{0}:{1}\n'.format(uid, user[uid]))
+    write_file_atomic(users_file, lines)
 
     return True
 
@@ -192,20 +205,183 @@ def user_add_or_modify(users_file, username=None, password='', logger=None):
                 debug(logger, 'Modify user {0}:{1}'.format(username, md5_password))
 
 
-    f = open(users_file + '.tmp', 'w')
-
-    debug(logger, 'Writing tmp-file: {0}...'.format(users_file + '.tmp'))
+    debug(logger, 'Writing {0}...'.format(users_file))
+    lines = []
     for user in users:
         uid = list(user.keys())[0]
-        f.write('{0}:{1}\n'.format(uid, user[uid]))
-
-    f.close()
-    os.remove(users_file)
-    debug(logger, 'Rename tmp-file to {0}...'.format(users_file))
-    os.rename(users_file + '.tmp', users_file)
+        lines.append('{0}:{1}\n'.format(uid, user[uid]))
+    write_file_atomic(users_file, lines)
     return True
 
 
+class UserStore(object):
+    """
+    Пользователи и группы (файлы тех же форматов, что у get_users/get_groups) в памяти:
+    {login: md5hash}, {group: [login, ...]} и обратный индекс {login: {group, ...}}.
+    Файлы перечитываются, только если изменились (mtime, размер, inode) - в том числе
+    другим процессом. Изменения пишутся атомарно (write_file_atomic).
+    Один экземпляр на пару файлов - get_user_store().
+    """
+
+    def __init__(self, users_file, groups_file=GROUPS_FILE, logger=None):
+        self.users_file = users_file
+        self.groups_file = groups_file
+        self.logger = logger
+        self.__lock = threading.RLock()
+        self.__users = {}        # {login: md5hash}
+        self.__groups = {}       # {group: [login, ...]}
+        self.__user_groups = {}  # {login: {group, ...}}
+        self.__users_stamp = None
+        self.__groups_stamp = None
+
+    # __loading__
+    def __load_users(self):
+        stamp = _file_stamp(self.users_file)
+        if stamp == self.__users_stamp:
+            return self.__users
+        with self.__lock:
+            users = {}
+            try:
+                with open(self.users_file) as f:
+                    for line in f:
+                        line = line.strip()
+                        if len(line) <= 2:
+                            continue
+                        splited_line = line.split(':')
+                        if len(splited_line) != 2:
+                            warn(self.logger, 'Not correct line. Skip.')
+                            continue
+                        users[splited_line[0]] = splited_line[1]
+            except OSError as e:
+                err(self.logger, 'UserStore: can not read {0}: {1}'.format(self.users_file, e))
+            self.__users = users
+            self.__users_stamp = stamp
+            debug(self.logger, 'UserStore: {0} users loaded'.format(len(users)))
+        return self.__users
+
+    def __load_groups(self):
+        stamp = _file_stamp(self.groups_file)
+        if stamp == self.__groups_stamp:
+            return self.__groups
+        with self.__lock:
+            groups = get_groups(self.groups_file, self.logger) if stamp is not None else {}
+            self.__set_groups(groups)
+            self.__groups_stamp = stamp
+        return self.__groups
+
+    def __set_groups(self, groups):
+        user_groups = {}
+        for group_name, lst_users in groups.items():
+            for username in lst_users:
+                if username:
+                    user_groups.setdefault(username, set()).add(group_name)
+        self.__groups = groups
+        self.__user_groups = user_groups
+
+    # __reading__
+    def verify_login(self, login, password):
+        """:return: True - логин есть и пароль совпадает"""
+        md5_hash = self.__load_users().get(login)
+        if md5_hash is None:
+            return False
+        return hmac.compare_digest(md5_hash, hashlib.md5(password.encode('utf-8')).hexdigest())
+
+    def has_user(self, login):
+        return login in self.__load_users()
+
+    def get_users(self):
+        """:return: {login: md5hash} (копия)"""
+        return dict(self.__load_users())
+
+    def get_groups(self):
+        """:return: {group: [login, ...]} (копия, как у get_groups)"""
+        return {group_name: list(lst_users) for group_name, lst_users in self.__load_groups().items()}
+
+    def get_user_groups(self, login):
+        """:return: множество групп пользователя"""
+        self.__load_groups()
+        return set(self.__user_groups.get(login, ()))
+
+    def in_group(self, login, group_name):
+        self.__load_groups()
+        return group_name in self.__user_groups.get(login, ())
+
+    # __writing__
+    def user_add_or_modify(self, username=None, password=''):
+        """Добавляет пользователя, если он есть - меняет хэш"""
+        if username is None:
+            return False
+        with self.__lock:
+            users = dict(self.__load_users())
+            users[username] = hashlib.md5(password.encode('utf-8')).hexdigest()
+            return self.__save_users(users)
+
+    def remove_user(self, username=None):
+        """Удаляет пользователя (из групп - remove_from_all_groups)"""
+        with self.__lock:
+            users = self.__load_users()
+            if username is None or username not in users:
+                return False
+            users = dict(users)
+            del users[username]
+            return self.__save_users(users)
+
+    def add_in_group(self, username, group_name):
+        with self.__lock:
+            groups = self.get_groups()
+            if username in groups.get(group_name, ()):
+                return True
+            return self.__save_groups(add_in_group(username, group_name, groups))
+
+    def remove_from_group(self, username, group_name):
+        with self.__lock:
+            if not self.in_group(username, group_name):
+                return True
+            return self.__save_groups(remove_from_group(username, group_name, self.get_groups()))
+
+    def remove_from_all_groups(self, username):
+        with self.__lock:
+            if not self.get_user_groups(username):
+                return True
+            return self.__save_groups(remove_from_all_groups(username, self.get_groups()))
+
+    def __save_users(self, users):
+        try:
+            write_file_atomic(self.users_file, ['{0}:{1}\n'.format(uid, md5_hash) for uid, md5_hash in users.items()])
+        except Exception as e:
+            err(self.logger, 'UserStore: can not write {0}: {1}'.format(self.users_file, e))
+            return False
+        self.__users = users
+        self.__users_stamp = _file_stamp(self.users_file)
+        return True
+
+    def __save_groups(self, groups):
+        try:
+            write_file_atomic(self.groups_file, [
+                '{0}: {1}\n'.format(group_name, ', '.join(lst_users)) for group_name, lst_users in groups.items()
+            ])
+        except Exception as e:
+            err(self.logger, 'UserStore: can not write {0}: {1}'.format(self.groups_file, e))
+            return False
+        self.__set_groups(groups)
+        self.__groups_stamp = _file_stamp(self.groups_file)
+        return True
+
+
+_user_stores = {}
+_user_stores_lock = threading.Lock()
+
+
+def get_user_store(users_file, groups_file=GROUPS_FILE, logger=None):
+    """:return: общий UserStore для пары файлов (создается при первом вызове)"""
+    key = (os.path.abspath(users_file), os.path.abspath(groups_file))
+    with _user_stores_lock:
+        store = _user_stores.get(key)
+        if store is None:
+            store = _user_stores[key] = UserStore(users_file, groups_file, logger)
+        return store
+
+
 def is_valid_ip(str_ip):
     """
     Функция проверяет является ли строка валидным IP-адресом
@@ -1,9 +1,6 @@
-import socket
-import json
-import csv
-from snmpagg.utils import lower_first_char
+from oldsnmpagg.utils import lower_first_char
 import datetime
-import dateutil.parser
+import functools
 
 REGISTER_TYPES = {
     'coil': 'Coil',
@@ -17,15 +14,43 @@ RW_REGISTERS = ['coil', 'holding_reg']
 
 CONNECT_TEST_DELAY = 1
 
+
+def ip_key(ip_address):
+    """Ключ сортировки ip: 10.0.0.2 раньше 10.0.0.10"""
+    try:
+        return tuple(int(part) for part in ip_address.split('.')), ip_address
+    except (AttributeError, ValueError):
+        return (), str(ip_address)
+
+
+def number_key(value):
+    """Ключ сортировки oid/modbus_id/порта: числовой, в т.ч. для строк из CSV ('5' == 5)"""
+    try:
+        return int(value), ''
+    except (TypeError, ValueError):
+        return -1, str(value)
+
+
+def parse_date_time(text):
+    """ISO 8601 через datetime.fromisoformat, остальные форматы - dateutil (медленно)"""
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        import dateutil.parser  # ~40 мс на импорт, нужен только для не-ISO строк
+        return dateutil.parser.parse(text)
+
+
+@functools.total_ordering
 class Controller:
-    """ Обертка для данных из таблицы controllers"""
-    root_oid = ''
-    ip_address = ''
-    oid = 0
-    oid_name = ''
-    tcp_port = 0
-    description = ''
-    connect = None
+    """
+    Обертка для данных из таблицы controllers.
+    Равенство, hash и порядок - по (ip_address, tcp_port); ключ вычисляется при первом
+    сравнении и кешируется, присваивание ip_address или tcp_port сбрасывает его
+    (не меняйте их у объекта, который уже лежит в set/dict - hash изменится)
+    """
+    __slots__ = (
+        'root_oid', '_ip_address', 'oid', 'oid_name', '_tcp_port', 'description', 'unit_id', 'connect', '__key'
+    )
 
     def __init__(self,
                  root_oid='',
@@ -34,6 +59,7 @@ class Controller:
                  oid_name='',
                  tcp_port=0,
                  description='',
+                 unit_id=1
                  ):
         self.root_oid = root_oid
         self.ip_address = ip_address
@@ -41,6 +67,9 @@ class Controller:
         self.oid_name = lower_first_char(oid_name)
         self.tcp_port = tcp_port
         self.description = description
+        self.unit_id = 1 if unit_id is None else unit_id
+        self.connect = None
+        self.__key = None
 
     def __str__(self):
         return '<Controller>:{0}:{1}:{2}:{3}:{4}:{5}'.format(
@@ -52,16 +81,47 @@ class Controller:
             self.description
         )
 
-    def __gt__(self, other):
-        lst_ip_addresses = sorted(set([self.ip_address, other.ip_address]))
-        if len(lst_ip_addresses) == 2 and self.ip_address == lst_ip_addresses[1]:
-            return True
-        return False
+    @property
+    def ip_address(self):
+        return self._ip_address
+
+    @ip_address.setter
+    def ip_address(self, value):
+        self._ip_address = value
+        self.__key = None
+
+    @property
+    def tcp_port(self):
+        return self._tcp_port
+
+    @tcp_port.setter
+    def tcp_port(self, value):
+        self._tcp_port = value
+        self.__key = None
+
+    def sort_key(self):
+        key = self.__key
+        if key is None:
+            key = self.__key = (ip_key(self._ip_address), number_key(self._tcp_port))
+        return key
+
+    def __hash__(self):
+        return hash(self.__key or self.sort_key())
 
     def __eq__(self, other):
-        if self.ip_address == other.ip_address and self.tcp_port == other.tcp_port:
-            return True
-        return False
+        if not isinstance(other, Controller):
+            return NotImplemented
+        return (self.__key or self.sort_key()) == (other.__key or other.sort_key())
+
+    def __lt__(self, other):
+        if not isinstance(other, Controller):
+            return NotImplemented
+        return (self.__key or self.sort_key()) < (other.__key or other.sort_key())
+
+    def __gt__(self, other):
+        if not isinstance(other, Controller):
+            return NotImplemented
+        return (self.__key or self.sort_key()) > (other.__key or other.sort_key())
 
     def set_connect(self, func=None, logger=None):
         con = func(addr=self.ip_address, port=self.tcp_port, logger=logger)
@@ -76,6 +136,7 @@ class Controller:
         True - if connected
         Flase - if not
         """
+        import socket
 
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -89,21 +150,21 @@ class Controller:
             return False
 
 
+@functools.total_ordering
 class Sensor:
-    """Обертка для данных из таблицы sensors"""
-    controller_ip = ''
-    oid = 0
-    oid_name = ''
-    modbus_id = 0
-    data_type = 0
-    description = ''
-    register_type = 'input'
-    register_type_name = REGISTER_TYPES['input']
-    monitoring = False
-    controller = None
-    min_value = None
-    max_value = None
-    value = None
+    """
+    Обертка для данных из таблицы sensors.
+    controller - общий для всех сенсоров контроллера, если передан готовый
+    (Controllers.get_sensors / get_all_sensors), иначе создается из controller_*
+    Равенство, hash и порядок - по (controller_ip, oid, modbus_id), oid и modbus_id
+    сравниваются как числа; ключ кешируется при первом сравнении и сбрасывается
+    присваиванием этих полей (как у Controller)
+    """
+    __slots__ = (
+        '_controller_ip', '_oid', 'oid_name', '_modbus_id', 'data_type', 'description',
+        'register_type', 'register_type_name', 'monitoring', 'controller',
+        'min_value', 'max_value', 'value', 'deadband_abs', 'deadband_pct', 'unit_id', '__key'
+    )
 
     def __init__(self,
                  controller_root_oid='',
@@ -122,7 +183,12 @@ class Sensor:
                  monitoring=False,
                  min_value='',
                  max_value='',
-                 value=''
+                 value='',
+                 deadband_abs='',
+                 deadband_pct='',
+                 unit_id=None,
+                 controller_unit_id=1,
+                 controller=None
                  ):
         self.controller_ip = controller_ip
         self.oid = oid
@@ -131,17 +197,24 @@ class Sensor:
         self.data_type = data_type
         self.description = description
 
-        self.controller = Controller(
-            controller_root_oid, controller_ip_address,
-            controller_oid, controller_oid_name,
-            controller_tcp_port, controller_description
-        )
+        if controller is None:
+            controller = Controller(
+                controller_root_oid, controller_ip_address,
+                controller_oid, controller_oid_name,
+                controller_tcp_port, controller_description,
+                controller_unit_id
+            )
+        self.controller = controller
 
         self.set_register_type(register_type)
         self.set_monitoring(monitoring)
         self.set_min_value(min_value)
         self.set_max_value(max_value)
         self.value = value
+        self.set_deadband_abs(deadband_abs)
+        self.set_deadband_pct(deadband_pct)
+        self.unit_id = None if unit_id == '' else unit_id
+        self.__key = None
 
     def __str__(self):
         return '<Sensor>:{0}:{1}:{2}:{3}:{4}:{5}:({6}={7}):{8}'.format(
@@ -156,14 +229,56 @@ class Sensor:
             self.monitoring
         )
 
+    @property
+    def controller_ip(self):
+        return self._controller_ip
+
+    @controller_ip.setter
+    def controller_ip(self, value):
+        self._controller_ip = value
+        self.__key = None
+
+    @property
+    def oid(self):
+        return self._oid
+
+    @oid.setter
+    def oid(self, value):
+        self._oid = value
+        self.__key = None
+
+    @property
+    def modbus_id(self):
+        return self._modbus_id
+
+    @modbus_id.setter
+    def modbus_id(self, value):
+        self._modbus_id = value
+        self.__key = None
+
+    def sort_key(self):
+        key = self.__key
+        if key is None:
+            key = self.__key = (ip_key(self._controller_ip), number_key(self._oid), number_key(self._modbus_id))
+        return key
+
+    def __hash__(self):
+        return hash(self.__key or self.sort_key())
+
+    def __eq__(self, other):
+        if not isinstance(other, Sensor):
+            return NotImplemented
+        return (self.__key or self.sort_key()) == (other.__key or other.sort_key())
+
+    def __lt__(self, other):
+        if not isinstance(other, Sensor):
+            return NotImplemented
+        return (self.__key or self.sort_key()) < (other.__key or other.sort_key())
+
     def __gt__(self, other):
-        lst = sorted([
-            '{0}_{1}'.format(self.controller_ip, self.oid),
-            '{0}_{1}'.format(other.controller_ip, other.oid)
-        ])
-        if len(lst) == 2 and '{0}_{1}'.format(self.controller_ip, self.oid) == lst[1]:
-            return True
-        return False
+        if not isinstance(other, Sensor):
+            return NotImplemented
+        return (self.__key or self.sort_key()) > (other.__key or other.sort_key())
 
     def get_snmp_data_type(self):
         dict_types = {
@@ -183,6 +298,12 @@ class Sensor:
         except KeyError:
             self.register_type_name = 'UnknownType'
 
+    def get_unit_id(self):
+        """Modbus unit id: свой у сенсора или контроллера (шлюза)"""
+        if self.unit_id is None:
+            return self.controller.unit_id
+        return self.unit_id
+
     def full_oid(self):
         return '{0}.{1}.{2}'.format(self.controller.root_oid, self.controller.oid, self.oid)
 
@@ -227,6 +348,18 @@ class Sensor:
     def get_max_value(self):
         return self.__get_value(self.max_value)
 
+    def set_deadband_abs(self, deadband_abs):
+        self.deadband_abs = self.__set_value(deadband_abs)
+
+    def set_deadband_pct(self, deadband_pct):
+        self.deadband_pct = self.__set_value(deadband_pct)
+
+    def get_deadband_abs(self):
+        return self.__get_value(self.deadband_abs)
+
+    def get_deadband_pct(self):
+        return self.__get_value(self.deadband_pct)
+
     @staticmethod
     def from_csv(csv_string):
         lst_fields = csv_string.split(';')
@@ -263,23 +396,37 @@ class Sensor:
 
 
 class Data:
-    """Обертка для данных полученных с сенсора (таблица data_history"""
-    id = 0
-    date_time = None  # object Data
-    sensor = None     # object Sensor
-    value = None
+    """
+    Обертка для данных полученных с сенсора (таблица data_history.
+    Время хранится как пришло: unix time (чтение из DataDB) или datetime;
+    datetime и ISO-строка создаются при первом обращении (date_time, get_date_time_iso8601)
+    """
+    __slots__ = ('id', 'sensor', 'value', '__timestamp', '__date_time')
 
     def __init__(self, sensor, value, date_time, item_id=0):
         self.id = item_id
         self.sensor = sensor
         self.value = value
-
-        if type(date_time) == str:
-            self.date_time = dateutil.parser.parse(date_time)
-        elif type(date_time) == float:
-            self.date_time = datetime.datetime.fromtimestamp(date_time)
+        self.__timestamp = None
+        self.__date_time = None
+
+        kind = type(date_time)
+        if kind is float or kind is int:
+            self.__timestamp = date_time
+        elif kind is str:
+            self.__date_time = parse_date_time(date_time)
         else:
-            self.date_time = date_time
+            self.__date_time = date_time
+
+    @property
+    def date_time(self):
+        if self.__date_time is None and self.__timestamp is not None:
+            self.__date_time = datetime.datetime.fromtimestamp(self.__timestamp)
+        return self.__date_time
+
+    @date_time.setter
+    def date_time(self, date_time):
+        self.__init__(self.sensor, self.value, date_time, self.id)
 
     def __str__(self):
         return '{0}:{1}:{2}:{3}'.format(self.id, self.sensor, self.value, self.date_time)
@@ -288,7 +435,9 @@ class Data:
         return self.date_time.isoformat()
 
     def date_time_as_unixtimestap(self):
-        return self.date_time.timestamp()
+        if self.__timestamp is None:
+            self.__timestamp = self.__date_time.timestamp()
+        return self.__timestamp
 
     def as_dict(self):
         return {
@@ -301,6 +450,7 @@ class Data:
         }
 
     def as_json(self):
+        import json
         return json.dumps(self.as_dict())
 
     def as_csv(self):
@@ -309,4 +459,29 @@ class Data:
             self.sensor.controller_ip,
             self.sensor.modbus_id,
             self.value
-        )
\ No newline at end of file
+        )
+
+class RetentionRule(object):
+    """
+    Обертка для данных из таблицы retention_rules: сколько дней хранить историю.
+    None в controller_ip / modbus_id / register_type - любой; правило с modbus_id - для одного
+    сенсора контроллера controller_ip. days = None - хранить всегда
+    """
+    __slots__ = ('controller_ip', 'modbus_id', 'register_type', 'days')
+
+    def __init__(self, controller_ip=None, modbus_id=None, register_type=None, days=None):
+        self.controller_ip = controller_ip or None
+        self.modbus_id = None if modbus_id in (None, '') else int(modbus_id)
+        self.register_type = register_type or None
+        self.days = None if days in (None, '') else float(days)
+
+    def __str__(self):
+        return '<RetentionRule>:{0}:{1}:{2}:{3}'.format(
+            self.controller_ip or '*',
+            '*' if self.modbus_id is None else self.modbus_id,
+            self.register_type or '*',
+            'forever' if self.days is None else self.days
+        )
+
+    def key(self):
+        return self.controller_ip, self.modbus_id, self.register_type
@@ -0,0 +1,99 @@
+import datetime
+import sqlite3
+
+from oldsnmpagg import backfill
+from oldsnmpagg.backfill import BulkLoader
+from oldsnmpagg.controllers import Controllers, DEFAULT_ROOT_OID
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.wrappers import Controller, Sensor
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def make_config(db_file):
+    controllers = Controllers(db_file)
+    controllers.add_controller(Controller(DEFAULT_ROOT_OID, '10.0.0.1', 1, 'c1', 502, ''))
+    controllers.add_sensor(Sensor(controller_ip='10.0.0.1', oid=7, oid_name='s1', modbus_id=1, data_type='int'))
+    return Controllers(db_file, read_only=True)
+
+
+def csv_lines(first, count):
+    return ''.join(
+        '{0},10.0.0.1,1,{1}\n'.format((START + datetime.timedelta(minutes=n)).isoformat(), n)
+        for n in range(first, first + count)
+    )
+
+
+def stored_rows(data_file):
+    connection = sqlite3.connect(data_file)
+    lst_rows = connection.execute('SELECT oid, value FROM data ORDER BY date_time').fetchall()
+    connection.close()
+    return lst_rows
+
+
+class FailingDataDB(DataDB):
+    """add_rows отказывает после fail_after удачных пачек (прерванная загрузка)"""
+
+    def __init__(self, data_file, fail_after):
+        super().__init__(data_file)
+        self.fail_after = fail_after
+
+    def add_rows(self, lst_rows, spool_position=None):
+        if self.fail_after <= 0:
+            return False
+        self.fail_after -= 1
+        return super().add_rows(lst_rows, spool_position)
+
+
+def test_resume_after_append(tmp_path):
+    controllers = make_config(str(tmp_path / 'config.db'))
+    data_file = str(tmp_path / 'data.db')
+    path = tmp_path / 'history.csv'
+    path.write_text(csv_lines(0, 1))
+
+    loader = BulkLoader(DataDB(data_file), controllers)
+    assert loader.load(str(path)) == 1
+    with open(path, 'a') as f:
+        f.write(csv_lines(1, 2))
+    assert loader.load(str(path)) == 2
+    assert loader.load(str(path)) == 0
+    assert stored_rows(data_file) == [(7, 0), (7, 1), (7, 2)]
+
+
+def test_resume_after_interruption(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill, 'READ_SIZE', 1)  # по строке за чтение
+    controllers = make_config(str(tmp_path / 'config.db'))
+    data_file = str(tmp_path / 'data.db')
+    path = tmp_path / 'history.csv'
+    path.write_text(csv_lines(0, 5))
+
+    # первая пачка записана, вторая - нет
+    assert BulkLoader(FailingDataDB(data_file, 1), controllers, batch_size=2).load(str(path)) == -1
+    assert stored_rows(data_file) == [(7, 0), (7, 1)]
+    assert BulkLoader(DataDB(data_file), controllers, batch_size=2).load(str(path)) == 3
+    assert BulkLoader(DataDB(data_file), controllers, batch_size=2).load(str(path)) == 0
+    assert stored_rows(data_file) == [(7, n) for n in range(5)]
+
+
+def test_replaced_file_loads_from_start(tmp_path):
+    controllers = make_config(str(tmp_path / 'config.db'))
+    data_file = str(tmp_path / 'data.db')
+    path = tmp_path / 'history.csv'
+    path.write_text(csv_lines(0, 3))
+
+    loader = BulkLoader(DataDB(data_file), controllers)
+    assert loader.load(str(path)) == 3
+    path.write_text(csv_lines(10, 2))  # другой файл по тому же пути, короче прошлой позиции
+    assert loader.load(str(path)) == 2
+    assert stored_rows(data_file) == [(7, 0), (7, 1), (7, 2), (7, 10), (7, 11)]
+
+
+def test_skips_unknown_sensors(tmp_path):
+    controllers = make_config(str(tmp_path / 'config.db'))
+    data_file = str(tmp_path / 'data.db')
+    path = tmp_path / 'history.csv'
+    path.write_text(csv_lines(0, 2) + '{0},10.0.0.9,1,5\nbad line\n'.format(START.isoformat()))
+
+    loader = BulkLoader(DataDB(data_file), controllers)
+    assert loader.load(str(path)) == 2
+    assert loader.skipped == 2
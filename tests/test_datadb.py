@@ -0,0 +1,68 @@
+import sqlite3
+import time
+
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.metrics import MetricsRegistry
+from oldsnmpagg.spool import Spool
+from oldsnmpagg.wrappers import Data, Sensor
+
+RETRY_INTERVAL = 0.2
+
+SENSOR = Sensor(controller_ip='10.0.0.1', oid=1, modbus_id=1)
+
+
+def stored_values(data_file):
+    connection = sqlite3.connect(data_file)
+    lst_values = [row[0] for row in connection.execute('SELECT value FROM data ORDER BY date_time')]
+    connection.close()
+    return lst_values
+
+
+def drop_data_table(data_file):
+    # база "пропала" для открытого соединения: вставка падает с OperationalError
+    connection = sqlite3.connect(data_file)
+    connection.execute('DROP TABLE data')
+    connection.commit()
+    connection.close()
+
+
+def make_data_db(tmp_path):
+    spool = Spool(str(tmp_path / 'spool.bin'), fsync_batch=1)
+    data_db = DataDB(str(tmp_path / 'data.db'), metrics=MetricsRegistry(), spool=spool,
+                     retry_interval=RETRY_INTERVAL)
+    return data_db, spool
+
+
+def test_spools_on_failure_and_replays_after_retry_interval(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    data_db, spool = make_data_db(tmp_path)
+    start = time.time() - 100
+    assert data_db.add_data(Data(SENSOR, 0, start))
+
+    drop_data_table(data_file)
+    assert data_db.add_data(Data(SENSOR, 1, start + 1))  # ушел в спул
+    assert data_db.add_data(Data(SENSOR, 2, start + 2))  # база не трогается до retry_interval
+    assert [sample[3] for _, sample in spool.read()] == [1, 2]
+
+    time.sleep(RETRY_INTERVAL)
+    # переподключение: таблица создается заново, спул переносится перед новым отсчетом
+    assert data_db.add_data(Data(SENSOR, 3, start + 3))
+    assert stored_values(data_file) == [1, 2, 3]
+    assert spool.is_empty()
+    spool.close()
+
+
+def test_bad_sample_does_not_go_offline(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    data_db, spool = make_data_db(tmp_path)
+    start = time.time() - 100
+    assert data_db.add_data(Data(SENSOR, 0, start), autocommit=False)
+
+    assert not data_db.add_data(Data(SENSOR, [1, 2], start + 1), autocommit=False)
+    assert spool.is_empty()
+
+    # база по-прежнему используется, транзакция с прошлым отсчетом жива
+    assert data_db.add_data(Data(SENSOR, 2, start + 2))
+    assert stored_values(data_file) == [0, 2]
+    assert spool.is_empty()
+    spool.close()
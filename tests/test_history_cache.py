@@ -0,0 +1,120 @@
+import datetime
+import time
+
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.historycache import HistoryCache
+from oldsnmpagg.wrappers import Sensor
+
+CACHE_BYTES = 16 * 1024 * 1024
+
+
+def make_sensor(modbus_id):
+    return Sensor(controller_ip='10.0.0.1', oid=modbus_id, modbus_id=modbus_id)
+
+
+def rows_of(sensor, values, start):
+    return [(sensor.controller_ip, sensor.oid, sensor.modbus_id, value, start + n) for n, value in enumerate(values)]
+
+
+def values(lst_data):
+    return [data.value for data in lst_data]
+
+
+def at(unix_time):
+    return datetime.datetime.fromtimestamp(unix_time)
+
+
+def test_closed_range_is_served_from_cache(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    sensor = make_sensor(1)
+    start = int(time.time()) - 3600
+    DataDB(data_file).add_rows(rows_of(sensor, range(10), start))
+
+    cached = DataDB(data_file, cache_bytes=CACHE_BYTES)
+    assert values(cached.get_data(sensor, at(start), at(start + 4), 1)) == [0, 1, 2, 3, 4]
+    assert values(cached.get_data(sensor, at(start), at(start + 4), 2)) == [0, 2, 4]
+    stats = cached.history_cache.stats()
+    assert (stats['misses'], stats['hits']) == (1, 1)
+
+
+def test_refresh_after_write_from_other_connection(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    sensor = make_sensor(1)
+    start = int(time.time()) - 3600
+    writer = DataDB(data_file)
+    writer.add_rows(rows_of(sensor, range(5), start))
+
+    cached = DataDB(data_file, cache_bytes=CACHE_BYTES)
+    date_range = (at(start), at(start + 100))
+    assert values(cached.get_data(sensor, *date_range, 1)) == [0, 1, 2, 3, 4]
+
+    writer.add_rows(rows_of(sensor, [5, 6], start + 5))  # другое соединение (другой процесс)
+    assert values(cached.get_data(sensor, *date_range, 1)) == [0, 1, 2, 3, 4, 5, 6]
+    stats = cached.history_cache.stats()
+    assert (stats['misses'], stats['refreshes']) == (1, 1)
+
+
+def test_refresh_after_write_from_same_connection(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    sensor, other = make_sensor(1), make_sensor(2)
+    start = int(time.time()) - 3600
+    cached = DataDB(data_file, cache_bytes=CACHE_BYTES)
+    cached.add_rows(rows_of(sensor, range(5), start))
+    date_range = (at(start), at(start + 100))
+    assert values(cached.get_data(sensor, *date_range, 1)) == [0, 1, 2, 3, 4]
+
+    cached.add_rows(rows_of(other, [9], start + 1))  # другой сенсор - запись не устаревает
+    assert values(cached.get_data(sensor, *date_range, 1)) == [0, 1, 2, 3, 4]
+    cached.add_rows(rows_of(sensor, [5], start + 5))
+    assert values(cached.get_data(sensor, *date_range, 1)) == [0, 1, 2, 3, 4, 5]
+    assert cached.history_cache.stats()['refreshes'] == 1
+
+
+def test_moving_to_date_reuses_entry(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    sensor = make_sensor(1)
+    now = int(time.time())
+    writer = DataDB(data_file)
+    writer.add_rows(rows_of(sensor, range(5), now - 10))
+    writer.add_rows(rows_of(sensor, [100], now + 30))  # отсчет позже to_date первого обновления
+
+    cached = DataDB(data_file, cache_bytes=CACHE_BYTES)
+    plain = DataDB(data_file)
+    for to_date in (now, now + 5, now + 40):
+        writer.add_rows(rows_of(sensor, [to_date], to_date - 0.5))
+        date_range = (at(now - 10), at(to_date))
+        assert values(cached.get_data(sensor, *date_range, 1)) == values(plain.get_data(sensor, *date_range, 1))
+
+    assert cached.history_cache.stats()['misses'] == 1
+    assert len(cached.history_cache) == 1
+
+
+def test_retention_trims_cached_rows(tmp_path):
+    data_file = str(tmp_path / 'data.db')
+    sensor = make_sensor(1)
+    start = int(time.time()) - 10 * 86400
+    cached = DataDB(data_file, cache_bytes=CACHE_BYTES)
+    cached.add_rows(rows_of(sensor, range(5), start))
+    cached.add_rows(rows_of(sensor, [5], time.time() - 3600))
+    date_range = (at(start), at(time.time() - 60))
+    assert values(cached.get_data(sensor, *date_range, 1)) == [0, 1, 2, 3, 4, 5]
+
+    cached.delete_data_older_than(1)
+    cached.commit()
+    assert values(cached.get_data(sensor, *date_range, 1)) == [5]
+
+    # удаление из другого соединения
+    other = DataDB(data_file)
+    assert other.create_sensor_index()
+    assert other.delete_sensor_data(sensor.controller_ip, sensor.modbus_id, None, time.time()) == 1
+    assert values(cached.get_data(sensor, *date_range, 1)) == []
+
+
+def test_eviction_keeps_within_max_bytes():
+    cache = HistoryCache(max_bytes=4096)
+    for n in range(100):
+        cache.put(('10.0.0.1', n, 0, 1), [(i, 1.0, 0.5) for i in range(10)], 10)
+    assert cache.bytes <= cache.max_bytes
+    assert cache.evictions > 0
+    assert cache.get(('10.0.0.1', 99, 0, 1)) is not None
+    assert cache.get(('10.0.0.1', 0, 0, 1)) is None
@@ -0,0 +1,48 @@
+import struct
+
+import pytest
+
+pytest.importorskip('pymodbus')
+
+from oldsnmpagg.modbusbridge import ModBusBridge  # noqa: E402
+from oldsnmpagg.simulator import ModbusSimulator, SimulatedDevice  # noqa: E402
+from oldsnmpagg.wrappers import Sensor  # noqa: E402
+
+
+class ShortDevice(SimulatedDevice):
+    """Шлюз, который на чтение нескольких регистров отдает на один регистр меньше"""
+
+    def handle(self, unit_id, pdu):
+        response = super().handle(unit_id, pdu)
+        function_code, size = response[0], response[1]
+        if function_code in (3, 4) and size > 2:
+            return struct.pack('>BB', function_code, size - 2) + response[2:-2]
+        return response
+
+
+@pytest.fixture(params=[0, 4], ids=['sync', 'pipelined'])
+def bridge(request):
+    simulator = ModbusSimulator()
+    port = ModbusSimulator.free_port()
+    device = simulator.devices[port] = ShortDevice()
+    for address in range(20):
+        device.set_value('holding_reg', address, address * 10)
+    simulator.start()
+    bridge = ModBusBridge(simulator.host, port, timeout=1, pipeline_window=request.param)
+    yield bridge
+    bridge.close()
+    simulator.stop()
+
+
+def test_short_block_response_falls_back_to_single_reads(bridge):
+    lst_sensors = [
+        Sensor(controller_ip='127.0.0.1', oid=address, modbus_id=address, data_type='int', register_type='holding_reg')
+        for address in range(20)
+    ]
+    # одна попытка - значений блока нет, но и исключения нет
+    assert bridge.get_values(lst_sensors) == {sensor: None for sensor in lst_sensors}
+
+    values = bridge.get_values(lst_sensors, attempt=2)
+    assert {sensor.modbus_id: value for sensor, value in values.items()} == {
+        address: address * 10 for address in range(20)
+    }
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+pytest.importorskip('pymodbus')
+
+from pymodbus.exceptions import ModbusIOException  # noqa: E402
+from pymodbus.register_read_message import ReadHoldingRegistersRequest  # noqa: E402
+
+from oldsnmpagg.modbusbridge import ModBusBridge  # noqa: E402
+from oldsnmpagg.pipeline import PipelinedModbusClient  # noqa: E402
+from oldsnmpagg.simulator import ModbusSimulator  # noqa: E402
+from oldsnmpagg.wrappers import Sensor  # noqa: E402
+
+
+@pytest.fixture
+def simulator():
+    # задержка ответа около таймаута: ответы приходят и до, и после него
+    simulator = ModbusSimulator(latency=0.01, jitter=0.01, drop_rate=0.2, seed=1)
+    port, device = simulator.add_device()
+    for address in range(100):
+        device.set_value('holding_reg', address, address)
+    simulator.start()
+    yield simulator, port
+    simulator.stop()
+
+
+def test_result_is_never_none_on_timeouts(simulator):
+    simulator, port = simulator
+    client = PipelinedModbusClient(simulator.host, port, window=8, timeout=0.01)
+    assert client.connect()
+
+    answered = 0
+    timed_out = 0
+    for _ in range(150):
+        lst_pending = [client.submit(ReadHoldingRegistersRequest(address, 1, unit=1)) for address in range(8)]
+        for address, pending in enumerate(lst_pending):
+            result = pending.result()
+            assert result is not None
+            if isinstance(result, ModbusIOException):
+                timed_out += 1
+            else:
+                assert result.registers == [address]
+                answered += 1
+    client.close()
+    assert answered > 0 and timed_out > 0
+
+
+class SlowDecoder(object):
+    """Разбор ответа дольше таймаута: читающий поток уже снял запрос, а ответ еще не записан"""
+
+    def __init__(self, decoder, delay):
+        self.decoder = decoder
+        self.delay = delay
+
+    def decode(self, pdu):
+        time.sleep(self.delay)
+        return self.decoder.decode(pdu)
+
+
+def test_timeout_while_reader_decodes():
+    simulator = ModbusSimulator()
+    port, device = simulator.add_device()
+    device.set_value('holding_reg', 5, 42)
+    simulator.start()
+    try:
+        client = PipelinedModbusClient(simulator.host, port, timeout=0.02)
+        client._PipelinedModbusClient__decoder = SlowDecoder(client._PipelinedModbusClient__decoder, 0.1)
+        for _ in range(3):
+            result = client.submit(ReadHoldingRegistersRequest(5, 1, unit=1)).result()
+            assert result is not None and result.registers == [42]
+        client.close()
+    finally:
+        simulator.stop()
+
+
+def test_get_values_survives_timeouts(simulator):
+    simulator, port = simulator
+    bridge = ModBusBridge(simulator.host, port, timeout=0.01, pipeline_window=4)
+    lst_sensors = [
+        Sensor(controller_ip=simulator.host, oid=address, modbus_id=address, data_type='int',
+               register_type='holding_reg')
+        for address in range(0, 100, 3)
+    ]
+    for _ in range(20):
+        values = bridge.get_values(lst_sensors, attempt=1)
+        assert set(values) == set(lst_sensors)
+        for sensor, value in values.items():
+            assert value is None or value == sensor.modbus_id
+    bridge.close()
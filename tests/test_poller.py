@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+import pytest
+
+pytest.importorskip('pymodbus')
+
+from oldsnmpagg.controllers import Controllers, DEFAULT_ROOT_OID  # noqa: E402
+from oldsnmpagg.metrics import MetricsRegistry  # noqa: E402
+from oldsnmpagg.poller import ShardedPoller  # noqa: E402
+from oldsnmpagg.simulator import ModbusSimulator  # noqa: E402
+from oldsnmpagg.wrappers import Controller, Sensor  # noqa: E402
+
+
+def rows_per_sensor(data_file):
+    connection = sqlite3.connect(data_file)
+    rows = dict(connection.execute('SELECT modbus_id, COUNT(*) FROM data GROUP BY modbus_id'))
+    connection.close()
+    return rows
+
+
+def test_writer_applies_deadband(tmp_path):
+    db_file = str(tmp_path / 'config.db')
+    data_file = str(tmp_path / 'data.db')
+    controllers = Controllers(db_file)
+    controllers.add_controller(Controller(DEFAULT_ROOT_OID, '10.0.0.1', 1, 'c1', 502, ''))
+    for modbus_id in range(1, 6):
+        controllers.add_sensor(Sensor(controller_ip='10.0.0.1', oid=modbus_id, oid_name='s{0}'.format(modbus_id),
+                                      modbus_id=modbus_id, data_type='int', register_type='holding_reg'))
+
+    simulator = ModbusSimulator.from_controllers(controllers, seed=1)
+    simulator.start()
+    address_map = {ip: (simulator.host, port) for ip, port in simulator.ports.items()}
+    poller = ShardedPoller(db_file, data_file, workers=1, interval=0.05, address_map=address_map,
+                           metrics=MetricsRegistry()).start()
+    try:
+        deadline = time.time() + 20
+        while poller.polled < 50 and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        poller.stop()
+        simulator.stop()
+
+    # значения симулятора не меняются - в историю попадает только первое
+    assert poller.polled >= 50
+    assert poller.samples == 5
+    assert rows_per_sensor(data_file) == {modbus_id: 1 for modbus_id in range(1, 6)}
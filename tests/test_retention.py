@@ -0,0 +1,123 @@
+import sqlite3
+import time
+
+from oldsnmpagg.controllers import Controllers, DEFAULT_ROOT_OID
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.metrics import MetricsRegistry
+from oldsnmpagg.retention import RetentionJob, DAY, index_rules, retention_days
+from oldsnmpagg.wrappers import Controller, RetentionRule, Sensor
+
+DAYS = 60
+SENSORS = [
+    ('10.0.0.1', 1, 'input'),
+    ('10.0.0.1', 2, 'discrete'),
+    ('10.0.0.1', 3, 'holding_reg'),
+    ('10.0.0.2', 1, 'input'),
+]
+RULES = [
+    RetentionRule(days=30),
+    RetentionRule(register_type='input', days=7),
+    RetentionRule('10.0.0.2', 1, days=None),
+]
+
+
+def make_config(db_file):
+    controllers = Controllers(db_file)
+    for ip in sorted(set(sensor[0] for sensor in SENSORS)):
+        controllers.add_controller(Controller(DEFAULT_ROOT_OID, ip, 1, ip, 502, ''))
+    for ip, modbus_id, register_type in SENSORS:
+        controllers.add_sensor(Sensor(controller_ip=ip, oid=modbus_id, oid_name='s{0}'.format(modbus_id),
+                                      modbus_id=modbus_id, data_type='int', register_type=register_type))
+    for rule in RULES:
+        controllers.set_retention_rule(rule)
+    return controllers
+
+
+def fill(data_file, now):
+    DataDB(data_file).add_rows([
+        (ip, modbus_id, modbus_id, day, now - day * DAY)
+        for ip, modbus_id, _ in SENSORS
+        for day in range(DAYS)
+    ])
+
+
+def days_left(data_file, ip, modbus_id, now):
+    connection = sqlite3.connect(data_file)
+    lst_dates = [row[0] for row in connection.execute(
+        'SELECT date_time FROM data WHERE controller_ip = ? AND modbus_id = ?', (ip, modbus_id))]
+    connection.close()
+    return sorted(round((now - date_time) / DAY) for date_time in lst_dates)
+
+
+def test_most_specific_rule_wins():
+    st_rules = index_rules(RULES + [RetentionRule('10.0.0.1', days=90)])
+    assert retention_days(st_rules, Sensor(controller_ip='10.0.0.2', modbus_id='1', register_type='input')) is None
+    assert retention_days(st_rules, Sensor(controller_ip='10.0.0.2', modbus_id=5, register_type='input')) == 7
+    assert retention_days(st_rules, Sensor(controller_ip='10.0.0.3', modbus_id=5, register_type='coil')) == 30
+    assert retention_days(st_rules, Sensor(controller_ip='10.0.0.1', modbus_id=5, register_type='input')) == 90
+    assert retention_days({}, Sensor(controller_ip='10.0.0.1')) is None
+
+
+def test_run_once_applies_rules_incrementally(tmp_path):
+    db_file = str(tmp_path / 'config.db')
+    data_file = str(tmp_path / 'data.db')
+    make_config(db_file)
+    now = time.time()
+    fill(data_file, now)
+
+    job = RetentionJob(db_file, data_file, batch_size=10, pause=0, metrics=MetricsRegistry())
+    assert job.run_once(now) == (DAYS - 7) + (DAYS - 30) * 2
+    assert days_left(data_file, '10.0.0.1', 1, now) == list(range(7))
+    assert days_left(data_file, '10.0.0.1', 2, now) == list(range(30))
+    assert days_left(data_file, '10.0.0.1', 3, now) == list(range(30))
+    assert days_left(data_file, '10.0.0.2', 1, now) == list(range(DAYS))
+
+    # срок не сдвинулся за отметки - ничего не удаляется
+    assert job.run_once(now) == 0
+
+    # через сутки - только вновь устаревшее, по одной строке на сенсор с правилом
+    assert job.run_once(now + DAY) == 3
+    assert days_left(data_file, '10.0.0.1', 1, now) == list(range(6))
+    assert days_left(data_file, '10.0.0.1', 2, now) == list(range(29))
+    assert days_left(data_file, '10.0.0.2', 1, now) == list(range(DAYS))
+
+    watermarks = DataDB(data_file).get_retention_watermarks()
+    assert watermarks[('10.0.0.1', 1)] == now + DAY - 7 * DAY
+    assert ('10.0.0.2', 1) not in watermarks
+
+
+def test_late_rows_below_watermark_are_deleted(tmp_path):
+    db_file = str(tmp_path / 'config.db')
+    data_file = str(tmp_path / 'data.db')
+    make_config(db_file)
+    now = time.time()
+    fill(data_file, now)
+    job = RetentionJob(db_file, data_file, batch_size=10, pause=0, metrics=MetricsRegistry())
+    assert job.run_once(now) > 0
+
+    # опоздавшие отсчеты старше срока (спул, массовая загрузка) - ниже отметки
+    data_db = DataDB(data_file)
+    data_db.add_rows([('10.0.0.1', 1, 1, 'late', now - 20 * DAY), ('10.0.0.1', 2, 2, 'late', now - 40 * DAY)])
+    assert ('10.0.0.1', 1) not in data_db.get_retention_watermarks()
+
+    assert job.run_once(now) == 2
+    assert days_left(data_file, '10.0.0.1', 1, now) == list(range(7))
+    assert days_left(data_file, '10.0.0.1', 2, now) == list(range(30))
+    assert job.run_once(now) == 0
+
+    # отсчет новее отметки отметку не трогает
+    data_db.add_rows([('10.0.0.1', 1, 1, 'fresh', now)])
+    assert ('10.0.0.1', 1) in data_db.get_retention_watermarks()
+
+
+def test_run_once_without_rules(tmp_path):
+    db_file = str(tmp_path / 'config.db')
+    data_file = str(tmp_path / 'data.db')
+    controllers = make_config(db_file)
+    for rule in RULES:
+        controllers.del_retention_rule(rule)
+    now = time.time()
+    fill(data_file, now)
+
+    assert RetentionJob(db_file, data_file, metrics=MetricsRegistry()).run_once(now) == 0
+    assert len(days_left(data_file, '10.0.0.1', 1, now)) == DAYS
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import pytest
+
+from oldsnmpagg.shmtable import SharedValueTable, FLAG_NO_DATA, FLAG_OFFLINE, FLAG_READ_ERROR
+
+WRITES = 200000
+KEY = ('10.0.0.1', 1)
+
+
+@pytest.fixture
+def name():
+    name = 'test_svt_{0}'.format(os.getpid())
+    yield name
+    try:
+        shared_memory.SharedMemory(name=name).unlink()  # тест упал до unlink()
+    except FileNotFoundError:
+        pass
+
+
+def write_values(name, ready):
+    table = SharedValueTable.attach(name, readonly=False)
+    ready.wait()
+    for n in range(1, WRITES + 1):
+        # значение, время и флаги одного отсчета всегда совпадают
+        table.set(*KEY, float(n), float(n), n & 0xff)
+    table.close()
+
+
+def read_values(name, ready, results):
+    table = SharedValueTable.attach(name)
+    ready.set()
+    reads = torn = 0
+    last = 0
+    while last < WRITES:
+        value, date_time, flags = table.get(*KEY)
+        reads += 1
+        if value is None:
+            continue
+        if value != date_time or flags != int(value) & 0xff or value < last:
+            torn += 1
+        last = value
+    table.close()
+    results.put((reads, torn))
+
+
+def test_no_torn_reads_between_processes(name):
+    table = SharedValueTable.create(name, keys=[KEY])
+    context = multiprocessing.get_context('fork')
+    ready = context.Event()
+    results = context.Queue()
+    reader = context.Process(target=read_values, args=(name, ready, results))
+    writer = context.Process(target=write_values, args=(name, ready))
+    reader.start()
+    writer.start()
+    writer.join(60)
+    reads, torn = results.get(timeout=60)
+    reader.join(60)
+    table.close()
+    table.unlink()
+
+    assert writer.exitcode == 0 and reader.exitcode == 0
+    assert reads > 0
+    assert torn == 0
+
+
+def test_attach_is_read_only(name):
+    table = SharedValueTable.create(name, keys=[KEY])
+    table.set(*KEY, 21.5, 1000.0)
+
+    reader = SharedValueTable.attach(name)
+    assert reader.get(*KEY) == (21.5, 1000.0, 0)
+    with pytest.raises(TypeError):
+        reader.set(*KEY, 1.0)
+    assert table.get(*KEY) == (21.5, 1000.0, 0)
+
+    # новый ключ создателя виден подключившемуся
+    table.add(('10.0.0.2', 5))
+    assert reader.get('10.0.0.2', 5) == (None, 0.0, FLAG_NO_DATA)
+    reader.close()
+    table.close()
+    table.unlink()
+
+
+def test_create_replaces_existing_table(name):
+    old = SharedValueTable.create(name, keys=[KEY])
+    old.set(*KEY, 1.0)
+    old.close()  # создатель упал, не удалив таблицу
+
+    table = SharedValueTable.create(name, keys=[('10.0.0.2', 2)], capacity=4)
+    reader = SharedValueTable.attach(name)
+    assert reader.capacity == 4
+    assert reader.keys() == [('10.0.0.2', 2)]
+    assert reader.get(*KEY) is None
+    reader.close()
+    table.close()
+    table.unlink()
+
+
+def test_full_table(name):
+    table = SharedValueTable.create(name, keys=[KEY, ('10.0.0.1', 2)], capacity=2)
+    assert table.add(KEY)  # уже есть
+    assert not table.add(('10.0.0.1', 3))
+    assert not table.set('10.0.0.1', 3, 1.0)
+    assert table.get('10.0.0.1', 3) is None
+    assert len(table) == 2
+    table.close()
+    table.unlink()
+
+
+def test_set_flags_keeps_last_value(name):
+    table = SharedValueTable.create(name, keys=[KEY, ('10.0.0.1', 2)])
+    table.set(*KEY, 21.5, 1000.0)
+    assert table.set_flags(*KEY, FLAG_READ_ERROR)
+    assert table.get(*KEY) == (21.5, 1000.0, FLAG_READ_ERROR)
+    assert table.set_flags(*KEY, FLAG_OFFLINE)
+    assert table.get(*KEY) == (21.5, 1000.0, FLAG_OFFLINE)
+
+    # значения еще не было - FLAG_NO_DATA остается
+    assert table.set_flags('10.0.0.1', 2, FLAG_OFFLINE)
+    assert table.get('10.0.0.1', 2) == (None, 0.0, FLAG_NO_DATA | FLAG_OFFLINE)
+    assert not table.set_flags('10.0.0.1', 3, FLAG_OFFLINE)
+    table.close()
+    table.unlink()
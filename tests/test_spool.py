@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+
+from oldsnmpagg.datadb import DataDB
+from oldsnmpagg.spool import Spool, HEADER_SIZE
+
+
+def count_rows(data_file):
+    connection = sqlite3.connect(data_file)
+    count = connection.execute('SELECT COUNT(*) FROM data').fetchone()[0]
+    connection.close()
+    return count
+
+
+def fill_spool(path, count, start=1000.0):
+    spool = Spool(path, fsync_batch=1)
+    for n in range(count):
+        spool.append_sample('10.0.0.1', n, n % 10, n * 1.5, start + n)
+    spool.close()
+
+
+def test_read_round_trip(tmp_path):
+    path = str(tmp_path / 'spool.bin')
+    spool = Spool(path)
+    for value in (None, True, 7, 2.5, 'text', b'\x00\x01'):
+        spool.append_sample('10.0.0.1', 1, 2, value, 1000.0)
+
+    assert [sample[3] for _, sample in spool.read()] == [None, True, 7, 2.5, 'text', b'\x00\x01']
+    assert list(spool.read())[0][1] == ('10.0.0.1', 1, 2, None, 1000.0)
+    spool.close()
+
+
+def test_truncated_final_record_is_dropped(tmp_path):
+    path = str(tmp_path / 'spool.bin')
+    fill_spool(path, 3)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)  # падение посреди записи последнего отсчета
+
+    spool = Spool(path)
+    assert [sample[1] for _, sample in spool.read()] == [0, 1]
+    assert os.path.getsize(path) == HEADER_SIZE + spool.size()  # хвост обрезан при открытии
+
+    # новые записи идут сразу за последней целой, а не за оборванной
+    spool.append_sample('10.0.0.1', 9, 9, 1.0, 2000.0)
+    assert [sample[1] for _, sample in spool.read()] == [0, 1, 9]
+
+    data_file = str(tmp_path / 'data.db')
+    assert spool.replay(DataDB(data_file)) == 3
+    assert count_rows(data_file) == 3
+    assert spool.is_empty()
+    spool.close()
+
+
+def test_corrupted_record_stops_read(tmp_path):
+    path = str(tmp_path / 'spool.bin')
+    fill_spool(path, 3)
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xff]))  # неверный crc последней записи
+
+    spool = Spool(path)
+    assert len(list(spool.read())) == 2
+    spool.close()
+
+
+def test_replay_twice_does_not_duplicate(tmp_path):
+    path = str(tmp_path / 'spool.bin')
+    data_file = str(tmp_path / 'data.db')
+    fill_spool(path, 25)
+    shutil.copy(path, path + '.copy')
+
+    spool = Spool(path)
+    assert spool.replay(DataDB(data_file), batch=10) == 25
+    assert spool.replay(DataDB(data_file), batch=10) == 0
+    spool.close()
+    assert count_rows(data_file) == 25
+
+    # падение после переноса, но до очистки спула: файл тот же, позиция уже в базе
+    shutil.copy(path + '.copy', path)
+    spool = Spool(path)
+    assert spool.replay(DataDB(data_file), batch=10) == 0
+    spool.close()
+    assert count_rows(data_file) == 25
+
+
+def test_replay_resumes_after_partial_replay(tmp_path):
+    path = str(tmp_path / 'spool.bin')
+    data_file = str(tmp_path / 'data.db')
+    fill_spool(path, 25)
+
+    # первые 10 отсчетов перенесены в одной транзакции с позицией, затем падение
+    spool = Spool(path)
+    lst_read = list(spool.read())
+    rows = [sample for _, sample in lst_read[:10]]
+    assert DataDB(data_file).add_rows(rows, spool_position=(path, spool.generation, lst_read[9][0]))
+
+    assert spool.replay(DataDB(data_file), batch=10) == 15
+    spool.close()
+    assert count_rows(data_file) == 25